@@ -1,44 +1,25 @@
-import xml.etree.ElementTree as ET
-import requests
-import time
+import asyncio
+import sys
 import json
 import logging
 import os
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import Iterator, List, Dict
 from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
-from urllib.parse import urlparse
 from typing import Optional, Tuple
-import threading
-from collections import deque
 from concurrent.futures import as_completed
+from bl_limiter import create_limiter
+from bl_client import BaseLinkerClient, HttpTransport, PermanentError
+from bl_metadata import MetadataCache
+from bl_feed import FeedError, decode_numbers, fingerprint
+from bl_snapshot import FeedStage
+from bl_records import ProductRecord
+from bl_sku_store import open_sku_store
+from bl_sku_index import refresh_index
+from bl_registry import ProductRegistry
 
 
-class RateLimiter:
-    def __init__(self, per_minute: int):
-        self.per_minute = per_minute
-        self.lock = threading.Lock()
-        self.calls = deque()
-
-    def wait(self):
-        now = time.monotonic()
-        with self.lock:
-            # usuń stare wpisy >60s
-            while self.calls and now - self.calls[0] >= 60:
-                self.calls.popleft()
-
-            if len(self.calls) >= self.per_minute:
-                sleep_for = 60 - (now - self.calls[0])
-            else:
-                sleep_for = 0
-
-        if sleep_for > 0:
-            time.sleep(sleep_for)
-
-        with self.lock:
-            self.calls.append(time.monotonic())
-
 load_dotenv()
 
 # Konfiguracja
@@ -50,11 +31,16 @@ PRICE_GROUP_ID = os.environ.get('PRICE_GROUP_ID')  # ID grupy cenowej CZK (API D
 REQUESTS_PER_MINUTE = int(os.environ.get('REQUESTS_PER_MINUTE', 80))  # Limit dla dodawania produktów
 MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 5))  # Liczba równoległych wątków
 BATCH_SIZE = REQUESTS_PER_MINUTE  # Partia produktów na minutę
-BATCH_INTERVAL = 60  # Odstęp między partiami (60 sekund)
 DEFAULT_TAX = 21  # Domyślny VAT (23%)
-SKU_TO_ID_FILE = "sku_to_id.json"  # Plik do przechowywania mapowania SKU -> product_id
+METRICS_FILE = "add_products.metrics.json"  # Podsumowanie wywołań API z przebiegu (obok logu)
 XML_URL = os.environ.get('XML_URL')  # URL do pliku XML
-PAUSE_DURATION = 360  # 6 minut w sekundach
+PAUSE_DURATION = 360  # 6 minut w sekundach (gdy nie da się odczytać czasu blokady)
+MAX_BLOCK_RETRIES = 5  # Ile razy ponowić zapytanie po blokadzie tokena
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 4))  # Ponowienia po błędach sieci / 5xx (z losowym backoffem)
+USE_ASYNC = "--async" in sys.argv or os.environ.get('USE_ASYNC', '0') == '1'  # Tryb asyncio zamiast wątków
+ASYNC_CONCURRENCY = int(os.environ.get('ASYNC_CONCURRENCY', 200))  # Liczba zapytań w locie w trybie asyncio
+RATE_BURST = int(os.environ.get('RATE_BURST', 1))  # Ile zapytań można wysłać od razu po bezczynności
+RATE_SHARE = float(os.environ.get('RATE_SHARE_ADD', 1.0))  # Udział tego joba we wspólnym budżecie tokena (0-1]
 
 # Konfiguracja logowania
 logging.basicConfig(
@@ -65,76 +51,77 @@ logging.basicConfig(
 
 # Globalna zmienna do przechowywania bazy SKU-to-ID w pamięci
 sku_to_id_cache = {}
+feed_errors = []  # produkty pominięte przez złe wartości liczbowe w feedzie
 
 SAFE_RPM = int(REQUESTS_PER_MINUTE * 0.95)  # np. 475 przy 500
-limiter = RateLimiter(SAFE_RPM)
-
-
-thread_local = threading.local()
+limiter = create_limiter(SAFE_RPM, API_TOKEN, burst=RATE_BURST, share=RATE_SHARE)
 
-def get_session():
-    if not hasattr(thread_local, "session"):
-        s = requests.Session()
-        thread_local.session = s
-    return thread_local.session
+client = BaseLinkerClient(API_URL, API_TOKEN, limiter, transport=HttpTransport(pool_size=MAX_WORKERS),
+                          max_retries=MAX_RETRIES,
+                          pause_fallback=PAUSE_DURATION, max_block_retries=MAX_BLOCK_RETRIES)
+metadata = MetadataCache(client, API_TOKEN)
+feed = FeedStage(XML_URL or "", "add_products")  # pobieranie warunkowe + wspólny snapshot + pomijanie niezmienionego feedu
+sku_store = open_sku_store()  # SKU -> product_id (SQLite albo JSON + dziennik, SKU_STORE_BACKEND)
+registry = ProductRegistry()  # SKU / product_id / ERP ID / EAN – nowe produkty trafiają tam od razu
 
 
 def load_sku_to_id() -> Dict[str, str]:
-    """Ładuje mapowanie SKU -> product_id z pliku JSON."""
+    """Ładuje mapowanie SKU -> product_id z bazy SKU (bl_sku_store)."""
     global sku_to_id_cache
-    if os.path.exists(SKU_TO_ID_FILE):
-        try:
-            with open(SKU_TO_ID_FILE, "r", encoding="utf-8") as f:
-                sku_to_id_cache = json.load(f)
-            logging.info(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-            print(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-        except Exception as e:
-            logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            sku_to_id_cache = {}
+    try:
+        sku_to_id_cache = sku_store.load()
+        logging.info(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+        print(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+    except Exception as e:
+        logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
+        print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
+        sku_to_id_cache = {}
     return sku_to_id_cache
 
 
-def save_sku_to_id():
+def save_sku_to_id(sku: str, product_id: str, product: Optional[ProductRecord] = None):
+    """Zapisuje nowe SKU od razu po udanym addProduct – jeden upsert zamiast przepisywania całej mapy."""
+    sku_to_id_cache[sku] = product_id
     try:
-        tmp_path = SKU_TO_ID_FILE + ".tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(sku_to_id_cache, f, ensure_ascii=False)  # <-- bez indent
-        os.replace(tmp_path, SKU_TO_ID_FILE)
-        logging.info(f"Zapisano bazę SKU-to-ID do pliku: {len(sku_to_id_cache)} rekordów.")
-        print(f"Zapisano bazę SKU-to-ID do pliku: {len(sku_to_id_cache)} rekordów.")
+        sku_store.put(sku, product_id)
+        if product is not None:
+            registry.record_product(sku, product_id, product["erp_id"], product["ean"])
     except Exception as e:
-        logging.error(f"Błąd podczas zapisywania bazy SKU-to-ID: {str(e)}")
-        print(f"Błąd podczas zapisywania bazy SKU-to-ID: {str(e)}")
+        logging.error(f"Błąd podczas zapisywania SKU {sku} do bazy SKU-to-ID: {str(e)}")
+        print(f"Błąd podczas zapisywania SKU {sku} do bazy SKU-to-ID: {str(e)}")
 
 
+def save_skus(saved: List[Tuple[str, str, ProductRecord]]):
+    """Jak save_sku_to_id() dla partii (sku, product_id, produkt) – jeden zapis bazy SKU i rejestru.
+
+    Mapa w pamięci (`sku_to_id_cache`) jest aktualizowana przez wołającego; tu tylko zapis na dysk,
+    więc wersja asyncio woła to w wątku, poza pętlą zdarzeń.
+    """
+    try:
+        sku_store.put_many((sku, product_id) for sku, product_id, _ in saved)
+        registry.record_products((sku, product_id, product["erp_id"], product["ean"]) for sku, product_id, product in saved)
+    except Exception as e:
+        logging.error(f"Błąd podczas zapisywania {len(saved)} SKU do bazy SKU-to-ID: {str(e)}")
+        print(f"Błąd podczas zapisywania {len(saved)} SKU do bazy SKU-to-ID: {str(e)}")
+
 
 def get_valid_storage_id() -> str:
     """Pobiera listę magazynów i sprawdza poprawność INVENTORY_ID."""
-    headers = {"X-BLToken": API_TOKEN}
-    params = {
-        "method": "getStoragesList",
-        "parameters": json.dumps({})
-    }
-    
     try:
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") != "SUCCESS":
-            logging.error(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            print(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            return None
-        
-        storages = response_data.get("storages", [])
-        for storage in storages:
-            if storage.get("storage_id") == INVENTORY_ID:
-                print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                return INVENTORY_ID
+        storage = metadata.find_storage(INVENTORY_ID)  # z cache metadanych (TTL), bez zapytania przy każdym starcie
+        if storage:
+            print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            return INVENTORY_ID
         
+        storages = metadata.storages()
         logging.error(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         print(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         return None
+    except PermanentError as e:
+        logging.error(f"Błąd pobierania listy magazynów: {str(e)}")
+        print(f"Błąd pobierania listy magazynów: {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas pobierania listy magazynów: {str(e)}")
         print(f"Błąd podczas pobierania listy magazynów: {str(e)}")
@@ -142,138 +129,104 @@ def get_valid_storage_id() -> str:
 
 def create_category_if_needed(inventory_id: str) -> str:
     """Tworzy kategorię, jeśli nie istnieje, i zwraca jej ID."""
-    headers = {"X-BLToken": API_TOKEN}
-    params = {
-        "method": "getProductCatalogCategories",
-        "parameters": json.dumps({"storage_id": INVENTORY_ID, "inventory_id": inventory_id})
-    }
-    
     try:
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") == "SUCCESS" and response_data.get("categories"):
-            category_id = str(response_data["categories"][0]["category_id"])
+        categories = metadata.categories(INVENTORY_ID, inventory_id)
+        if categories:
+            category_id = str(categories[0]["category_id"])
             print(f"Znaleziono istniejącą kategorię: ID {category_id}")
             logging.info(f"Znaleziono istniejącą kategorię: ID {category_id}")
             return category_id
         
-        params = {
-            "method": "addProductCatalogCategory",
-            "parameters": json.dumps({
+        try:
+            response_data = client.call("addProductCatalogCategory", {
                 "storage_id": INVENTORY_ID,
                 "inventory_id": inventory_id,
                 "parent_category_id": "0",
                 "name": "Default Category",
                 "description": "Domyślna kategoria dla API Durczok CZK"
-            }, ensure_ascii=False)
-        }
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") == "SUCCESS":
-            category_id = str(response_data.get("category_id"))
-            print(f"Utworzono nową kategorię: ID {category_id}")
-            logging.info(f"Utworzono nową kategorię: ID {category_id}")
-            return category_id
-        else:
+            })
+        except PermanentError:
             logging.warning("Nie udało się utworzyć kategorii, użyto category_id=0.")
             print("Nie udało się utworzyć kategorii, użyto category_id=0.")
             return "0"
+        metadata.invalidate_categories(INVENTORY_ID, inventory_id)
+        category_id = str(response_data.get("category_id"))
+        print(f"Utworzono nową kategorię: ID {category_id}")
+        logging.info(f"Utworzono nową kategorię: ID {category_id}")
+        return category_id
     except Exception as e:
         logging.error(f"Błąd podczas pobierania/utworzenia kategorii: {str(e)}")
         print(f"Błąd podczas pobierania/utworzenia kategorii: {str(e)}")
         return "0"
 
-def fetch_and_parse_xml() -> List[Dict]:
-    """Pobiera i parsuje plik XML z podanego URL lub ścieżki lokalnej (ceny w CZK), formatując nazwę w formacie g:mpn g:brand title."""
-    products = []
-    try:
-        if XML_URL.startswith("file://"):
-            # Lokalny plik
-            parsed = urlparse(XML_URL)
-            file_path = parsed.path
-            if os.name == 'nt' and file_path.startswith('/'):
-                file_path = file_path[1:]  # Usuń początkowy / dla Windows
-            with open(file_path, "r", encoding="utf-8") as f:
-                xml_content = f.read()
-        else:
-            # URL
-            response = requests.get(XML_URL)
-            response.raise_for_status()
-            xml_content = response.content.decode('utf-8')
-            xml_content = xml_content.lstrip('\ufeff')  # Usuń BOM jeśli występuje
+def description_at(pos: int) -> Optional[str]:
+    """Opis (g:description) produktu z pozycji `pos` feedu – czytany ze snapshotu dopiero w addProduct."""
+    return feed.value(pos, "g_description")
+
+
+def iter_xml_products() -> Iterator[ProductRecord]:
+    """Strumieniowo czyta plik XML z podanego URL lub ścieżki lokalnej (ceny w CZK), formatując nazwę w formacie g:mpn g:brand title.
+
+    Zwraca produkty po jednym (stała pamięć); błąd pobierania/parsowania to FeedError.
+    Niezmieniony feed jest czytany ze wspólnego snapshotu (bez ponownego parsowania XML).
+    Opis nie jest trzymany w rekordzie – ProductRecord doczytuje go przy pierwszym użyciu.
+    """
+    for pos, row in enumerate(feed.iter_rows()):
+        # Parsowanie MPN (używany jako SKU)
+        mpn = (row["mpn"] or "Unknown-MPN").strip()
         
-        root = ET.fromstring(xml_content)
-        namespace = {"g": "http://base.google.com/ns/1.0"}
+        # Cena i stan - zła wartość pomija tylko ten produkt, nie cały feed
+        numbers, errors = decode_numbers(row)
+        if errors:
+            feed_errors.append({"sku": mpn, "errors": errors})
+            logging.warning(f"Pominięto SKU {mpn}: nieprawidłowe wartości w feedzie {', '.join(errors)}")
+            continue
+        price_czk = numbers["price"]
+        quantity = numbers["availability"]
         
-        for item in root.findall(".//item"):
-            # Parsowanie ceny
-            price_czk = float(item.find("g:price", namespace).text) if item.find("g:price", namespace) is not None else 0.0
-            
-            # Parsowanie MPN (używany jako SKU)
-            mpn_el = item.find("g:mpn", namespace)
-            mpn = (mpn_el.text or "Unknown-MPN").strip() if mpn_el is not None else "Unknown-MPN"
-            
-            # Parsowanie marki
-            brand_el = item.find("g:brand", namespace)
-            brand = (brand_el.text or "Unknown-Brand").strip() if brand_el is not None else "Unknown-Brand"
-            
-            # Parsowanie tytułu - najpierw <title>, jeśli pusty to <description>
-            title_elem = item.find("title")
-            title = (title_elem.text if title_elem is not None and title_elem.text else "").strip()
-            if not title:
-                desc_elem = item.find("description")
-                title = (desc_elem.text if desc_elem is not None and desc_elem.text else "Unknown-Title").strip()
-            
-            # Parsowanie zdjęcia
-            img_elem = item.find("g:image_link", namespace)
-            image_link = img_elem.text.strip() if img_elem is not None and img_elem.text else ""
-            
-            # Parsowanie dostępności (stan magazynu) - zawsze jest liczbą
-            quantity = int(item.find("g:availability", namespace).text) if item.find("g:availability", namespace) is not None else 0
-            
-            # Parsowanie GTIN - zawsze pojedynczy numer
-            gtin_el = item.find("g:gtin", namespace)
-            ean = (gtin_el.text or "").strip() if gtin_el is not None else ""
-            
-            # Parsowanie kategorii z NX_StockCategory
-            nx_stock_category = (item.find("NX_StockCategory").text if item.find("NX_StockCategory") is not None else "").strip()
-            category = nx_stock_category if nx_stock_category else item.find("g:product_type", namespace).text if item.find("g:product_type", namespace) is not None else ""
-            
-            # Parsowanie ERP ID z g:id (wewnętrzne ID z ERP) - MUSI być z namespace!
-            erp_id = (item.find("g:id", namespace).text if item.find("g:id", namespace) is not None else "").strip()
-            
-            # Formatowanie nazwy w formacie: g:mpn g:title (bez duplikatu marki, bo marka już jest w MPN)
-            formatted_name = f"{mpn} {title}".strip()
-            
-            
-            product = {
-                "sku": mpn,
-                "name": formatted_name,  # Formatowana nazwa bez duplikatu marki
-                "quantity": quantity,
-                "price_brutto": round(price_czk, 2),
-                "ean": ean,
-                "man_name": brand,
-                "description": item.find("g:description", namespace).text if item.find("g:description", namespace) is not None else "",
-                "category": category,
-                "image_link": image_link,
-                "erp_id": erp_id
-            }
-            
-            products.append(product)
-
-        return products
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Błąd podczas pobierania XML z URL {XML_URL}: {str(e)}")
-        print(f"Błąd podczas pobierania XML z URL {XML_URL}: {str(e)}")
-        return []
-    except ET.ParseError as e:
-        logging.error(f"Błąd podczas parsowania XML: {str(e)}")
-        print(f"Błąd podczas parsowania XML: {str(e)}")
-        return []
+        # Parsowanie marki
+        brand = (row["brand"] or "Unknown-Brand").strip()
+        
+        # Parsowanie tytułu - najpierw <title>, jeśli pusty to <description>
+        title = (row["title"] or "").strip()
+        if not title:
+            title = (row["description"] or "Unknown-Title").strip()
+        
+        # Parsowanie zdjęcia
+        image_link = (row["image_link"] or "").strip()
+        
+        # Parsowanie GTIN - zawsze pojedynczy numer
+        ean = (row["gtin"] or "").strip()
+        
+        # Parsowanie kategorii z NX_StockCategory
+        nx_stock_category = (row["stock_category"] or "").strip()
+        category = nx_stock_category if nx_stock_category else row["product_type"] or ""
+        
+        # Parsowanie ERP ID z g:id (wewnętrzne ID z ERP)
+        erp_id = (row["erp_id"] or "").strip()
+        
+        # Formatowanie nazwy w formacie: g:mpn g:title (bez duplikatu marki, bo marka już jest w MPN)
+        formatted_name = f"{mpn} {title}".strip()
+        
+        
+        product = ProductRecord(
+            sku=mpn,
+            name=formatted_name,  # Formatowana nazwa bez duplikatu marki
+            quantity=quantity,
+            price_brutto=round(price_czk, 2),
+            ean=ean,
+            man_name=brand,
+            category=category,
+            image_link=image_link,
+            erp_id=erp_id,
+            description_source=description_at,
+            pos=pos,
+        )
+        
+        yield product
 
-def add_product_to_baselinker(product: Dict, storage_id: str, category_id: str, inventory_id: str) -> Optional[Tuple[str, str]]:
-    """Wysyła pojedynczy nowy produkt do BaseLinker przez Storage API (ceny w CZK)."""
-    headers = {"X-BLToken": API_TOKEN}
+def build_add_product(product: Dict, storage_id: str, category_id: str) -> Dict:
+    """Buduje parametry addProduct dla nowego produktu (ceny w CZK)."""
     price_brutto_czk = product["price_brutto"]
     price_wholesale_netto_czk = price_brutto_czk / (1 + DEFAULT_TAX / 100)
     
@@ -304,86 +257,126 @@ def add_product_to_baselinker(product: Dict, storage_id: str, category_id: str,
             formatted_product["extra_fields"] = {"9157": erp_id_int}
         except ValueError:
             logging.warning(f"ERP_ID '{erp_id}' nie jest liczbą dla SKU {product['sku']}")
-    
 
-    params = {
-        "method": "addProduct",
-        "parameters": json.dumps(formatted_product, ensure_ascii=False)
-    }
-    
-    try:
-        limiter.wait()
-        session = get_session()
-        response = session.post(API_URL, headers=headers, data=params, timeout=60)
+    return formatted_product
 
-        response_data = response.json()
-        
 
-        
-        if response_data.get("status") != "SUCCESS":
-            error_message = response_data.get("error_message", "Brak szczegółów błędu")
-            logging.error(f"Błąd API (addProduct) dla SKU {product['sku']}: {error_message}")
-            print(f"Błąd API (addProduct) dla SKU {product['sku']}: {error_message}")
-            
-            # Sprawdzenie, czy błąd to przekroczenie limitu zapytań
-            if "Query limit exceeded, token blocked until" in error_message:
-                print(f"Wykryto przekroczenie limitu zapytań. Pauza na 12 minut...")
-                logging.info(f"Wykryto przekroczenie limitu zapytań. Pauza na 12 minut...")
-                time.sleep(PAUSE_DURATION)
-                print(f"Pauza zakończona. Wznawianie pracy...")
-                logging.info(f"Pauza zakończona. Wznawianie pracy...")
-                # Ponowna próba dodania produktu po odczekaniu
-                response = session.post(API_URL, headers=headers, data=params, timeout=60)
-                response_data = response.json()
-                if response_data.get("status") != "SUCCESS":
-                    logging.error(f"Ponowna próba nieudana dla SKU {product['sku']}: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-                    print(f"Ponowna próba nieudana dla SKU {product['sku']}: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-                    return None
-        
-        # Sprawdź czy product_id istnieje i nie jest None
-        product_id = response_data.get("product_id")
-        if product_id and str(product_id) != "0" and str(product_id).lower() != "none":
-            product_id_str = str(product_id)
-            logging.info(f"Pomyślnie dodano produkt: SKU={product['sku']} -> ID={product_id_str}")
-            print(f"Pomyślnie dodano produkt: SKU={product['sku']} -> ID={product_id_str}")
-
-            # ✅ zwróć wynik do wątku głównego
-            return (product["sku"], product_id_str)
-        else:
-            logging.error(f"Brak product_id lub product_id=None w odpowiedzi API dla SKU {product['sku']}: {response_data}")
-            print(f"Brak product_id lub product_id=None w odpowiedzi API dla SKU {product['sku']}: {response_data}")
-            return None
+def parse_add_product_response(product: Dict, response_data: Dict) -> Optional[Tuple[str, str]]:
+    """Zwraca (sku, product_id) z udanej odpowiedzi addProduct albo None."""
+    # Sprawdź czy product_id istnieje i nie jest None
+    product_id = response_data.get("product_id")
+    if product_id and str(product_id) != "0" and str(product_id).lower() != "none":
+        product_id_str = str(product_id)
+        logging.info(f"Pomyślnie dodano produkt: SKU={product['sku']} -> ID={product_id_str}")
+        print(f"Pomyślnie dodano produkt: SKU={product['sku']} -> ID={product_id_str}")
+
+        # ✅ zwróć wynik do wątku głównego
+        return (product["sku"], product_id_str)
+    else:
+        logging.error(f"Brak product_id lub product_id=None w odpowiedzi API dla SKU {product['sku']}: {response_data}")
+        print(f"Brak product_id lub product_id=None w odpowiedzi API dla SKU {product['sku']}: {response_data}")
+        return None
+
+
+def add_product_to_baselinker(product: Dict, storage_id: str, category_id: str, inventory_id: str) -> Optional[Tuple[str, str]]:
+    """Wysyła pojedynczy nowy produkt do BaseLinker przez Storage API (ceny w CZK)."""
+    try:
+        response_data = client.add_product(build_add_product(product, storage_id, category_id))
+    except PermanentError as e:
+        logging.error(f"Błąd API (addProduct) dla SKU {product['sku']}: {str(e)}")
+        print(f"Błąd API (addProduct) dla SKU {product['sku']}: {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas wysyłania żądania (addProduct) dla SKU {product['sku']}: {str(e)}")
         print(f"Błąd podczas wysyłania żądania (addProduct) dla SKU {product['sku']}: {str(e)}")
         return None
 
-def add_products_from_xml():
-    """Główna funkcja dodawania produktów z pliku XML online (ceny w CZK) z użyciem partii."""
+    return parse_add_product_response(product, response_data)
+
+def prepare_new_products() -> Optional[Tuple[str, str, List[ProductRecord]]]:
+    """Ładuje bazę SKU, sprawdza magazyn/kategorię i zwraca (storage_id, category_id, nowe produkty)."""
     load_sku_to_id()
     
     storage_id = get_valid_storage_id()
     if not storage_id:
         logging.error("Nie można kontynuować: nieprawidłowy ID magazynu.")
         print("Nie można kontynuować: nieprawidłowy ID magazynu. Sprawdź API_TOKEN i INVENTORY_ID.")
-        return
+        return None
     
     category_id = create_category_if_needed(NEW_INVENTORY_ID)
     
-    products = fetch_and_parse_xml()
-    if not products:
+    # w pamięci zostają tylko nowe produkty, nie cały feed
+    total = 0
+    new_products = []
+    try:
+        for product in iter_xml_products():
+            total += 1
+            # wersja feedu jest znana od pierwszego produktu przy 304 / snapshocie / pliku lokalnym –
+            # niezmieniony feed nie jest czytany dalej
+            if total == 1 and feed.already_pushed(fingerprint(sku_to_id_cache)):
+                logging.info("Feed bez zmian od ostatniego udanego dodawania – pomijam przebieg.")
+                print("Feed bez zmian od ostatniego udanego dodawania – pomijam przebieg (--force-feed wymusza).")
+                return None
+            if product["sku"] not in sku_to_id_cache:
+                new_products.append(product)
+    except FeedError as e:
+        logging.error(str(e))
+        print(str(e))
+        total = 0
+    # zwykłe 200 (bez ETag/Last-Modified albo bez 304): sha256 treści jest znany dopiero po całym feedzie
+    if total and feed.already_pushed(fingerprint(sku_to_id_cache)):
+        logging.info("Treść feedu (sha256) bez zmian od ostatniego udanego dodawania – pomijam przebieg.")
+        print("Feed bez zmian od ostatniego udanego dodawania – pomijam przebieg (--force-feed wymusza).")
+        return None
+    if feed_errors:
+        print(f"Pominięto {len(feed_errors)} produktów z nieprawidłowymi wartościami w feedzie (szczegóły w logu).")
+    if not total:
         logging.error("Brak produktów do przetworzenia.")
         print("Brak produktów do przetworzenia. Sprawdź URL XML Lub jego składnię.")
-        return
-    
-    new_products = [p for p in products if p["sku"] not in sku_to_id_cache]
+        return None
+
     if not new_products:
         logging.info("Brak nowych produktów do dodania.")
         print("Brak nowych produktów do dodania.")
-        return
+        feed.mark_pushed(fingerprint(sku_to_id_cache))
+        return None
     
     print(f"Znaleziono {len(new_products)} nowych produktów do dodania.")
     logging.info(f"Znaleziono {len(new_products)} nowych produktów do dodania.")
+    report_duplicate_eans(new_products)
+    return storage_id, category_id, new_products
+
+
+def report_duplicate_eans(new_products: List[ProductRecord]):
+    """Ostrzega o nowych produktach, których EAN ma już w katalogu inny SKU (jedno połączenie w rejestrze)."""
+    duplicates = [(ean, sku, product_id) for ean, sku, product_id in
+                  registry.join((p["ean"] for p in new_products if p["ean"]), by="ean", fields=("sku", "product_id"))
+                  if product_id]
+    if not duplicates:
+        return
+    new_by_ean = {p["ean"]: p["sku"] for p in new_products if p["ean"]}
+    for ean, sku, product_id in duplicates:
+        logging.warning(f"EAN {ean} nowego SKU {new_by_ean.get(ean)} jest już w katalogu: SKU {sku}, product_id {product_id}")
+    print(f"Uwaga: {len(duplicates)} nowych produktów ma EAN istniejącego już produktu (szczegóły w logu).")
+
+
+def save_failed_products(failed_products: List[ProductRecord]):
+    if failed_products:
+        with open("failed_products_add.json", "w", encoding="utf-8") as f:
+            json.dump([product.to_dict() for product in failed_products], f, ensure_ascii=False, indent=2)
+        logging.warning(f"Nieudane produkty zapisano do failed_products_add.json ({len(failed_products)} produktów).")
+        print(f"Nieudane produkty zapisano do failed_products_add.json ({len(failed_products)} produktów).")
+    else:
+        print("Wszystkie nowe produkty dodano pomyślnie!")
+        feed.mark_pushed(fingerprint(sku_to_id_cache))
+
+
+def add_products_from_xml():
+    """Główna funkcja dodawania produktów z pliku XML online (ceny w CZK) z użyciem partii."""
+    prepared = prepare_new_products()
+    if prepared is None:
+        return
+    storage_id, category_id, new_products = prepared
     
     # Przetwarzanie w partiach po BATCH_SIZE (500) produktów na minutę
     failed_products = []
@@ -398,7 +391,6 @@ def add_products_from_xml():
         print(f"Przetwarzanie partii {batch_number} ({len(batch)} produktów)...")
         logging.info(f"Przetwarzanie partii {batch_number} ({len(batch)} produktów)...")
         
-        start_time = time.time()
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
             future_to_product = {
                 executor.submit(add_product_to_baselinker, product, storage_id, category_id, NEW_INVENTORY_ID): product
@@ -414,33 +406,89 @@ def add_products_from_xml():
                     failed_products.append(product)
                 else:
                     sku, product_id = res
-                    sku_to_id_cache[sku] = product_id
+                    save_sku_to_id(sku, product_id, product)
                     batch_added += 1
-                    
-                    if batch_added % 100 == 0:
-                        save_sku_to_id()
-                        print(f"Zapis pośredni: {batch_added} dodanych w partii {batch_number}")
-
-
 
-
-        # ✅ zapis raz po partii
         if batch_added > 0:
-            save_sku_to_id()
-            print(f"Partia {batch_number}: dopisano {batch_added} nowych SKU do sku_to_id.json")
+            print(f"Partia {batch_number}: dopisano {batch_added} nowych SKU do bazy SKU-to-ID")
 
         
 
         
         batch_number += 1
     
-    if failed_products:
-        with open("failed_products_add.json", "w", encoding="utf-8") as f:
-            json.dump(failed_products, f, ensure_ascii=False, indent=2)
-        logging.warning(f"Nieudane produkty zapisano do failed_products_add.json ({len(failed_products)} produktów).")
-        print(f"Nieudane produkty zapisano do failed_products_add.json ({len(failed_products)} produktów).")
-    else:
-        print("Wszystkie nowe produkty dodano pomyślnie!")
+    if len(failed_products) < len(new_products):
+        refresh_index(sku_store)  # update_products / update_erp / GUI startują z indeksu mmap bez przebudowy
+        registry.reconcile(sku_store)
+    save_failed_products(failed_products)
+
+
+async def add_products_from_xml_async():
+    """Wersja asyncio: ASYNC_CONCURRENCY zapytań addProduct w locie bez puli wątków."""
+    from bl_async import AsyncBaseLinkerClient, run_bounded
+
+    prepared = prepare_new_products()
+    if prepared is None:
+        return
+    storage_id, category_id, new_products = prepared
+
+    failed_products = []
+    added = {"count": 0}
+    saves: asyncio.Queue = asyncio.Queue()  # (sku, product_id, produkt) do zapisu; None kończy
+
+    async def saver():
+        # zapis w wątku, partiami: wszystko, co przyszło w trakcie poprzedniego zapisu
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = [await saves.get()]
+            while not saves.empty():
+                batch.append(saves.get_nowait())
+            done = batch[-1] is None
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                await loop.run_in_executor(None, save_skus, batch)
+
+    saver_task = asyncio.create_task(saver())
+    async with AsyncBaseLinkerClient(API_URL, API_TOKEN, limiter, concurrency=ASYNC_CONCURRENCY, max_retries=MAX_RETRIES,
+                                     pause_fallback=PAUSE_DURATION, max_block_retries=MAX_BLOCK_RETRIES,
+                                     metrics=client.metrics) as async_client:
+        async def worker(product):
+            response_data = await async_client.add_product(build_add_product(product, storage_id, category_id))
+            return parse_add_product_response(product, response_data)
+
+        def on_result(product, res):
+            if isinstance(res, Exception):
+                logging.error(f"Błąd API (addProduct) dla SKU {product['sku']}: {str(res)}")
+                print(f"Błąd API (addProduct) dla SKU {product['sku']}: {str(res)}")
+                res = None
+            if res is None:
+                failed_products.append(product)
+                return
+            sku, product_id = res
+            sku_to_id_cache[sku] = product_id
+            saves.put_nowait((sku, product_id, product))
+            added["count"] += 1
+
+        try:
+            await run_bounded(new_products, worker, ASYNC_CONCURRENCY, on_result)
+        finally:
+            saves.put_nowait(None)
+            await saver_task
+    async_client.report()
+
+    if added["count"] > 0:
+        print(f"Dopisano {added['count']} nowych SKU do bazy SKU-to-ID")
+        refresh_index(sku_store)  # update_products / update_erp / GUI startują z indeksu mmap bez przebudowy
+        registry.reconcile(sku_store)
+
+    save_failed_products(failed_products)
 
 if __name__ == "__main__":
-    add_products_from_xml()
\ No newline at end of file
+    if USE_ASYNC:
+        asyncio.run(add_products_from_xml_async())
+    else:
+        add_products_from_xml()
+    if not USE_ASYNC:  # w trybie asyncio addProduct idzie przez aiohttp – raport w add_products_from_xml_async()
+        client.transport.report()
+    client.write_run_summary(METRICS_FILE)
\ No newline at end of file
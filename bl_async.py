@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlencode
+
+import aiohttp
+
+from bl_client import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, RETRYABLE_ERRORS, BaseLinkerError, PermanentError, RateLimitError, ServerError, TransientError,
+    backoff_delay, classify_response, error_kind, method_lane, report_connections,
+)
+from bl_metrics import ApiMetrics
+from bl_limiter import pause_for_block_async
+
+
+class AsyncBaseLinkerClient:
+    """Asynchroniczny klient BaseLinker (aiohttp) dla zadań z dziesiątkami tysięcy wywołań.
+
+    Jedna pula połączeń keep-alive i semafor ograniczający liczbę zapytań w locie,
+    a tempo pilnuje ten sam limiter co w wersji wątkowej (wspólny budżet tokena,
+    pauza przy "token blocked until"). Klasy błędów i ponowienia są takie same
+    jak w BaseLinkerClient. Klient nie jest związany z katalogiem, więc jeden
+    proces może obsługiwać kilka inventory naraz.
+    """
+
+    def __init__(self, api_url: str, token: str, limiter, concurrency: int = 100,
+                 max_retries: int = 4, backoff_base: float = 1.0, backoff_cap: float = 30.0,
+                 pause_fallback: float = 360, max_block_retries: int = 5, metrics: Optional[ApiMetrics] = None):
+        self.api_url = api_url
+        self.token = token
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pause_fallback = pause_fallback
+        self.max_block_retries = max_block_retries
+        self.metrics = metrics or ApiMetrics()  # można podać metrics klienta wątkowego, żeby mieć jedno podsumowanie
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.requests_count = 0
+        self.connections = 0
+
+    async def _on_connection_created(self, session, context, params):
+        self.connections += 1
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        trace = aiohttp.TraceConfig()  # nowe połączenia TCP/TLS – do reuse jak w HttpTransport
+        trace.on_connection_create_end.append(self._on_connection_created)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            headers={"X-BLToken": self.token, "Accept-Encoding": "gzip, deflate"},
+            trace_configs=[trace],
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.metrics.record_transport("aiohttp", self.connection_stats())
+
+    def connection_stats(self) -> Dict[str, float]:
+        """Jak HttpTransport.connection_stats(), dla puli aiohttp tego klienta."""
+        reuse = max(0.0, 1 - self.connections / self.requests_count) if self.requests_count else 0.0
+        return {"requests": self.requests_count, "connections": self.connections, "reuse_rate": round(reuse, 4)}
+
+    def report(self):
+        report_connections(self.connection_stats(), " (aiohttp)")
+
+    async def _post(self, method: str, params: Dict) -> Dict:
+        body = urlencode({"method": method, "parameters": json.dumps(params, ensure_ascii=False)})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        started = time.monotonic()
+        self.requests_count += 1
+        try:
+            async with self.session.post(self.api_url, data=body, headers=headers) as response:
+                raw = await response.read()
+                status = response.status
+                wire_bytes = response.content_length or len(raw)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            self.metrics.record_call(method, time.monotonic() - started, False)
+            raise TransientError(f"{method}: błąd sieci: {e!r}", method) from e
+
+        data = None
+        if status < 400:
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = None
+        self.metrics.record_call(
+            method, time.monotonic() - started, bool(data) and data.get("status") == "SUCCESS",
+            bytes_sent=len(body.encode("utf-8")), bytes_received=wire_bytes, bytes_decoded=len(raw),
+        )
+
+        if status >= 500:
+            raise ServerError(f"{method}: HTTP {status}", method)
+        if status >= 400:
+            raise PermanentError(f"{method}: HTTP {status}", method)
+        if data is None:
+            raise ServerError(f"{method}: nieprawidłowa odpowiedź JSON", method)
+        return data
+
+    async def call(self, method: str, params: Dict, dedupe: Optional[Callable[[], Awaitable[Optional[Dict]]]] = None,
+                   lane: Optional[str] = None) -> Dict:
+        """Wywołuje metodę API i zwraca odpowiedź SUCCESS albo rzuca BaseLinkerError."""
+        lane = method_lane(method, lane)
+        attempt = 0
+        blocks = 0
+        while True:
+            try:
+                # najpierw slot limitera, potem miejsce w semaforze – czekanie na slot nie zajmuje połączeń
+                waited = time.monotonic()
+                await self.limiter.wait_async(lane)
+                self.metrics.record_limiter_wait(method, time.monotonic() - waited)
+                async with self.semaphore:
+                    data = await self._post(method, params)
+                error = classify_response(method, data)
+                if error is not None:
+                    raise error
+                return data
+            except RateLimitError as e:
+                if blocks >= self.max_block_retries:
+                    self.metrics.record_error(method, error_kind(e))
+                    raise
+                blocks += 1
+                self.metrics.record_retry(method, error_kind(e))
+                pause = await pause_for_block_async(self.limiter, str(e), self.pause_fallback)
+                if pause is not None:
+                    logging.info(f"Wykryto przekroczenie limitu zapytań ({e}). Pauza {int(pause)} s.")
+                    print(f"Wykryto przekroczenie limitu zapytań. Wstrzymanie wszystkich zadań na {int(pause)} s...")
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.metrics.record_error(method, error_kind(e))
+                    raise
+                self.metrics.record_retry(method, error_kind(e))
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                attempt += 1
+                logging.warning(f"{e} – ponowienie {attempt}/{self.max_retries} za {delay:.1f} s")
+                await asyncio.sleep(delay)
+                if dedupe is not None:
+                    try:
+                        existing = await dedupe()
+                    except BaseLinkerError as check_error:
+                        logging.error(f"{method}: nie można sprawdzić, czy poprzednia próba się zapisała: {check_error}")
+                        raise e
+                    if existing is not None:
+                        logging.info(f"{method}: poprzednia próba jednak się zapisała – pomijam ponowienie.")
+                        return existing
+            except PermanentError as e:
+                self.metrics.record_error(method, error_kind(e))
+                raise
+
+    async def find_product_id_by_sku(self, storage_id: str, sku: str) -> Optional[str]:
+        data = await self.call("getProductsList", {"storage_id": storage_id, "filter_sku": sku})
+        products = data.get("products") or {}
+        for product in (products.values() if isinstance(products, dict) else products):
+            if product.get("sku") == sku and product.get("product_id"):
+                return str(product["product_id"])
+        return None
+
+    async def add_product(self, params: Dict) -> Dict:
+        """addProduct odporny na duplikaty (patrz BaseLinkerClient.add_product)."""
+        dedupe = None
+        if str(params.get("product_id", "0")) == "0" and params.get("sku"):
+            async def dedupe():
+                product_id = await self.find_product_id_by_sku(params["storage_id"], params["sku"])
+                return {"status": "SUCCESS", "product_id": product_id} if product_id else None
+        return await self.call("addProduct", params, dedupe=dedupe)
+
+
+async def run_bounded(items: Iterable, worker: Callable[..., Awaitable], concurrency: int,
+                      on_result: Optional[Callable] = None) -> List:
+    """Uruchamia `worker(item)` dla wszystkich elementów przy stałej liczbie zadań.
+
+    Zamiast tworzyć korutynę na każdy z ~30k produktów, `concurrency` zadań pobiera
+    elementy ze wspólnego iteratora. `on_result(item, wynik_albo_wyjątek)` jest wołane
+    po każdym elemencie (postęp, zapisy pośrednie). Zwraca listę takich par.
+    """
+    iterator = iter(items)
+    results = []
+
+    async def runner():
+        for item in iterator:
+            try:
+                result = await worker(item)
+            except Exception as e:
+                result = e
+            results.append((item, result))
+            if on_result is not None:
+                on_result(item, result)
+
+    await asyncio.gather(*(runner() for _ in range(concurrency)))
+    return results
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from bl_limiter import DEFAULT_LANE, is_query_limit_error, pause_for_block
+from bl_metrics import ApiMetrics
+
+CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", 10))  # s – nawiązanie połączenia
+READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", 60))  # s – oczekiwanie na odpowiedź
+
+
+class BaseLinkerError(Exception):
+    """Błąd wywołania API BaseLinker."""
+
+    def __init__(self, message: str, method: Optional[str] = None, error_code: Optional[str] = None):
+        super().__init__(message)
+        self.method = method
+        self.error_code = error_code
+
+
+class TransientError(BaseLinkerError):
+    """Błąd sieci (timeout, zerwane połączenie) – można ponowić."""
+
+
+class ServerError(BaseLinkerError):
+    """Odpowiedź 5xx albo nieczytelna odpowiedź serwera – można ponowić."""
+
+
+class RateLimitError(BaseLinkerError):
+    """Token zablokowany ("Query limit exceeded") – ponawiamy po wspólnej pauzie."""
+
+
+class PermanentError(BaseLinkerError):
+    """Błąd walidacji / zły token / 4xx – ponawianie nic nie da."""
+
+
+RETRYABLE_ERRORS = (TransientError, ServerError)
+
+# Domyślny pas priorytetu limitera dla metod API (można nadpisać parametrem `lane`)
+METHOD_LANES = {
+    "updateProductsQuantity": "stock",
+    "updateProductsPrices": "prices",
+    "addProduct": "create",
+    "addProductCatalogCategory": "create",
+    "addInventoryProduct": "backfill",
+}
+
+
+def method_lane(method: str, lane: Optional[str] = None) -> str:
+    return lane or METHOD_LANES.get(method, DEFAULT_LANE)
+
+
+def error_kind(error: BaseLinkerError) -> str:
+    """Nazwa klasy błędu używana w metrykach."""
+    if isinstance(error, TransientError):
+        return "network"
+    if isinstance(error, ServerError):
+        return "server"
+    if isinstance(error, RateLimitError):
+        return "rate_limit"
+    return "permanent"
+
+
+def classify_response(method: str, data: Dict) -> Optional[BaseLinkerError]:
+    """Zwraca wyjątek odpowiadający odpowiedzi z błędem albo None dla SUCCESS."""
+    if data.get("status") == "SUCCESS":
+        return None
+    error_message = data.get("error_message") or "Brak szczegółów błędu"
+    error_code = data.get("error_code")
+    message = f"{method} ERROR: {error_message} ({error_code})"
+    if is_query_limit_error(error_message):
+        return RateLimitError(message, method, error_code)
+    return PermanentError(message, method, error_code)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Wykładniczy backoff z pełnym jitterem: losowo z [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _counting_pool_classes(on_connect: Callable[[], None]) -> Dict:
+    """Klasy pul urllib3, które zliczają każde faktyczne nawiązanie połączenia (TCP/TLS)."""
+
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            on_connect()
+            super().connect()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            on_connect()
+            super().connect()
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    return {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+class HttpTransport:
+    """Warstwa HTTP dla wszystkich wywołań API: jedna sesja keep-alive na proces.
+
+    Pula połączeń HTTPAdapter ma rozmiar liczby wątków (żaden wątek nie czeka na
+    wolne połączenie i nie otwiera nowego TLS), odpowiedzi są kompresowane
+    (gzip/deflate), a timeouty połączenia i odczytu ustawione jawnie.
+    """
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.lock = threading.Lock()
+        self.requests_count = 0
+        self.connections = 0
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), pool_block=False)
+        self.adapter.poolmanager.pool_classes_by_scheme = _counting_pool_classes(self._on_connect)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    def _on_connect(self):
+        with self.lock:
+            self.connections += 1
+
+    def post(self, url: str, headers: Dict, data: Dict) -> requests.Response:
+        with self.lock:
+            self.requests_count += 1
+        return self.session.post(url, headers=headers, data=data, timeout=self.timeout)
+
+    def connection_stats(self) -> Dict[str, float]:
+        """Liczba zapytań i nawiązanych połączeń (reuse = zapytania bez nowego połączenia)."""
+        with self.lock:
+            requests_count, connections = self.requests_count, self.connections
+        reuse = max(0.0, 1 - connections / requests_count) if requests_count else 0.0
+        return {"requests": requests_count, "connections": connections, "reuse_rate": round(reuse, 4)}
+
+    def report(self):
+        report_connections(self.connection_stats())
+
+
+def report_connections(stats: Dict[str, float], label: str = ""):
+    """Loguje i wypisuje connection_stats() transportu (`label` np. " (aiohttp)")."""
+    msg = (f"Połączenia HTTP{label}: {stats['requests']} zapytań, {stats['connections']} nowych połączeń "
+           f"(reuse {stats['reuse_rate'] * 100:.1f}%)")
+    logging.info(msg)
+    print(msg)
+
+
+class BaseLinkerClient:
+    """Jedna ścieżka wywołań API BaseLinker dla wszystkich skryptów.
+
+    Każde wywołanie przechodzi przez limiter, a błędy są dzielone na klasy:
+    sieć i 5xx są ponawiane z ograniczonym, losowym backoffem, blokada tokena
+    ustawia wspólną pauzę limitera, a błędy walidacji od razu kończą się
+    PermanentError. Dla nieidempotentnych wywołań (addProduct z product_id "0")
+    przed ponowieniem wołany jest `dedupe()`, który sprawdza, czy poprzednia
+    próba jednak nie zapisała produktu.
+    """
+
+    def __init__(self, api_url: str, token: str, limiter, transport: Optional[HttpTransport] = None,
+                 max_retries: int = 4, backoff_base: float = 1.0, backoff_cap: float = 30.0,
+                 pause_fallback: float = 360, max_block_retries: int = 5, metrics: Optional[ApiMetrics] = None):
+        self.api_url = api_url
+        self.token = token
+        self.limiter = limiter
+        self.transport = transport or HttpTransport()
+        self.metrics = metrics or ApiMetrics()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pause_fallback = pause_fallback
+        self.max_block_retries = max_block_retries
+
+    def _post(self, method: str, params: Dict) -> Dict:
+        payload = {"method": method, "parameters": json.dumps(params, ensure_ascii=False)}
+        started = time.monotonic()
+        try:
+            response = self.transport.post(self.api_url, {"X-BLToken": self.token}, payload)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            self.metrics.record_call(method, time.monotonic() - started, False)
+            raise TransientError(f"{method}: błąd sieci: {e}", method) from e
+        latency = time.monotonic() - started
+
+        data = None
+        if response.status_code < 400:
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+        # raw.tell() = bajty odczytane z sieci (przed dekompresją gzip)
+        wire_bytes = response.raw.tell() if hasattr(response.raw, "tell") else len(response.content)
+        self.metrics.record_call(
+            method, latency, bool(data) and data.get("status") == "SUCCESS",
+            bytes_sent=int(response.request.headers.get("Content-Length") or 0),
+            bytes_received=wire_bytes or len(response.content),
+            bytes_decoded=len(response.content),
+        )
+
+        if response.status_code >= 500:
+            raise ServerError(f"{method}: HTTP {response.status_code}", method)
+        if response.status_code >= 400:
+            raise PermanentError(f"{method}: HTTP {response.status_code}", method)
+        if data is None:
+            raise ServerError(f"{method}: nieprawidłowa odpowiedź JSON", method)
+        return data
+
+    def call(self, method: str, params: Dict, dedupe: Optional[Callable[[], Optional[Dict]]] = None,
+             lane: Optional[str] = None) -> Dict:
+        """Wywołuje metodę API i zwraca odpowiedź SUCCESS albo rzuca BaseLinkerError.
+
+        `dedupe` – dla wywołań nieidempotentnych: przed ponowieniem zwraca gotową
+        odpowiedź, jeśli operacja jednak się wykonała, albo None.
+        `lane` – pas priorytetu limitera (domyślnie wg METHOD_LANES).
+        """
+        lane = method_lane(method, lane)
+        attempt = 0
+        blocks = 0
+        while True:
+            try:
+                waited = time.monotonic()
+                self.limiter.wait(lane)
+                self.metrics.record_limiter_wait(method, time.monotonic() - waited)
+                data = self._post(method, params)
+                error = classify_response(method, data)
+                if error is not None:
+                    raise error
+                return data
+            except RateLimitError as e:
+                if blocks >= self.max_block_retries:
+                    self.metrics.record_error(method, error_kind(e))
+                    raise
+                blocks += 1
+                self.metrics.record_retry(method, error_kind(e))
+                pause = pause_for_block(self.limiter, str(e), self.pause_fallback)
+                if pause is not None:
+                    logging.info(f"Wykryto przekroczenie limitu zapytań ({e}). Pauza {int(pause)} s.")
+                    print(f"Wykryto przekroczenie limitu zapytań. Wstrzymanie wszystkich wątków na {int(pause)} s...")
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.metrics.record_error(method, error_kind(e))
+                    raise
+                self.metrics.record_retry(method, error_kind(e))
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                attempt += 1
+                logging.warning(f"{e} – ponowienie {attempt}/{self.max_retries} za {delay:.1f} s")
+                time.sleep(delay)
+                if dedupe is not None:
+                    try:
+                        existing = dedupe()
+                    except BaseLinkerError as check_error:
+                        logging.error(f"{method}: nie można sprawdzić, czy poprzednia próba się zapisała: {check_error}")
+                        raise e
+                    if existing is not None:
+                        logging.info(f"{method}: poprzednia próba jednak się zapisała – pomijam ponowienie.")
+                        return existing
+            except PermanentError as e:
+                self.metrics.record_error(method, error_kind(e))
+                raise
+
+    def write_run_summary(self, path: str):
+        """Zapisuje metryki przebiegu (z połączeniami HTTP) do pliku JSON."""
+        self.metrics.write_summary(path, {"transport": self.transport.connection_stats()})
+
+    def find_product_id_by_sku(self, storage_id: str, sku: str) -> Optional[str]:
+        """Zwraca product_id produktu o dokładnie tym SKU albo None."""
+        data = self.call("getProductsList", {"storage_id": storage_id, "filter_sku": sku})
+        products = data.get("products") or {}
+        for product in (products.values() if isinstance(products, dict) else products):
+            if product.get("sku") == sku and product.get("product_id"):
+                return str(product["product_id"])
+        return None
+
+    def add_product(self, params: Dict) -> Dict:
+        """addProduct odporny na duplikaty: nowy produkt (product_id "0") nie zostanie dodany dwa razy."""
+        dedupe = None
+        if str(params.get("product_id", "0")) == "0" and params.get("sku"):
+            def dedupe():
+                product_id = self.find_product_id_by_sku(params["storage_id"], params["sku"])
+                return {"status": "SUCCESS", "product_id": product_id} if product_id else None
+        return self.call("addProduct", params, dedupe=dedupe)
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+PUSH_STATE_FILE = os.environ.get("PUSH_STATE_FILE", "push_state.sqlite")
+# --full-push (albo FULL_PUSH=1) wysyła wszystkie produkty, ignorując zapamiętany stan
+FULL_PUSH = "--full-push" in sys.argv or os.environ.get("FULL_PUSH", "0") == "1"
+
+# (sku, product_id, quantity) / (sku, product_id, price_brutto, tax_rate, price_group_id)
+QuantityEntry = Tuple[str, str, int]
+PriceEntry = Tuple[str, str, float, float, int]
+
+
+class Delta:
+    """Liczniki różnicy między feedem a stanem ostatniego potwierdzonego wysłania.
+
+    `added` – produkt nigdy nie wysłany (albo SKU dostało inny product_id),
+    `removed` – SKU wysłane wcześniej, których nie ma już w feedzie albo
+    w sku_to_id (znane dopiero po przeczytaniu całego feedu).
+    """
+
+    def __init__(self):
+        self.added = 0
+        self.quantity_changed = 0
+        self.price_changed = 0
+        self.removed: List[str] = []
+        self.unchanged = 0
+        self.complete = False  # True, gdy strumień produktów został przeczytany do końca
+
+    def summary(self) -> str:
+        removed = len(self.removed) if self.complete else "?"
+        return (f"nowe {self.added} | zmiana stanu {self.quantity_changed} | "
+                f"zmiana ceny {self.price_changed} | usunięte {removed} | bez zmian {self.unchanged}")
+
+
+class PushState:
+    """Ostatnio wysłany (potwierdzony przez BaseLinker) stan i cena każdego SKU.
+
+    Trzymany w SQLite per `scope` (magazyn + katalog). `diff()` porównuje z nim
+    feed, a `commit_quantities()` / `commit_prices()` zapisują tylko pozycje z
+    partii, które API przyjęło – niepotwierdzone zostają "zmienione" i idą
+    ponownie w następnym przebiegu.
+    """
+
+    def __init__(self, scope: str, path: str = PUSH_STATE_FILE, full: bool = FULL_PUSH):
+        self.scope = scope
+        self.full = full
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pushed_state ("
+            "scope TEXT NOT NULL, sku TEXT NOT NULL, product_id TEXT NOT NULL, quantity INTEGER, "
+            "price REAL, tax REAL, price_group INTEGER, updated_at REAL NOT NULL, PRIMARY KEY (scope, sku))"
+        )
+
+    def load(self) -> Dict[str, Tuple]:
+        """SKU -> (product_id, quantity, price, tax, price_group)."""
+        with self.lock:
+            return {
+                row[0]: row[1:]
+                for row in self.conn.execute(
+                    "SELECT sku, product_id, quantity, price, tax, price_group FROM pushed_state WHERE scope = ?",
+                    (self.scope,),
+                )
+            }
+
+    def changes(self, products: Iterable, sku_to_id: Mapping[str, str], delta: Delta, tax: Optional[float] = None,
+                price_group: Optional[int] = None, prices: bool = True) -> Iterator[Tuple[str, object, str]]:
+        """Strumieniowo porównuje produkty (z sku/quantity/price_brutto) ze stanem.
+
+        Zwraca ("quantity" | "price", produkt, product_id) dla każdej potrzebnej
+        aktualizacji, zaraz po przeczytaniu produktu – bez listy całego feedu.
+        Przy `prices=False` (tryb stock-only) porównywane są tylko stany; SKU
+        wysłane wtedy po raz pierwszy mają w stanie pustą cenę, więc pełny
+        przebieg wyśle im cenę. Powtórzone SKU: liczy się pierwsze wystąpienie.
+        Liczniki trafiają do `delta`, a po wyczerpaniu strumienia – lista usuniętych.
+        """
+        state = self.load()
+        seen = set()
+        for product in products:
+            sku = product["sku"]
+            product_id = str(sku_to_id.get(sku, "0"))
+            if product_id == "0" or sku in seen:
+                continue
+            seen.add(sku)
+            pushed = None if self.full else state.get(sku)
+            if pushed is None or pushed[0] != product_id:
+                delta.added += 1
+                yield "quantity", product, product_id
+                if prices:
+                    yield "price", product, product_id
+                continue
+            _, quantity, price, pushed_tax, pushed_group = pushed
+            changed = False
+            if quantity != product["quantity"]:
+                delta.quantity_changed += 1
+                changed = True
+                yield "quantity", product, product_id
+            if prices and (price is None or round(price, 2) != round(product["price_brutto"], 2)
+                           or pushed_tax != tax or pushed_group != price_group):
+                delta.price_changed += 1
+                changed = True
+                yield "price", product, product_id
+            if not changed:
+                delta.unchanged += 1
+        delta.removed = [sku for sku in state if sku not in seen]
+        delta.complete = True
+
+    def _write(self, sql: str, rows: List[Tuple]):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def commit_quantities(self, entries: Iterable[QuantityEntry]):
+        """Zapisuje stany przyjęte przez API (zmiana product_id kasuje zapamiętaną cenę)."""
+        now = time.time()
+        self._write(
+            "INSERT INTO pushed_state (scope, sku, product_id, quantity, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, sku) DO UPDATE SET quantity = excluded.quantity, updated_at = excluded.updated_at, "
+            "price = CASE WHEN product_id = excluded.product_id THEN price END, "
+            "tax = CASE WHEN product_id = excluded.product_id THEN tax END, "
+            "price_group = CASE WHEN product_id = excluded.product_id THEN price_group END, "
+            "product_id = excluded.product_id",
+            [(self.scope, sku, str(product_id), quantity, now) for sku, product_id, quantity in entries],
+        )
+
+    def commit_prices(self, entries: Iterable[PriceEntry]):
+        """Zapisuje ceny przyjęte przez API (zmiana product_id kasuje zapamiętany stan)."""
+        now = time.time()
+        self._write(
+            "INSERT INTO pushed_state (scope, sku, product_id, price, tax, price_group, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, sku) DO UPDATE SET price = excluded.price, tax = excluded.tax, "
+            "price_group = excluded.price_group, updated_at = excluded.updated_at, "
+            "quantity = CASE WHEN product_id = excluded.product_id THEN quantity END, "
+            "product_id = excluded.product_id",
+            [(self.scope, sku, str(product_id), price, tax, group, now) for sku, product_id, price, tax, group in entries],
+        )
+
+    def forget(self, skus: Iterable[str]):
+        """Usuwa SKU ze stanu – jeśli wrócą do feedu, zostaną wysłane jako nowe."""
+        self._write("DELETE FROM pushed_state WHERE scope = ? AND sku = ?", [(self.scope, sku) for sku in skus])
@@ -0,0 +1,628 @@
+import gzip
+import hashlib
+import html
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+
+GOOGLE_NS = "http://base.google.com/ns/1.0"
+NS = {"g": GOOGLE_NS}
+FEED_TIMEOUT = float(os.environ.get("FEED_TIMEOUT", 60))  # s – połączenie / przerwa w przesyłaniu feedu XML
+CHUNK_SIZE = 256 * 1024  # bajty podawane parserowi naraz
+PROGRESS_INTERVAL = 2.0  # s – co ile wypisywać postęp czytania feedu
+UTF8_BOM = b"\xef\xbb\xbf"
+FEED_CACHE_DIR = os.environ.get("FEED_CACHE_DIR", "feed_cache")  # ostatni feed (gzip) + ETag/Last-Modified/sha256
+# --force-feed (albo FORCE_FEED=1) wysyła dane nawet wtedy, gdy feed się nie zmienił
+FORCE_FEED = "--force-feed" in sys.argv or os.environ.get("FORCE_FEED", "0") == "1"
+
+
+# Pola produktu czytane z <item>: nazwa -> ścieżka elementu (surowy tekst albo None, gdy brak elementu)
+ITEM_FIELDS = {
+    "erp_id": "g:id",
+    "mpn": "g:mpn",
+    "brand": "g:brand",
+    "title": "title",
+    "description": "description",
+    "g_description": "g:description",
+    "price": "g:price",
+    "availability": "g:availability",
+    "gtin": "g:gtin",
+    "image_link": "g:image_link",
+    "product_type": "g:product_type",
+    "stock_category": "NX_StockCategory",
+}
+
+# Pola liczbowe: nazwa z ITEM_FIELDS -> (typ, wartość, gdy elementu brak)
+NUMERIC_FIELDS = {
+    "price": (float, 0.0),
+    "availability": (int, 0),
+}
+
+
+def _clark(path: str) -> str:
+    """"g:mpn" -> "{http://base.google.com/ns/1.0}mpn" (tak ElementTree zapisuje tagi dzieci)."""
+    prefix, _, local = path.rpartition(":")
+    return f"{{{NS[prefix]}}}{local}" if prefix else local
+
+
+# tag dziecka <item> -> pole; wyliczone raz, dekoder robi jeden przebieg po dzieciach
+_FIELD_BY_TAG = {_clark(path): name for name, path in ITEM_FIELDS.items()}
+
+
+class FeedError(Exception):
+    """Nie udało się pobrać albo sparsować feedu XML."""
+
+
+def local_path(url: str) -> Optional[str]:
+    """Ścieżka pliku dla adresu file://, inaczej None."""
+    if not url.startswith("file://"):
+        return None
+    file_path = urlparse(url).path
+    if os.name == 'nt' and file_path.startswith('/'):
+        file_path = file_path[1:]  # Usuń początkowy / dla Windows
+    return file_path
+
+
+@contextmanager
+def feed_chunks(url: str) -> Iterator[Tuple[Iterator[bytes], Optional[int]]]:
+    """Otwiera feed (URL albo file://) jako (iterator kawałków bajtów, rozmiar albo None).
+
+    URL jest czytany strumieniowo (`iter_content`, z dekompresją gzip), więc
+    parser dostaje dane w trakcie pobierania. Plik lokalny jest mapowany w
+    pamięci (mmap) i podawany tymi samymi kawałkami.
+    """
+    path = local_path(url)
+    if path is not None:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                yield iter(()), 0
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield (mm[i:i + CHUNK_SIZE] for i in range(0, size, CHUNK_SIZE)), size
+        return
+    with requests.get(url, stream=True, timeout=FEED_TIMEOUT) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        # przy Content-Encoding długość dotyczy danych skompresowanych, a liczymy bajty po dekompresji
+        total = int(length) if length and not response.headers.get("Content-Encoding") else None
+        yield response.iter_content(CHUNK_SIZE), total
+
+
+def _strip_bom(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Usuwa BOM UTF-8 z początku strumienia (także gdy pierwszy kawałek jest krótszy niż BOM)."""
+    head = b""
+    chunks = iter(chunks)
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(UTF8_BOM):
+            break
+    yield head[len(UTF8_BOM):] if head.startswith(UTF8_BOM) else head
+    yield from chunks
+
+
+def iter_items(chunks: Iterable[bytes], tag: str = "item") -> Iterator[ET.Element]:
+    """Strumieniowo zwraca kolejne elementy `<item>` z kawałków bajtów (XMLPullParser).
+
+    Element jest ważny tylko do następnej iteracji: potem jest czyszczony i
+    odpinany od rodzica, więc drzewo nie rośnie i pamięć nie zależy od
+    rozmiaru feedu.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parents = []
+
+    def drain():
+        for event, elem in parser.read_events():
+            if event == "start":
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == tag:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+    for chunk in _strip_bom(chunks):
+        parser.feed(chunk)
+        yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def read_item(item: ET.Element) -> Dict[str, Optional[str]]:
+    """Surowe pola ITEM_FIELDS z elementu <item> ("" dla pustego elementu, None dla brakującego).
+
+    Jeden przebieg po dzieciach przez tablicę tag -> pole zamiast find() na każde
+    pole; przy powtórzonym tagu liczy się pierwszy (jak w findtext).
+    """
+    row = dict.fromkeys(ITEM_FIELDS)
+    for child in item:
+        name = _FIELD_BY_TAG.get(child.tag)
+        if name is not None and row[name] is None:
+            row[name] = child.text or ""
+    return row
+
+
+_STOCK_TAIL = 64 * 1024  # bajty – ile niedopasowanego końca bufora przenosić do następnego kawałka
+
+
+def iter_stock(chunks: Iterable[bytes]) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """Minimalny skaner trybu stock-only: (g:mpn, g:availability) każdego <item>, bez budowania elementów.
+
+    Jedno wyrażenie regularne na bajtach wyszukuje tylko te dwa pola, koniec
+    produktu oraz sekcje CDATA i komentarze, które przeskakuje w całości (jak
+    `_item_end` w bl_feed_parallel), więc `</item>` czy `<g:mpn>` w opisie nie
+    są znacznikami. Prefiks przestrzeni nazw Google i kodowanie są brane
+    z nagłówka feedu; obsługuje atrybuty, puste `<g:mpn/>`, CDATA i encje.
+    Wartości są surowe jak w read_item() (None, gdy pola brak).
+    """
+    chunks = _strip_bom(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if b"<item" in head or len(head) > CHUNK_SIZE:
+            break
+    declared = re.search(rb"xmlns:([\w.-]+)\s*=\s*[\"']" + re.escape(GOOGLE_NS.encode()) + rb"[\"']", head)
+    prefix = declared.group(1) if declared else b"g"
+    encoding = re.match(rb"\s*<\?xml[^>]*encoding\s*=\s*[\"']([\w.-]+)", head)
+    encoding = encoding.group(1).decode("ascii") if encoding else "utf-8"
+
+    # sekcje "rozwinięte" zamiast .*? – jeden przebieg bez cofania po każdym znaku
+    sections = rb"!\[CDATA\[[^\]]*(?:\](?!\]>)[^\]]*)*\]\]>|!--[^-]*(?:-(?!->)[^-]*)*-->"
+
+    def field(name: bytes) -> bytes:
+        # g:name ...>tekst/CDATA/komentarze</g:name> albo g:name .../>; grupa `name_v` = zawartość
+        return (rb"(?P<%s>%s:%s(?:\s[^>]*?)?(?:/>|>(?P<%s_v>[^<]*(?:<(?:%s)[^<]*)*)</%s:%s\s*>))"
+                % (name, prefix, name, name, sections, prefix, name))
+
+    # wspólne "<" na początku: re szuka wtedy kandydatów szybkim przeszukiwaniem literału
+    token = re.compile(
+        rb"<(?:%s|%s|(?P<end>/item\s*>|item(?:\s[^>]*?)?/>)|%s"
+        # początek sekcji albo pola bez końca w buforze – dokończy następny kawałek
+        rb"|(?P<open>!\[CDATA\[|!--|%s:(?:mpn|availability)(?=[\s/>]|\Z)))"
+        % (field(b"mpn"), field(b"availability"), sections, prefix),
+    )
+    piece = re.compile(rb"<!\[CDATA\[(.*?)\]\]>|<!--.*?-->|([^<]+)", re.S)
+
+    def text(raw: bytes) -> str:
+        if b"\r" in raw:  # parser XML normalizuje końce linii
+            raw = raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if b"<" not in raw:
+            decoded = raw.decode(encoding)
+            return html.unescape(decoded) if "&" in decoded else decoded
+        parts = []
+        for cdata, plain in piece.findall(raw):
+            parts.append(cdata.decode(encoding) if cdata else html.unescape(plain.decode(encoding)))
+        return "".join(parts)
+
+    mpn = availability = None
+    tail = b""
+    for chunk in chain([head], chunks):
+        buf = tail + chunk
+        pos = 0
+        complete = True
+        for match in token.finditer(buf):
+            kind = match.lastgroup  # grupa zewnętrzna zamyka się po `name_v`; None dla pominiętej sekcji
+            if kind == "end":
+                yield mpn, availability
+                mpn = availability = None
+            elif kind == "mpn":
+                if mpn is None:
+                    mpn = text(match.group("mpn_v") or b"")
+            elif kind == "availability":
+                if availability is None:
+                    availability = text(match.group("availability_v") or b"")
+            elif kind == "open":
+                complete = False
+                break
+            pos = match.end()
+        tail = buf[pos:] if not complete else buf[max(pos, len(buf) - _STOCK_TAIL):]
+
+
+def decode_numbers(row: Dict[str, Optional[str]]) -> Tuple[Dict[str, Union[int, float]], List[str]]:
+    """Wartości NUMERIC_FIELDS z wiersza i lista błędów dla tego produktu.
+
+    Zła wartość (np. g:price="abc") nie przerywa czytania feedu – trafia na listę
+    błędów, a skrypt decyduje, co zrobić z produktem (zwykle go pomija).
+    """
+    values = {}
+    errors = []
+    for name, (kind, default) in NUMERIC_FIELDS.items():
+        if name not in row:  # np. wiersz trybu stock-only bez ceny
+            continue
+        raw = row[name]
+        if raw is None:
+            values[name] = default
+            continue
+        try:
+            values[name] = kind(raw)
+        except ValueError:
+            values[name] = default
+            errors.append(f"{ITEM_FIELDS[name]}={raw!r}")
+    return values, errors
+
+
+class FeedProgress:
+    """Postęp czytania feedu w bajtach i produktach, wypisywany co PROGRESS_INTERVAL s."""
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL):
+        self.interval = interval
+        self.total: Optional[int] = None
+        self.bytes_read = 0
+        self.items = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def count(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def item_done(self):
+        self.items += 1
+        if self.interval and time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        mb = self.bytes_read // 1_000_000
+        size = f"{mb}/{self.total // 1_000_000} MB" if self.total else f"{mb} MB"
+        msg = f"FEED: {size} | {self.items} produktów"
+        logging.info(msg)
+        print(msg)
+
+    def finish(self):
+        msg = (f"FEED: wczytano {self.bytes_read / 1e6:.1f} MB, {self.items} produktów "
+               f"w {time.monotonic() - self.started:.1f} s")
+        logging.info(msg)
+        print(msg)
+
+
+def _parse_feed(source, url: str, progress: bool, parse=None) -> Iterator:
+    """Parsuje kawałki z `source` (contextmanager jak feed_chunks) przez `parse` (domyślnie iter_items); błędy jako FeedError."""
+    parse = parse or iter_items
+    tracker = FeedProgress(PROGRESS_INTERVAL if progress else 0)
+    try:
+        with source as (chunks, total):
+            tracker.total = total
+            for item in parse(tracker.count(chunks)):
+                yield item
+                tracker.item_done()
+    except requests.exceptions.RequestException as e:
+        raise FeedError(f"Błąd podczas pobierania XML z URL {url}: {str(e)}") from e
+    except ET.ParseError as e:
+        raise FeedError(f"Błąd podczas parsowania XML: {str(e)}") from e
+    except OSError as e:
+        raise FeedError(f"Błąd podczas odczytu XML {url}: {str(e)}") from e
+    if progress:
+        tracker.finish()
+
+
+def iter_feed(url: str, progress: bool = True) -> Iterator[ET.Element]:
+    """Elementy `<item>` feedu spod `url` w trakcie pobierania; błędy pobierania/parsowania jako FeedError."""
+    return _parse_feed(feed_chunks(url), url, progress)
+
+
+def fingerprint(obj) -> str:
+    """Krótki skrót danych JSON (np. mapy SKU -> product_id) do porównań między przebiegami.
+
+    Obiekt z gotowym `content_fingerprint` (indeks SKU z bl_sku_index) zwraca
+    skrót policzony przy jego budowie – ten sam, co dla odpowiadającego mu dict.
+    """
+    if hasattr(obj, "content_fingerprint"):
+        return obj.content_fingerprint
+    data = json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class FeedCache:
+    """Warunkowe pobieranie feedu z kopią na dysku i skrótem treści.
+
+    Ostatnia treść feedu jest trzymana w `FEED_CACHE_DIR` (gzip) razem z ETag,
+    Last-Modified i sha256. Kolejne pobranie wysyła If-None-Match /
+    If-Modified-Since, a na 304 parsuje kopię z dysku. Po udanym przebiegu
+    skrypt woła `mark_pushed()`, a `already_pushed()` mówi, czy ten sam feed
+    (przy tym samym `context`, np. skrócie sku_to_id) został już wysłany przez
+    ten job – wtedy cały przebieg można pominąć. --force-feed wyłącza pomijanie.
+    """
+
+    def __init__(self, url: str, job: str, cache_dir: str = FEED_CACHE_DIR, force: bool = FORCE_FEED):
+        self.url = url
+        self.job = job
+        self.force = force
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        self.body_path = os.path.join(cache_dir, f"{key}.xml.gz")
+        self.meta_path = os.path.join(cache_dir, f"{key}.json")
+        self.cache_dir = cache_dir
+        self.sha256: Optional[str] = None  # znany po wczytaniu całego feedu
+        self.not_modified = False
+
+    def _load_meta(self) -> Dict:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, update: Dict):
+        meta = self._load_meta()  # ponowny odczyt – inny job mógł dopisać swoje "pushed"
+        meta.update(update)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.meta_path)
+        except OSError as e:
+            logging.warning(f"Nie można zapisać metadanych cache feedu {self.meta_path}: {str(e)}")
+
+    @contextmanager
+    def _chunks(self) -> Iterator[Tuple[Iterator[bytes], Optional[int]]]:
+        hasher = hashlib.sha256()
+        state = {"complete": False, "size": 0}
+
+        def tee(chunks, sink=None):
+            for chunk in chunks:
+                hasher.update(chunk)
+                state["size"] += len(chunk)
+                if sink is not None:
+                    sink.write(chunk)
+                yield chunk
+            state["complete"] = True
+
+        if local_path(self.url) is not None:
+            with feed_chunks(self.url) as (chunks, total):
+                yield tee(chunks), total
+            if state["complete"]:
+                self.sha256 = hasher.hexdigest()
+            return
+
+        meta = self._load_meta()
+        headers = {}
+        if os.path.exists(self.body_path) and meta.get("sha256"):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        with requests.get(self.url, stream=True, timeout=FEED_TIMEOUT, headers=headers) as response:
+            if response.status_code == 304 and headers:
+                self.not_modified = True
+                logging.info(f"Feed bez zmian (304) – używam kopii z {self.body_path}.")
+                print("Feed bez zmian od ostatniego pobrania (304) – używam kopii z dysku.")
+                self.sha256 = meta["sha256"]  # wersja znana bez czytania treści
+                with gzip.open(self.body_path, "rb") as f:
+                    yield iter(lambda: f.read(CHUNK_SIZE), b""), meta.get("size")
+                return
+
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            total = int(length) if length and not response.headers.get("Content-Encoding") else None
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self.body_path}.{os.getpid()}.tmp"
+            try:
+                with gzip.open(tmp_path, "wb", compresslevel=6) as sink:
+                    yield tee(response.iter_content(CHUNK_SIZE), sink), total
+                if state["complete"]:
+                    self.sha256 = hasher.hexdigest()
+                    os.replace(tmp_path, self.body_path)
+                    self._save_meta({
+                        "url": self.url,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "sha256": self.sha256,
+                        "size": state["size"],
+                        "fetched_at": time.time(),
+                    })
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def iter_items(self, progress: bool = True) -> Iterator[ET.Element]:
+        """Jak iter_feed(), ale z pobieraniem warunkowym i zapisem kopii feedu."""
+        return _parse_feed(self._chunks(), self.url, progress)
+
+    def iter_stock(self, progress: bool = True) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+        """Jak iter_items(), ale tylko (g:mpn, g:availability) przez iter_stock()."""
+        return _parse_feed(self._chunks(), self.url, progress, iter_stock)
+
+    def _pushed_key(self, context: str) -> Optional[str]:
+        return f"{self.sha256}:{context}" if self.sha256 else None
+
+    def already_pushed(self, context: str = "") -> bool:
+        """True, jeśli ten sam feed (i `context`) został już w całości wysłany przez ten job.
+
+        Przy 304 i pliku lokalnym sha256 jest znany od razu; przy zwykłym 200
+        (także bez ETag/Last-Modified) dopiero po przeczytaniu całej treści.
+        """
+        if self.force:
+            return False
+        key = self._pushed_key(context)
+        return key is not None and self._load_meta().get("pushed", {}).get(self.job) == key
+
+    def mark_pushed(self, context: str = ""):
+        """Zapamiętuje bieżący feed jako wysłany w całości przez ten job."""
+        key = self._pushed_key(context)
+        if key is None:
+            return
+        pushed = self._load_meta().get("pushed", {})
+        pushed[self.job] = key
+        self._save_meta({"pushed": pushed})
+
+
+def _memory_benchmark(sizes=(30_000, 100_000, 500_000)):
+    """Szczytowa pamięć (tracemalloc) przy czytaniu feedu o różnej liczbie produktów."""
+    import tempfile
+    import tracemalloc
+
+    from bl_mock_server import generate_feed
+
+    for items in sizes:
+        fd, path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in generate_feed(items):
+                f.write(chunk)
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            count = sum(1 for item in iter_feed(f"file://{path}", progress=False) if item.findtext("g:mpn", namespaces=NS))
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{items:>7} produktów ({os.path.getsize(path) / 1e6:.0f} MB): {count} sparsowano w {elapsed:.1f} s, "
+                  f"szczyt pamięci {peak / 1e6:.2f} MB")
+        finally:
+            os.remove(path)
+
+
+def _find_twice(item: ET.Element) -> Dict:
+    """Dekodowanie jak przed read_item(): find() na test i drugi raz na .text (punkt odniesienia w benchmarku)."""
+    namespace = NS
+    price = float(item.find("g:price", namespace).text) if item.find("g:price", namespace) is not None else 0.0
+    quantity = int(item.find("g:availability", namespace).text) if item.find("g:availability", namespace) is not None else 0
+    gtin_el = item.find("g:gtin", namespace)
+    ean = (gtin_el.text or "").strip() if gtin_el is not None else ""
+    nx = (item.find("NX_StockCategory").text if item.find("NX_StockCategory") is not None else "").strip()
+    category = nx if nx else item.find("g:product_type", namespace).text if item.find("g:product_type", namespace) is not None else ""
+    erp_id = (item.find("g:id", namespace).text if item.find("g:id", namespace) is not None else "").strip()
+    mpn_el = item.find("g:mpn", namespace)
+    mpn = (mpn_el.text or "").strip() if mpn_el is not None else ""
+    title_elem = item.find("title")
+    title = (title_elem.text if title_elem is not None and title_elem.text else "").strip()
+    if not title:
+        desc_elem = item.find("description")
+        title = (desc_elem.text if desc_elem is not None and desc_elem.text else "").strip()
+    brand_el = item.find("g:brand", namespace)
+    brand = (brand_el.text or "").strip() if brand_el is not None else ""
+    img_elem = item.find("g:image_link", namespace)
+    image_link = img_elem.text.strip() if img_elem is not None and img_elem.text else ""
+    description = item.find("g:description", namespace).text if item.find("g:description", namespace) is not None else ""
+    return {"sku": mpn, "price": price, "quantity": quantity, "ean": ean, "category": category, "erp_id": erp_id,
+            "title": title, "brand": brand, "image_link": image_link, "description": description}
+
+
+def _decode_table(item: ET.Element) -> Dict:
+    """To samo co _find_twice(), ale przez read_item() + decode_numbers()."""
+    row = read_item(item)
+    numbers, _ = decode_numbers(row)
+    title = (row["title"] or "").strip() or (row["description"] or "").strip()
+    return {"sku": (row["mpn"] or "").strip(), "price": numbers["price"], "quantity": numbers["availability"],
+            "ean": (row["gtin"] or "").strip(), "category": (row["stock_category"] or "").strip() or row["product_type"] or "",
+            "erp_id": (row["erp_id"] or "").strip(), "title": title, "brand": (row["brand"] or "").strip(),
+            "image_link": (row["image_link"] or "").strip(), "description": row["g_description"] or ""}
+
+
+def _decoder_benchmark(items: int = 30_000, rounds: int = 5):
+    """Czas samego dekodowania <item> (bez parsowania XML): find() x2 na pole vs tablica tag -> pole."""
+    from bl_mock_server import generate_feed
+
+    root = ET.fromstring(b"".join(generate_feed(items)))
+    elements = root.findall("./channel/item")
+    assert [_find_twice(e) for e in elements] == [_decode_table(e) for e in elements]
+    for name, decode in (("find() x2", _find_twice), ("tablica tag->pole", _decode_table)):
+        best = min(_timed(lambda: [decode(e) for e in elements]) for _ in range(rounds))
+        print(f"{name:>18}: {len(elements)} produktów w {best * 1000:.0f} ms ({best / len(elements) * 1e6:.2f} µs/produkt)")
+
+
+def _timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+_G = 'xmlns:g="http://base.google.com/ns/1.0"'
+# (nazwa, feed) – przypadki brzegowe skanera stock-only; każdy musi dać to samo co read_item()
+_STOCK_EDGE_FEEDS = [
+    ("CDATA z </item> i komentarze", (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" {_G}><channel>\n'
+        + "".join(
+            f"<item><g:mpn>CD-{i}</g:mpn><g:description><![CDATA[opis </item> <item><g:mpn>FAKE</g:mpn> "
+            f"<!-- ]]></g:description><!-- <g:mpn>KOM</g:mpn> </item> <![CDATA[ -->"
+            f"<g:availability>{i}</g:availability></item>\n"
+            for i in range(20)
+        ) + "</channel></rss>\n").encode("utf-8")),
+    ("atrybuty, spacje i puste elementy", (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" {_G}><channel>\n'
+        '<item><g:mpn type="x">AT-1</g:mpn ><g:availability unit=\'szt\'>3</g:availability></item>\n'
+        "<item><g:mpn >AT-2</g:mpn><g:availability>\r\n4\r\n</g:availability></item>\n"
+        "<item><g:mpn/><g:availability /></item>\n"
+        '<item><g:mpn type="x"/><g:availability>5</g:availability></item>\n'
+        "<item><g:mpnx>NIE</g:mpnx><g:availability>6</g:availability></item>\n"
+        "<item/>\n"
+        "</channel></rss>\n").encode("utf-8")),
+    ("tekst mieszany z CDATA, komentarzem i encjami", (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" {_G}><channel>\n'
+        "<item><g:mpn>A&amp;<![CDATA[<B>]]><!-- x -->C&#38;</g:mpn><g:availability>1</g:availability></item>\n"
+        "<item><g:mpn>Zażółć</g:mpn><g:mpn>DRUGI</g:mpn></item>\n"
+        "</channel></rss>\n").encode("utf-8")),
+    ("inny prefiks przestrzeni nazw i BOM", UTF8_BOM + (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:google="http://base.google.com/ns/1.0"><channel>\n'
+        + "".join(f"<item><google:mpn>PF-{i}</google:mpn><google:availability>{i}</google:availability></item>\n"
+                  for i in range(20))
+        + "</channel></rss>\n").encode("utf-8")),
+]
+
+
+def _check_stock_edge_cases(chunk_sizes: Iterable[int] = (1, 7, 64, 1 << 20)) -> List[str]:
+    """Porównuje iter_stock() z read_item() dla _STOCK_EDGE_FEEDS przy różnych kawałkach; zwraca nazwy różnic."""
+    failed = []
+    for name, content in _STOCK_EDGE_FEEDS:
+        full = [(row["mpn"], row["availability"]) for row in map(read_item, iter_items([content]))]
+        same = all(
+            list(iter_stock(content[i:i + size] for i in range(0, len(content), size))) == full
+            for size in chunk_sizes
+        )
+        print(f"  {name}: {len(full)} produktów, wynik {'identyczny' if same else 'RÓŻNY!'}")
+        if not same:
+            failed.append(name)
+    return failed
+
+
+def _stock_benchmark(items: int = 100_000):
+    """Skaner stock-only vs pełny parser (read_item): ten sam wynik, czas przejścia feedu.
+
+    Kończy się kodem 1, jeśli skaner różni się od pełnego parsera (przypadki brzegowe albo duży feed).
+    """
+    from bl_mock_server import generate_feed
+
+    print("Przypadki brzegowe:")
+    failed = _check_stock_edge_cases()
+
+    chunks = [UTF8_BOM] + list(generate_feed(items))
+    # CDATA i encje w kilku produktach, żeby sprawdzić też te ścieżki
+    chunks[1] = chunks[1].replace(b"<g:mpn>MPN-0000001</g:mpn>", b"<g:mpn><![CDATA[MPN-0000001]]></g:mpn>")
+    chunks[1] = chunks[1].replace(b"<g:mpn>MPN-0000002</g:mpn>", b"<g:mpn>MPN&amp;0000002</g:mpn>")
+    started = time.perf_counter()
+    full = [(row["mpn"], row["availability"]) for row in map(read_item, iter_items(chunks))]
+    full_time = time.perf_counter() - started
+    started = time.perf_counter()
+    stock = list(iter_stock(chunks))
+    stock_time = time.perf_counter() - started
+    print(f"{items} produktów: pełny parser {full_time:.2f} s, stock-only {stock_time:.2f} s "
+          f"(x{full_time / stock_time:.1f}), wynik {'identyczny' if stock == full else 'RÓŻNY!'}")
+    if stock != full:
+        failed.append(f"{items} produktów")
+    if failed:
+        raise SystemExit(f"Skaner stock-only różni się od pełnego parsera: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    if "--decoder" in sys.argv:
+        _decoder_benchmark()
+    elif "--stock" in sys.argv:
+        _stock_benchmark()
+    else:
+        _memory_benchmark()
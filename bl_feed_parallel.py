@@ -0,0 +1,227 @@
+import mmap
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bl_feed import ITEM_FIELDS, PROGRESS_INTERVAL, UTF8_BOM, FeedError, FeedProgress, read_item
+
+FEED_WORKERS = int(os.environ.get("FEED_WORKERS", 1))  # >1: lokalny feed (file://) parsowany w tylu procesach
+RANGE_SIZE = 8 * 1024 * 1024  # bajty – docelowy rozmiar fragmentu pliku dla jednego zadania
+
+FIELDS = tuple(ITEM_FIELDS)
+_XML_DECL = re.compile(rb"\s*(<\?xml[^>]*\?>)")
+_XMLNS = re.compile(rb"""xmlns(?::[\w.-]+)?\s*=\s*(?:"[^"]*"|'[^']*')""")
+_SECTIONS = ((b"<![CDATA[", b"]]>"), (b"<!--", b"-->"))  # tekst, w którym `</item>` nie jest znacznikiem
+
+
+def _find_item(buf, pos: int, end: int) -> int:
+    """Pozycja następnego `<item>` / `<item ...>` od `pos` (nie `<items>` itp.) albo -1."""
+    while True:
+        i = buf.find(b"<item", pos, end)
+        if i < 0 or buf[i + 5:i + 6] in (b">", b" ", b"\t", b"\r", b"\n", b"/"):
+            return i
+        pos = i + 5
+
+
+def _item_end(buf, pos: int, target: int, stop: int) -> int:
+    """Koniec pierwszego `</item>` od `target` leżącego poza CDATA i komentarzami albo -1.
+
+    `pos` (<= target) to pozycja na pewno poza nimi (granica produktu); sekcje
+    między `pos` a kandydatem są przeskakiwane w całości.
+    """
+    while True:
+        close = buf.find(b"</item>", max(pos, target), stop)
+        if close < 0:
+            return -1
+        section = buf.find(b"<!", pos, close)
+        if section < 0:
+            return close + len(b"</item>")
+        pos = section + 2
+        for opener, closer in _SECTIONS:
+            if buf[section:section + len(opener)] == opener:
+                end = buf.find(closer, section + len(opener), stop)
+                if end < 0:
+                    return -1  # niezamknięta sekcja – błąd zgłosi parser
+                pos = end + len(closer)
+                break
+
+
+def item_ranges(buf, parts: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """Dzieli feed na `parts` zakresów bajtów zaczynających się i kończących na granicy `<item>`.
+
+    Zwraca też prolog dla fragmentów: deklarację XML (kodowanie) i element
+    z deklaracjami przestrzeni nazw z nagłówka feedu, żeby każdy zakres dał się
+    sparsować osobno. `</item>` w CDATA i komentarzach nie jest granicą.
+    """
+    size = len(buf)
+    first = _find_item(buf, 0, size)
+    if first < 0:
+        return b"", []
+    header = bytes(buf[:first])
+    if header.startswith(UTF8_BOM):
+        header = header[len(UTF8_BOM):]
+    decl = _XML_DECL.match(header)
+    prolog = (decl.group(1) if decl else b"") + b"<feed " + b" ".join(_XMLNS.findall(header)) + b">"
+
+    last = buf.rfind(b"</item>")
+    stop = last + len(b"</item>") if last >= first else size
+    step = max(1, (stop - first) // max(1, parts))
+    ranges = []
+    start = first
+    while start < stop:
+        end = _item_end(buf, start, min(start + step, stop - 1), stop)
+        if end < 0:
+            end = stop
+        ranges.append((start, end))
+        start = end
+    return prolog, ranges
+
+
+def _parse_range(path: str, prolog: bytes, start: int, end: int) -> List[Tuple]:
+    """Zadanie procesu roboczego: pola ITEM_FIELDS produktów z zakresu [start, end) pliku (krotki)."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        parser = ET.XMLParser()
+        parser.feed(prolog)
+        parser.feed(buf[start:end])
+        parser.feed(b"</feed>")
+        root = parser.close()
+    return [tuple(read_item(item).values()) for item in root.iter("item")]
+
+
+def iter_rows_parallel(path: str, workers: int = FEED_WORKERS, progress: bool = True,
+                       range_size: int = RANGE_SIZE) -> Iterator[Dict[str, Optional[str]]]:
+    """Jak read_item() po iter_feed(), ale zakresy pliku są parsowane w `workers` procesach.
+
+    Wyniki wracają w kolejności z pliku; w locie jest najwyżej 2 * workers
+    zakresów, więc pamięć nie rośnie z rozmiarem feedu. Błędy jako FeedError.
+    """
+    tracker = FeedProgress(PROGRESS_INTERVAL if progress else 0)
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            tracker.total = len(buf)
+            prolog, ranges = item_ranges(buf, max(workers, len(buf) // range_size))
+    except (OSError, ValueError) as e:  # ValueError: mmap pustego pliku
+        raise FeedError(f"Błąd podczas odczytu XML {path}: {str(e)}") from e
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        queued = iter(ranges)
+        pending = deque()
+        for start, end in queued:
+            pending.append((end - start, pool.submit(_parse_range, path, prolog, start, end)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            size, future = pending.popleft()
+            try:
+                rows = future.result()
+            except ET.ParseError as e:
+                raise FeedError(f"Błąd podczas parsowania XML: {str(e)}") from e
+            except OSError as e:
+                raise FeedError(f"Błąd podczas odczytu XML {path}: {str(e)}") from e
+            for start, end in queued:
+                pending.append((end - start, pool.submit(_parse_range, path, prolog, start, end)))
+                break
+            tracker.bytes_read += size
+            for values in rows:
+                yield dict(zip(FIELDS, values))
+                tracker.item_done()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    if progress:
+        tracker.finish()
+
+
+def _serial_rows(path: str) -> List[Dict]:
+    from bl_feed import iter_feed
+    return [read_item(item) for item in iter_feed(f"file://{path}", progress=False)]
+
+
+_G = 'xmlns:g="http://base.google.com/ns/1.0"'
+# (nazwa, feed) – przypadki brzegowe podziału na zakresy; każdy musi dać to samo co parser szeregowy
+_EDGE_FEEDS = [
+    ("CDATA z </item> i komentarze", (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" {_G}><channel>\n'
+        + "".join(
+            f"<item><g:mpn>CD-{i}</g:mpn><g:description><![CDATA[opis </item> <item><g:mpn>FAKE</g:mpn> "
+            f"<!-- ]]></g:description><!-- </item> <![CDATA[ --><g:availability>{i}</g:availability></item>\n"
+            for i in range(40)
+        ) + "</channel></rss>\n").encode("utf-8")),
+    ("BOM i deklaracja XML", UTF8_BOM + (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" {_G}><channel>\n'
+        + "".join(f"<item><g:mpn>BOM-{i}</g:mpn><title>Zażółć {i}</title></item>\n" for i in range(40))
+        + "</channel></rss>\n").encode("utf-8")),
+    ("prolog bez xmlns i deklaracji", (
+        "<rss><channel><items>\n"
+        + "".join(f"<item {_G}><g:mpn>NS-{i}</g:mpn><title>T{i}</title></item>\n" for i in range(40))
+        + "</items></channel></rss>\n").encode("utf-8")),
+]
+
+
+def _check_edge_cases(workers: int = 2, range_size: int = 256) -> List[str]:
+    """Porównuje wynik równoległy z szeregowym dla _EDGE_FEEDS (małe zakresy = dużo granic); zwraca nazwy różnic."""
+    import tempfile
+
+    failed = []
+    for name, content in _EDGE_FEEDS:
+        fd, path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        try:
+            serial = _serial_rows(path)
+            try:
+                rows = list(iter_rows_parallel(path, workers, progress=False, range_size=range_size))
+            except FeedError as e:
+                rows = e
+            same = rows == serial
+            print(f"  {name}: {len(serial)} produktów, wynik {'identyczny' if same else 'RÓŻNY!'}")
+            if not same:
+                failed.append(name)
+        finally:
+            os.remove(path)
+    return failed
+
+
+def _benchmark(items: int = 200_000, workers=None):
+    """Równoważność z parserem szeregowym (przypadki brzegowe + duży feed) i czas parsowania dla 1..N procesów.
+
+    Kończy się kodem 1, jeśli którykolwiek wynik różni się od parsera szeregowego.
+    """
+    import tempfile
+
+    from bl_mock_server import generate_feed
+
+    print("Przypadki brzegowe:")
+    failed = _check_edge_cases()
+    workers = workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, "wb") as f:
+        f.write(UTF8_BOM)
+        for chunk in generate_feed(items):
+            f.write(chunk)
+    try:
+        started = time.perf_counter()
+        serial = _serial_rows(path)
+        base = time.perf_counter() - started
+        print(f"{items} produktów ({os.path.getsize(path) / 1e6:.0f} MB), rdzeni: {os.cpu_count()}")
+        print(f"  szeregowo: {base:.2f} s")
+        for n in workers:
+            started = time.perf_counter()
+            rows = list(iter_rows_parallel(path, n, progress=False, range_size=4 * 1024 * 1024))
+            elapsed = time.perf_counter() - started
+            same = rows == serial
+            print(f"  {n} proc.: {elapsed:.2f} s (x{base / elapsed:.2f}), wynik {'identyczny' if same else 'RÓŻNY!'}")
+            if not same:
+                failed.append(f"{items} produktów, {n} proc.")
+    finally:
+        os.remove(path)
+    if failed:
+        raise SystemExit(f"Wynik równoległy różni się od szeregowego: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,518 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Wspólny rejestr limitu dla wszystkich procesów na tej maszynie
+DEFAULT_LEDGER_PATH = os.path.join(tempfile.gettempdir(), "baselinker_rate_ledger.sqlite")
+
+QUERY_LIMIT_MARKER = "Query limit exceeded"
+BLOCK_MARGIN = float(os.environ.get("BLOCK_MARGIN", 5))  # Zapas (s) po czasie odblokowania tokena
+MAX_BLOCK_PAUSE = 3600  # Dłuższa "blokada" to raczej zły zegar/format – używamy fallbacku
+BASELINKER_TZ = os.environ.get("BASELINKER_TZ", "Europe/Warsaw")  # strefa czasu w "token blocked until ..."
+_BLOCKED_UNTIL_RE = re.compile(r"blocked until (\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})")
+
+# Pasy priorytetu i ich wagi: aktywne pasy dzielą budżet tokena proporcjonalnie do wag
+LANE_WEIGHTS = {
+    "stock": 8,     # stany magazynowe (update_products) – najpierw
+    "prices": 4,    # ceny (update_products)
+    "create": 2,    # dodawanie produktów i kategorii (add_products)
+    "default": 2,   # odczyty metadanych, synchronizacja SKU
+    "backfill": 1,  # uzupełnianie pól w tle (update_erp)
+}
+LANE_MIN_SHARE = {"backfill": 0.1}  # gwarantowany udział – backfill nigdy nie stoi w miejscu
+DEFAULT_LANE = "default"
+LANE_ACTIVE_WINDOW = 3.0  # s – pas bez zapytań dłużej niż tyle oddaje swój udział innym
+MAX_AHEAD = 2.0  # s – jak daleko naprzód pas może rezerwować sloty (ogranicza przestrzał przy zmianie udziałów)
+BURST_LANE = "*"  # wiersz wspólnego dla pasów licznika burstu (TAT kredytów), nie pas
+
+
+def lane_shares(active: Iterable[str]) -> Dict[str, float]:
+    """Dzieli budżet (1.0) między aktywne pasy proporcjonalnie do wag.
+
+    Pas, któremu z proporcji wyszłoby mniej niż LANE_MIN_SHARE, dostaje minimum,
+    a reszta jest dzielona między pozostałe pasy.
+    """
+    pending = {lane: LANE_WEIGHTS.get(lane, LANE_WEIGHTS[DEFAULT_LANE]) for lane in active}
+    shares = {}
+    remaining = 1.0
+    while pending:
+        total = sum(pending.values())
+        floored = [lane for lane, w in pending.items() if remaining * w / total < LANE_MIN_SHARE.get(lane, 0)]
+        if not floored:
+            for lane, w in pending.items():
+                shares[lane] = remaining * w / total
+            break
+        for lane in floored:
+            shares[lane] = min(LANE_MIN_SHARE[lane], remaining)
+            remaining -= shares[lane]
+            del pending[lane]
+    return shares
+
+
+def _reserve_lane(lanes: Dict[str, Tuple[float, float]], lane: str, now: float, per_minute: int, burst: int,
+                  not_before: float = 0.0) -> Tuple[Optional[float], Optional[float]]:
+    """Rezerwuje slot w pasie `lane`; `lanes` to {pas: (TAT, ostatnia aktywność)} i jest aktualizowany.
+
+    Pas to GCRA z tempem swojego udziału i tolerancją `burst` - 1 odstępów, ale
+    każda wysyłka przed TAT pasa (z tolerancji) zużywa kredyt ze wspólnego dla
+    tokena licznika BURST_LANE (`burst` - 1 kredytów odnawianych w tempie
+    `per_minute`). Po bezczynności wszystkie pasy razem wysyłają więc od razu
+    najwyżej `burst` - 1 zapytań ponad pierwsze zapytanie każdego pasa, a nie
+    `burst` razy liczba pasów; bez kredytu pas wysyła w swoim tempie (slot = TAT).
+    Zwraca (moment wysyłki, None) albo (None, kiedy spróbować ponownie), gdy
+    najbliższy slot jest dalej niż MAX_AHEAD.
+    """
+    active = {name for name, (_, seen) in lanes.items() if name != BURST_LANE and now - seen < LANE_ACTIVE_WINDOW}
+    active.add(lane)
+    interval = 60.0 / (per_minute * lane_shares(active)[lane])
+    tat = max(lanes.get(lane, (0.0, 0.0))[0], not_before)
+    paced = send_at = max(tat, now)
+    credit_interval = 60.0 / per_minute
+    credit_tat = lanes.get(BURST_LANE, (0.0, 0.0))[0]
+    if burst > 1:
+        # najwcześniej: tolerancja pasa i pierwszy wolny kredyt (GCRA licznika kredytów)
+        send_at = min(paced, max(now, not_before, tat - (burst - 1) * interval,
+                                 credit_tat - (burst - 2) * credit_interval))
+    if send_at - now > MAX_AHEAD:
+        lanes[lane] = (tat, now)  # pas czeka – nadal liczy się jako aktywny
+        return None, send_at - MAX_AHEAD
+    if send_at < paced:
+        lanes[BURST_LANE] = (max(credit_tat, send_at) + credit_interval, now)
+    lanes[lane] = (paced + interval, now)
+    return send_at, None
+
+
+class _FifoGate:
+    """Kolejka biletów: wątki przechodzą przez bramkę w kolejności przyjścia (threading.Lock tego nie gwarantuje)."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+
+    def __enter__(self):
+        with self.cond:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while self.serving != ticket:
+                self.cond.wait()
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.serving += 1
+            self.cond.notify_all()
+
+
+class _LaneGates:
+    """Bramka FIFO per pas: rezerwuje tylko pierwszy czekający pasa, reszta stoi za nim w kolejności.
+
+    Odroczony (slot dalej niż MAX_AHEAD) czeka w bramce do dokładnego momentu
+    ponowienia, zamiast ścigać się z pozostałymi po losowym opóźnieniu. Wątki
+    używają _FifoGate, zadania asyncio – asyncio.Lock (też FIFO) pętli, w której działają.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads: Dict[str, _FifoGate] = {}
+        self.tasks: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = {}
+
+    def thread_gate(self, lane: str) -> _FifoGate:
+        with self.lock:
+            return self.threads.setdefault(lane, _FifoGate())
+
+    def task_gate(self, lane: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            entry = self.tasks.get(lane)
+            if entry is None or entry[0] is not loop:
+                entry = self.tasks[lane] = (loop, asyncio.Lock())
+            return entry[1]
+
+
+class RateLimiter:
+    """Wspólny limiter zapytań do BaseLinker (GCRA / token bucket) z pasami priorytetu.
+
+    Zamiast liczyć wywołania w oknie 60 s, każdy wątek pod lockiem rezerwuje
+    dokładny, przyszły moment wysyłki (slot). Każdy pas priorytetu (LANE_WEIGHTS)
+    ma własny TAT, a odstęp między jego slotami wynika z udziału pasa w budżecie
+    (`lane_shares`), więc stany i ceny nie czekają w kolejce za backfillem.
+    W obrębie pasa sloty są przydzielane w kolejności zgłoszeń (FIFO, _LaneGates).
+    `burst` to liczba zapytań, które można wysłać od razu po okresie bezczynności
+    (łącznie we wszystkich pasach).
+    """
+
+    def __init__(self, per_minute: int, burst: int = 1):
+        if per_minute <= 0:
+            raise ValueError("per_minute musi być > 0")
+        self.per_minute = per_minute
+        self.burst = max(1, int(burst))
+        self.lock = threading.Lock()
+        self.lanes: Dict[str, Tuple[float, float]] = {}
+        self.paused_until = 0.0
+        self.gates = _LaneGates()
+
+    def try_reserve(self, lane: str = DEFAULT_LANE) -> Tuple[Optional[float], Optional[float]]:
+        """Rezerwuje slot (czasy monotonic); patrz `_reserve_lane`."""
+        with self.lock:
+            return _reserve_lane(self.lanes, lane, time.monotonic(), self.per_minute, self.burst, self.paused_until)
+
+    def pause_until(self, until: float) -> bool:
+        """Wstrzymuje wszystkie wątki do czasu `until` (time.time()).
+
+        Zwraca True, jeśli pauza została wydłużona (pierwszy wątek, który ją zgłosił).
+        """
+        until_mono = time.monotonic() + (until - time.time())
+        with self.lock:
+            if until_mono <= self.paused_until:
+                return False
+            self.paused_until = until_mono  # nowe sloty dopiero po odblokowaniu
+            return True
+
+    async def pause_until_async(self, until: float) -> bool:
+        return self.pause_until(until)  # tylko lock w pamięci – bez czekania
+
+    def _paused_for(self) -> float:
+        with self.lock:
+            return self.paused_until - time.monotonic()
+
+    def wait(self, lane: str = DEFAULT_LANE):
+        """Blokuje wątek do momentu przydzielonego slotu (i końca ewentualnej pauzy)."""
+        while True:
+            with self.gates.thread_gate(lane):
+                send_at, retry_at = self.try_reserve(lane)
+                while send_at is None:
+                    time.sleep(max(0.0, retry_at - time.monotonic()))
+                    send_at, retry_at = self.try_reserve(lane)
+            sleep_for = send_at - time.monotonic()  # już poza bramką – następny w kolejce rezerwuje kolejny slot
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            if self._paused_for() <= 0:
+                return
+            # slot przypadł przed/na pauzę ogłoszoną w międzyczasie – nowy slot po pauzie
+
+    async def wait_async(self, lane: str = DEFAULT_LANE):
+        """Odpowiednik wait() dla asyncio – czeka bez blokowania pętli zdarzeń."""
+        while True:
+            async with self.gates.task_gate(lane):
+                send_at, retry_at = self.try_reserve(lane)
+                while send_at is None:
+                    await asyncio.sleep(max(0.0, retry_at - time.monotonic()))
+                    send_at, retry_at = self.try_reserve(lane)
+            sleep_for = send_at - time.monotonic()
+            if sleep_for > 0:
+                await asyncio.sleep(sleep_for)
+            if self._paused_for() <= 0:
+                return
+
+
+class SharedRateLimiter:
+    """Limiter współdzielony przez wszystkie procesy używające tego samego tokena.
+
+    Stan pasów (TAT i ostatnia aktywność) trzymany jest w małej bazie SQLite,
+    a każda rezerwacja slotu to krótka transakcja `BEGIN IMMEDIATE`, więc
+    równoległe skrypty (cron + GUI) razem nie przekroczą `per_minute`, a stany
+    z update_products dostają sloty przed backfillem z update_erp, nawet gdy
+    działają w osobnych procesach. `share` (0–1] ogranicza dodatkowo tempo
+    samego procesu, żeby jeden job nie zajął całego budżetu tokena. W procesie
+    rezerwuje tylko pierwszy czekający pasa (_LaneGates, FIFO), więc z każdego
+    procesu o slot pasa ubiega się jeden wątek naraz, ponawiając dokładnie wtedy,
+    gdy slot wejdzie w okno MAX_AHEAD.
+    """
+
+    def __init__(self, per_minute: int, token: str, burst: int = 1, share: float = 1.0,
+                 ledger_path: Optional[str] = None):
+        if per_minute <= 0:
+            raise ValueError("per_minute musi być > 0")
+        if not 0 < share <= 1:
+            raise ValueError("share musi być z przedziału (0, 1]")
+        self.per_minute = per_minute
+        self.burst = max(1, int(burst))
+        self.share = share
+        self.key = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]  # nie zapisujemy tokena
+        self.ledger_path = ledger_path or os.environ.get("RATE_LEDGER", DEFAULT_LEDGER_PATH)
+        self.local = RateLimiter(max(1, int(per_minute * share)), burst=burst) if share < 1 else None
+        self.lock = threading.Lock()
+        self.gates = _LaneGates()
+        # wait_async(): transakcje rejestru w osobnym wątku (tworzony przy pierwszym użyciu). Jeden wystarczy –
+        # transakcje i tak idą po kolei pod self.lock – i nie zajmuje domyślnej puli pętli (np. resolver DNS aiohttp)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-ledger")
+        self.conn = sqlite3.connect(self.ledger_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")  # rejestr jest tymczasowy – fsync niepotrzebny
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_lanes ("
+            "token_key TEXT NOT NULL, lane TEXT NOT NULL, tat REAL NOT NULL, last_active REAL NOT NULL, "
+            "PRIMARY KEY (token_key, lane))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_pause (token_key TEXT PRIMARY KEY, paused_until REAL NOT NULL)"
+        )
+
+    def _transaction(self, fn):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def _paused_until(self) -> float:
+        row = self.conn.execute("SELECT paused_until FROM rate_pause WHERE token_key = ?", (self.key,)).fetchone()
+        return row[0] if row else 0.0
+
+    def try_reserve(self, lane: str = DEFAULT_LANE) -> Tuple[Optional[float], Optional[float]]:
+        """Rezerwuje slot pasa we wspólnym rejestrze (czasy time.time()); patrz `_reserve_lane`."""
+        def reserve():
+            lanes = {
+                name: (tat, last_active) for name, tat, last_active in self.conn.execute(
+                    "SELECT lane, tat, last_active FROM rate_lanes WHERE token_key = ?", (self.key,)
+                )
+            }
+            result = _reserve_lane(lanes, lane, time.time(), self.per_minute, self.burst, self._paused_until())
+            self.conn.executemany(
+                "INSERT INTO rate_lanes (token_key, lane, tat, last_active) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(token_key, lane) DO UPDATE SET tat = excluded.tat, last_active = excluded.last_active",
+                [(self.key, name) + lanes[name] for name in (lane, BURST_LANE) if name in lanes],
+            )
+            return result
+
+        return self._transaction(reserve)
+
+    def pause_until(self, until: float) -> bool:
+        """Wstrzymuje wszystkie procesy tego tokena do czasu `until` (time.time())."""
+        def pause():
+            if until <= self._paused_until():
+                return False
+            self.conn.execute(
+                "INSERT INTO rate_pause (token_key, paused_until) VALUES (?, ?) "
+                "ON CONFLICT(token_key) DO UPDATE SET paused_until = excluded.paused_until",
+                (self.key, until),
+            )
+            return True
+
+        if not self._transaction(pause):
+            return False
+        if self.local is not None:
+            self.local.pause_until(until)
+        return True
+
+    async def pause_until_async(self, until: float) -> bool:
+        """pause_until() w wątku limitera (transakcja rejestru poza pętlą zdarzeń)."""
+        return await self._in_executor(self.pause_until, until)
+
+    def _paused_for(self) -> float:
+        with self.lock:
+            return self._paused_until() - time.time()
+
+    def wait(self, lane: str = DEFAULT_LANE):
+        """Czeka na slot procesu (share), a potem na slot pasa we wspólnym budżecie tokena."""
+        while True:
+            if self.local is not None:
+                self.local.wait(lane)
+            with self.gates.thread_gate(lane):
+                send_at, retry_at = self.try_reserve(lane)
+                while send_at is None:
+                    time.sleep(max(0.0, retry_at - time.time()))
+                    send_at, retry_at = self.try_reserve(lane)
+            sleep_for = send_at - time.time()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            if self._paused_for() <= 0:
+                return
+
+    async def _in_executor(self, fn, *args):
+        """Woła `fn` (transakcja SQLite, do 30 s czekania na blokadę rejestru) w wątku limitera."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def wait_async(self, lane: str = DEFAULT_LANE):
+        """Odpowiednik wait() dla asyncio – czeka bez blokowania pętli zdarzeń.
+
+        Rezerwacje w rejestrze idą przez wątek limitera, więc zajęty rejestr
+        (inny proces w transakcji) nie wstrzymuje pozostałych zapytań w locie.
+        """
+        while True:
+            if self.local is not None:
+                await self.local.wait_async(lane)
+            async with self.gates.task_gate(lane):
+                send_at, retry_at = await self._in_executor(self.try_reserve, lane)
+                while send_at is None:
+                    await asyncio.sleep(max(0.0, retry_at - time.time()))
+                    send_at, retry_at = await self._in_executor(self.try_reserve, lane)
+            sleep_for = send_at - time.time()
+            if sleep_for > 0:
+                await asyncio.sleep(sleep_for)
+            if await self._in_executor(self._paused_for) <= 0:
+                return
+
+
+def is_query_limit_error(error_message: Optional[str]) -> bool:
+    return bool(error_message) and QUERY_LIMIT_MARKER in error_message
+
+
+def parse_blocked_until(error_message: str) -> Optional[float]:
+    """Czyta czas odblokowania z "Query limit exceeded, token blocked until YYYY-MM-DD HH:MM:SS".
+
+    BaseLinker podaje czas lokalny (PL), więc interpretujemy go w strefie BASELINKER_TZ,
+    niezależnie od strefy maszyny. Bez bazy stref (np. Windows bez pakietu tzdata)
+    zostaje strefa maszyny.
+    """
+    m = _BLOCKED_UNTIL_RE.search(error_message or "")
+    if not m:
+        return None
+    try:
+        blocked_until = datetime.strptime(m.group(1).replace("T", " "), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+    try:
+        blocked_until = blocked_until.replace(tzinfo=ZoneInfo(BASELINKER_TZ))
+    except (ZoneInfoNotFoundError, ValueError):
+        pass
+    return blocked_until.timestamp()
+
+
+def _block_until(error_message: str, fallback: float, now: float) -> float:
+    until = parse_blocked_until(error_message)
+    if until is None or until > now + MAX_BLOCK_PAUSE:
+        until = now + fallback
+    return max(until, now) + BLOCK_MARGIN
+
+
+def pause_for_block(limiter, error_message: str, fallback: float) -> Optional[float]:
+    """Ustawia globalną pauzę limitera do czasu z komunikatu (+BLOCK_MARGIN).
+
+    Gdy czasu nie da się odczytać (albo jest nierealny), pauzuje na `fallback` sekund.
+    Zwraca długość pauzy w sekundach, jeśli to ten wywołujący ją ustawił, inaczej None.
+    """
+    now = time.time()
+    until = _block_until(error_message, fallback, now)
+    if limiter.pause_until(until):
+        return until - now
+    return None
+
+
+async def pause_for_block_async(limiter, error_message: str, fallback: float) -> Optional[float]:
+    """Odpowiednik pause_for_block() dla asyncio – zapis pauzy nie blokuje pętli zdarzeń."""
+    now = time.time()
+    until = _block_until(error_message, fallback, now)
+    if await limiter.pause_until_async(until):
+        return until - now
+    return None
+
+
+def create_limiter(per_minute: int, token: Optional[str] = None, burst: int = 1, share: float = 1.0):
+    """Zwraca limiter dla skryptu: współdzielony między procesami, jeśli znamy token.
+
+    RATE_BACKEND=local wymusza limiter tylko w obrębie procesu.
+    """
+    if token and os.environ.get("RATE_BACKEND", "shared").lower() != "local":
+        return SharedRateLimiter(per_minute, token, burst=burst, share=share)
+    return RateLimiter(max(1, int(per_minute * share)), burst=burst)
+
+
+def _benchmark(per_minute: int, workers: int, duration: float, burst: int = 1) -> dict:
+    """Uruchamia `workers` wątków przez `duration` sekund i mierzy faktyczne tempo."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    limiter = RateLimiter(per_minute, burst=burst)
+    stamps = []
+    stamps_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while True:
+            limiter.wait()
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            with stamps_lock:
+                stamps.append(now)
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for _ in range(workers):
+            ex.submit(worker)
+
+    # maksymalna liczba zapytań w dowolnym oknie 1 s (limit skalowany do sekundy)
+    stamps.sort()
+    window = 1.0
+    peak = 0
+    j = 0
+    for i, t in enumerate(stamps):
+        while t - stamps[j] >= window:
+            j += 1
+        peak = max(peak, i - j + 1)
+
+    return {
+        "workers": workers,
+        "calls": len(stamps),
+        "rpm": len(stamps) / duration * 60,
+        "peak_per_s": peak,
+        "allowed_per_s": per_minute / 60 * window + burst - 1,
+    }
+
+
+def _lane_benchmark(per_minute: int, duration: float) -> dict:
+    """8 wątków backfill przez cały czas, 4 wątki stock od połowy – tempo każdego pasa w obu fazach."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    limiter = RateLimiter(per_minute)
+    stamps = {"stock": [], "backfill": []}
+    stamps_lock = threading.Lock()
+    start = time.monotonic()
+    half = start + duration / 2
+    deadline = start + duration
+
+    def worker(lane: str, begin: float):
+        time.sleep(max(0.0, begin - time.monotonic()))
+        while True:
+            limiter.wait(lane)
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            with stamps_lock:
+                stamps[lane].append(now)
+
+    with ThreadPoolExecutor(max_workers=12) as ex:
+        for _ in range(8):
+            ex.submit(worker, "backfill", start)
+        for _ in range(4):
+            ex.submit(worker, "stock", half)
+
+    phase = duration / 2
+    # pierwsza sekunda po wejściu stock to okres przejściowy (sloty backfill zarezerwowane naprzód)
+    return {
+        "backfill_alone": sum(1 for t in stamps["backfill"] if t < half) / phase * 60,
+        "backfill_shared": sum(1 for t in stamps["backfill"] if t >= half + MAX_AHEAD) / (phase - MAX_AHEAD) * 60,
+        "stock_shared": sum(1 for t in stamps["stock"] if t >= half + MAX_AHEAD) / (phase - MAX_AHEAD) * 60,
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark: czy limiter trzyma zadane RPM przy 8–64 wątkach.
+    TARGET_RPM = 3000
+    for n in (8, 16, 32, 64):
+        r = _benchmark(TARGET_RPM, n, duration=5.0, burst=5)
+        print(
+            f"workers={r['workers']:>2} | {int(r['rpm'])}/min (cel {TARGET_RPM}) | "
+            f"szczyt {r['peak_per_s']}/s (limit {r['allowed_per_s']:.0f}/s)"
+        )
+
+    # Pasy priorytetu: backfill sam, a potem razem ze stanami.
+    r = _lane_benchmark(TARGET_RPM, duration=10.0)
+    shares = lane_shares(["stock", "backfill"])
+    print(
+        f"backfill sam: {int(r['backfill_alone'])}/min | razem: stock {int(r['stock_shared'])}/min "
+        f"(cel {int(TARGET_RPM * shares['stock'])}), backfill {int(r['backfill_shared'])}/min "
+        f"(cel {int(TARGET_RPM * shares['backfill'])})"
+    )
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+METADATA_CACHE_FILE = os.environ.get("METADATA_CACHE_FILE", "bl_metadata_cache.json")
+METADATA_TTL = int(os.environ.get("METADATA_TTL", 24 * 3600))  # s – magazyny/kategorie/extra fields zmieniają się rzadko
+# --refresh-metadata (albo REFRESH_METADATA=1) wymusza pobranie metadanych z API
+REFRESH_METADATA = "--refresh-metadata" in sys.argv or os.environ.get("REFRESH_METADATA", "0") == "1"
+
+
+class MetadataCache:
+    """Cache metadanych inventory na dysku (z TTL), wspólny dla wszystkich skryptów.
+
+    Trzyma listę magazynów, kategorie katalogu i definicje extra fields, żeby
+    każdy start skryptu nie wydawał na nie budżetu zapytań. Wpisy są kluczowane
+    skrótem tokena (różne konta nie mieszają się), a `invalidate()` usuwa wpis po
+    zmianie, np. po dodaniu kategorii.
+    """
+
+    def __init__(self, client, token: str, path: str = METADATA_CACHE_FILE, ttl: int = METADATA_TTL,
+                 refresh: bool = REFRESH_METADATA):
+        self.client = client
+        self.token_key = hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self.refreshed = set()  # klucze pobrane już w tym przebiegu przy --refresh-metadata
+
+    def _load_file(self) -> Dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Nie można odczytać cache metadanych {self.path}: {str(e)}")
+            return {}
+
+    def _save_file(self, data: Dict):
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Nie można zapisać cache metadanych {self.path}: {str(e)}")
+
+    def get(self, key: str, loader: Callable[[], object]):
+        """Zwraca wartość z cache, a gdy jej brak/wygasła – woła `loader()` i zapisuje wynik."""
+        if not (self.refresh and key not in self.refreshed):
+            entry = self._load_file().get(self.token_key, {}).get(key)
+            if entry and time.time() - entry.get("fetched_at", 0) < self.ttl:
+                return entry["value"]
+
+        value = loader()
+        data = self._load_file()  # ponowny odczyt – inny proces mógł w międzyczasie dopisać swoje klucze
+        data.setdefault(self.token_key, {})[key] = {"fetched_at": time.time(), "value": value}
+        self._save_file(data)
+        self.refreshed.add(key)
+        logging.info(f"Pobrano metadane '{key}' z API i zapisano w cache.")
+        return value
+
+    def invalidate(self, key: Optional[str] = None):
+        """Usuwa jeden wpis (albo wszystkie dla tego tokena)."""
+        data = self._load_file()
+        entries = data.get(self.token_key, {})
+        if key is None:
+            entries.clear()
+        else:
+            entries.pop(key, None)
+        self._save_file(data)
+
+    def storages(self) -> List[Dict]:
+        return self.get("storages", lambda: self.client.call("getStoragesList", {}).get("storages", []))
+
+    def categories(self, storage_id: str, inventory_id: str) -> List[Dict]:
+        return self.get(
+            f"categories:{storage_id}:{inventory_id}",
+            lambda: self.client.call(
+                "getProductCatalogCategories", {"storage_id": storage_id, "inventory_id": inventory_id}
+            ).get("categories", []),
+        )
+
+    def invalidate_categories(self, storage_id: str, inventory_id: str):
+        self.invalidate(f"categories:{storage_id}:{inventory_id}")
+
+    def extra_fields(self) -> List[Dict]:
+        return self.get("extra_fields", lambda: self.client.call("getInventoryExtraFields", {}).get("extra_fields", []))
+
+    def find_storage(self, storage_id: str) -> Optional[Dict]:
+        """Szuka magazynu; jeśli nie ma go w cache, odświeża listę raz (mógł dopiero powstać)."""
+        for storage in self.storages():
+            if storage.get("storage_id") == storage_id:
+                return storage
+        if "storages" in self.refreshed:
+            return None
+        self.invalidate("storages")
+        for storage in self.storages():
+            if storage.get("storage_id") == storage_id:
+                return storage
+        return None
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Granice przedziałów histogramu czasu odpowiedzi (s); ostatni przedział to "> 60"
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class MethodStats:
+    def __init__(self):
+        self.calls = 0
+        self.ok = 0
+        self.latencies: List[float] = []
+        self.limiter_wait = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.retries: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def summary(self) -> Dict:
+        latencies = sorted(self.latencies)
+        histogram = {}
+        lower = 0.0
+        for upper in LATENCY_BUCKETS:
+            histogram[f"{lower:g}-{upper:g}s"] = sum(1 for x in latencies if lower <= x < upper)
+            lower = upper
+        histogram[f">{lower:g}s"] = sum(1 for x in latencies if x >= lower)
+        return {
+            "calls": self.calls,
+            "ok": self.ok,
+            "latency_s": {
+                "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+                "p50": round(_percentile(latencies, 0.50), 4),
+                "p95": round(_percentile(latencies, 0.95), 4),
+                "p99": round(_percentile(latencies, 0.99), 4),
+                "max": round(latencies[-1], 4) if latencies else 0.0,
+                "histogram": histogram,
+            },
+            "limiter_wait_s": round(self.limiter_wait, 3),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "bytes_decoded": self.bytes_decoded,
+            "retries": dict(self.retries),
+            "errors": dict(self.errors),
+        }
+
+
+class ApiMetrics:
+    """Liczniki wywołań API per metoda: czasy odpowiedzi, czekanie w limiterze, bajty, ponowienia, błędy.
+
+    Na koniec przebiegu `write_summary()` zapisuje JSON obok logu skryptu, żeby było
+    widać, czy wolny przebieg to limiter, sieć czy BaseLinker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods: Dict[str, MethodStats] = defaultdict(MethodStats)
+        self.transports: Dict[str, Dict] = {}  # połączenia klientów innych niż HttpTransport (np. aiohttp)
+        self.started_at = datetime.now()
+        self.started_mono = time.monotonic()
+
+    def record_limiter_wait(self, method: str, seconds: float):
+        with self.lock:
+            self.methods[method].limiter_wait += seconds
+
+    def record_call(self, method: str, latency: float, ok: bool, bytes_sent: int = 0,
+                    bytes_received: int = 0, bytes_decoded: int = 0):
+        with self.lock:
+            stats = self.methods[method]
+            stats.calls += 1
+            stats.ok += int(ok)
+            stats.latencies.append(latency)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.bytes_decoded += bytes_decoded
+
+    def record_retry(self, method: str, kind: str):
+        with self.lock:
+            self.methods[method].retries[kind] += 1
+
+    def record_error(self, method: str, kind: str):
+        with self.lock:
+            self.methods[method].errors[kind] += 1
+
+    def record_transport(self, name: str, stats: Dict):
+        with self.lock:
+            self.transports[name] = stats
+
+    def summary(self, extra: Optional[Dict] = None) -> Dict:
+        with self.lock:
+            methods = {name: stats.summary() for name, stats in sorted(self.methods.items())}
+            transports = {f"transport_{name}": stats for name, stats in self.transports.items()}
+        total_calls = sum(m["calls"] for m in methods.values())
+        result = {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "duration_s": round(time.monotonic() - self.started_mono, 3),
+            "total_calls": total_calls,
+            "total_limiter_wait_s": round(sum(m["limiter_wait_s"] for m in methods.values()), 3),
+            "total_bytes_sent": sum(m["bytes_sent"] for m in methods.values()),
+            "total_bytes_received": sum(m["bytes_received"] for m in methods.values()),
+            "methods": methods,
+        }
+        if extra:
+            result.update(extra)
+        result.update(transports)
+        return result
+
+    def write_summary(self, path: str, extra: Optional[Dict] = None):
+        """Zapisuje podsumowanie przebiegu do pliku JSON (atomowo)."""
+        summary = self.summary(extra)
+        try:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            logging.info(f"Zapisano metryki API do {path} ({summary['total_calls']} wywołań).")
+            print(f"Metryki API: {summary['total_calls']} wywołań, limiter {summary['total_limiter_wait_s']} s -> {path}")
+        except OSError as e:
+            logging.error(f"Błąd podczas zapisywania metryk API: {str(e)}")
+            print(f"Błąd podczas zapisywania metryk API: {str(e)}")
@@ -0,0 +1,453 @@
+"""Lokalny zamiennik connector.php BaseLinkera do testów offline i benchmarków.
+
+Uruchomienie:
+    python bl_mock_server.py --port 8765 --seed-products 100000 --rpm 500 --latency lognormal:0.15:0.4
+
+a w .env skryptów:
+    API_URL=http://127.0.0.1:8765/connector.php
+    XML_URL=http://127.0.0.1:8765/feed.xml?items=100000
+    INVENTORY_ID=bl_1
+
+Serwer trzyma katalog w pamięci i obsługuje metody używane przez skrypty, ma
+rozkłady opóźnień (globalnie i per metoda), limit zapytań per token z
+prawdziwym komunikatem "token blocked until ..." oraz wstrzykiwane błędy 5xx
+i timeouty. GET /feed.xml zwraca wygenerowany feed Google Merchant (z ETag), a GET
+/stats liczniki wywołań.
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
+
+PAGE_SIZE = 1000  # getProductsList zwraca do 1000 produktów na stronę
+DEFAULT_EXTRA_FIELDS = [{"extra_field_id": 9157, "name": "ERP_ID", "kind": 0, "editor_type": "text"}]
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Zwraca losowanie opóźnienia (s) ze specyfikacji rozkładu.
+
+    "0", "const:S", "uniform:MIN:MAX", "normal:MEAN:SD", "lognormal:MEDIANA:SIGMA", "exp:ŚREDNIA".
+    """
+    kind, *args = spec.split(":")
+    values = [float(a) for a in args]
+    if kind in ("0", "none"):
+        return lambda: 0.0
+    if kind == "const":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"Nieznany rozkład opóźnień: {spec}")
+
+
+def feed_item(i: int, seed: int = 0) -> Dict:
+    """Deterministyczny produkt nr `i` feedu (`seed` zmienia stany i ceny, nie SKU)."""
+    rnd = random.Random(i * 7919 + seed)
+    return {
+        "erp_id": str(100000 + i),
+        "sku": f"MPN-{i:07d}",
+        "brand": f"Brand{i % 50}",
+        "title": f"Produkt testowy {i}",
+        "description": f"Opis produktu testowego {i}. " * 3,
+        "price": round(rnd.uniform(10, 5000), 2),
+        "quantity": rnd.randint(0, 200),
+        "ean": f"{590000000000 + i:013d}",
+        "category": f"Kategoria {i % 40}",
+    }
+
+
+def generate_feed(items: int, seed: int = 0) -> Iterator[bytes]:
+    """Generuje feed XML (RSS + przestrzeń nazw g:) w kawałkach, bez budowania go w pamięci."""
+    yield (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+           b'<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0"><channel>\n')
+    chunk = []
+    for i in range(1, items + 1):
+        p = feed_item(i, seed)
+        chunk.append(
+            f"<item><g:id>{p['erp_id']}</g:id><g:mpn>{p['sku']}</g:mpn><g:brand>{p['brand']}</g:brand>"
+            f"<title>{p['title']}</title><g:description>{p['description']}</g:description>"
+            f"<g:price>{p['price']}</g:price><g:availability>{p['quantity']}</g:availability>"
+            f"<g:gtin>{p['ean']}</g:gtin><g:image_link>https://example.com/img/{i}.jpg</g:image_link>"
+            f"<g:product_type>{p['category']}</g:product_type><NX_StockCategory>{p['category']}</NX_StockCategory>"
+            f"</item>\n"
+        )
+        if len(chunk) >= 1000:
+            yield "".join(chunk).encode("utf-8")
+            chunk = []
+    if chunk:
+        yield "".join(chunk).encode("utf-8")
+    yield b"</channel></rss>\n"
+
+
+class MockBaseLinker:
+    """Stan katalogu i logika metod API (bez HTTP)."""
+
+    def __init__(self, storage_id: str = "bl_1", inventory_id: str = "1", rpm: int = 0, block_seconds: float = 60,
+                 latency: str = "0", method_latency: Optional[Dict[str, str]] = None, error_rate: float = 0.0,
+                 timeout_rate: float = 0.0, timeout_seconds: float = 65, tokens: Optional[List[str]] = None,
+                 page_size: int = PAGE_SIZE):
+        self.storage_id = storage_id
+        self.inventory_id = str(inventory_id)
+        self.rpm = rpm
+        self.block_seconds = block_seconds
+        self.latency = parse_latency(latency)
+        self.method_latency = {m: parse_latency(s) for m, s in (method_latency or {}).items()}
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.tokens = set(tokens) if tokens else None
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.products: Dict[str, Dict] = {}  # product_id -> produkt
+        self.sku_index: Dict[str, str] = {}
+        self.next_product_id = 1
+        self.categories: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+        self.next_category_id = 1
+        self.extra_fields = list(DEFAULT_EXTRA_FIELDS)
+        self.windows: Dict[str, deque] = defaultdict(deque)
+        self.blocked_until: Dict[str, float] = {}
+        self.stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def seed_products(self, count: int, seed: int = 0):
+        """Zakłada `count` produktów o tych samych SKU co feed z /feed.xml."""
+        with self.lock:
+            for i in range(1, count + 1):
+                p = feed_item(i, seed)
+                self._insert_product({"sku": p["sku"], "name": f"{p['sku']} {p['title']}", "ean": p["ean"],
+                                      "quantity": p["quantity"], "price_brutto": p["price"]})
+
+    def _insert_product(self, fields: Dict) -> str:
+        product_id = str(self.next_product_id)
+        self.next_product_id += 1
+        self.products[product_id] = dict(fields, product_id=product_id)
+        if fields.get("sku"):
+            self.sku_index[fields["sku"]] = product_id
+        return product_id
+
+    # --- limity i błędy ---
+
+    def check_token(self, token: Optional[str]) -> Optional[Dict]:
+        if not token or (self.tokens is not None and token not in self.tokens):
+            return _error("ERROR_BAD_TOKEN", "Invalid user token")
+        if not self.rpm:
+            return None
+        now = time.time()
+        with self.lock:
+            until = self.blocked_until.get(token, 0)
+            if until > now:
+                return _blocked_error(until)
+            window = self.windows[token]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.rpm:
+                until = now + self.block_seconds
+                self.blocked_until[token] = until
+                window.clear()
+                return _blocked_error(until)
+            window.append(now)
+        return None
+
+    def delay_for(self, method: str) -> float:
+        return self.method_latency.get(method, self.latency)()
+
+    def pick_fault(self) -> Optional[str]:
+        r = random.random()
+        if r < self.timeout_rate:
+            return "timeout"
+        if r < self.timeout_rate + self.error_rate:
+            return random.choice(["500", "502", "503"])
+        return None
+
+    def record(self, method: str, outcome: str):
+        with self.lock:
+            self.stats[method][outcome] += 1
+
+    def stats_snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "products": len(self.products),
+                "methods": {m: dict(v) for m, v in sorted(self.stats.items())},
+            }
+
+    # --- metody API ---
+
+    def dispatch(self, method: str, params: Dict) -> Dict:
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return _error("ERROR_UNKNOWN_METHOD", "An unknown method")
+        with self.lock:
+            return handler(params)
+
+    def _check_storage(self, params: Dict) -> Optional[Dict]:
+        if params.get("storage_id") not in (None, self.storage_id):
+            return _error("ERROR_STORAGE_ID", f"Invalid storage_id: {params.get('storage_id')}")
+        return None
+
+    def api_getStoragesList(self, params: Dict) -> Dict:
+        return _success(storages=[{
+            "storage_id": self.storage_id, "name": "Mock storage", "methods": [], "read": True, "write": True,
+        }])
+
+    def api_getProductsList(self, params: Dict) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        if params.get("filter_sku"):
+            product_id = self.sku_index.get(params["filter_sku"])
+            items = [self.products[product_id]] if product_id else []
+        else:
+            page = max(1, int(params.get("page", 1)))
+            ids = list(self.products)[(page - 1) * self.page_size:page * self.page_size]
+            items = [self.products[i] for i in ids]
+        fields = ("product_id", "ean", "sku", "name", "quantity", "price_brutto")
+        return _success(storage_id=self.storage_id, products=[{k: p.get(k) for k in fields} for p in items])
+
+    def api_getProductCatalogCategories(self, params: Dict) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        return _success(categories=list(self.categories[(self.storage_id, str(params.get("inventory_id")))]))
+
+    def api_addProductCatalogCategory(self, params: Dict) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        if not params.get("name"):
+            return _error("ERROR_EMPTY_NAME", "Category name is required")
+        category_id = str(self.next_category_id)
+        self.next_category_id += 1
+        self.categories[(self.storage_id, str(params.get("inventory_id")))].append({
+            "category_id": category_id, "name": params["name"], "parent_id": params.get("parent_category_id", "0"),
+        })
+        return _success(category_id=category_id)
+
+    def api_addProduct(self, params: Dict) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        if not params.get("name"):
+            return _error("ERROR_EMPTY_NAME", "Product name is required")
+        product_id = str(params.get("product_id", "0"))
+        fields = {k: v for k, v in params.items() if k not in ("storage_id", "product_id")}
+        if product_id == "0":
+            product_id = self._insert_product(fields)
+        elif product_id in self.products:
+            self.products[product_id].update(fields)
+            if fields.get("sku"):
+                self.sku_index[fields["sku"]] = product_id
+        else:
+            return _error("ERROR_PRODUCT_ID", f"Invalid product_id: {product_id}")
+        return _success(storage_id=self.storage_id, product_id=product_id, warnings={})
+
+    def api_deleteProduct(self, params: Dict) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        product_id = str(params.get("product_id", "0"))
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return _error("ERROR_PRODUCT_ID", f"Invalid product_id: {product_id}")
+        if self.sku_index.get(product.get("sku")) == product_id:
+            del self.sku_index[product["sku"]]
+        return _success()
+
+    def _bulk_update(self, params: Dict, apply: Callable[[Dict, object], None], unpack) -> Dict:
+        error = self._check_storage(params)
+        if error:
+            return error
+        counter = 0
+        warnings = {}
+        for entry in params.get("products") or []:
+            product_id, value = unpack(entry)
+            product = self.products.get(str(product_id))
+            if product is None:
+                warnings[str(product_id)] = "Invalid product_id"
+                continue
+            apply(product, value)
+            counter += 1
+        return _success(counter=counter, warnings=warnings)
+
+    def api_updateProductsQuantity(self, params: Dict) -> Dict:
+        # products: [[product_id, variant_id, quantity], ...]
+        return self._bulk_update(params, lambda p, q: p.update(quantity=int(q)), lambda e: (e[0], e[2]))
+
+    def api_updateProductsPrices(self, params: Dict) -> Dict:
+        # products: [{"product_id", "variant_id", "price_brutto", "tax_rate", "price_group_id"}, ...]
+        def apply(product, entry):
+            product["price_brutto"] = float(entry.get("price_brutto", 0))
+            product["tax_rate"] = entry.get("tax_rate")
+        return self._bulk_update(params, apply, lambda e: (e.get("product_id"), e))
+
+    def api_addInventoryProduct(self, params: Dict) -> Dict:
+        if str(params.get("inventory_id")) != self.inventory_id:
+            return _error("ERROR_INVENTORY_ID", f"Invalid inventory_id: {params.get('inventory_id')}")
+        product_id = str(params.get("product_id") or "0")
+        if product_id == "0":
+            product_id = self._insert_product({"sku": params.get("sku", ""), "name": params.get("name", "")})
+        elif product_id not in self.products:
+            return _error("ERROR_PRODUCT_ID", f"Invalid product_id: {product_id}")
+        self.products[product_id].setdefault("text_fields", {}).update(params.get("text_fields") or {})
+        return _success(product_id=product_id, warnings={})
+
+    def api_getInventoryExtraFields(self, params: Dict) -> Dict:
+        return _success(extra_fields=self.extra_fields)
+
+
+def _success(**fields) -> Dict:
+    return dict(status="SUCCESS", **fields)
+
+
+def _error(code: str, message: str) -> Dict:
+    return {"status": "ERROR", "error_code": code, "error_message": message}
+
+
+def _blocked_error(until: float) -> Dict:
+    # dokładnie jak w BaseLinkerze: czas lokalny serwera (PL)
+    stamp = datetime.fromtimestamp(until, ZoneInfo("Europe/Warsaw")).strftime("%Y-%m-%d %H:%M:%S")
+    return _error("ERROR_QUERY_LIMIT_EXCEEDED", f"Query limit exceeded, token blocked until {stamp}")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive jak w prawdziwym API
+    mock: MockBaseLinker = None
+
+    def log_message(self, format, *args):
+        pass  # 100k zapytań w logu konsoli tylko spowalnia benchmark
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        headers = {"Content-Type": content_type}
+        if len(body) > 1024 and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/stats":
+            self._send(200, json.dumps(self.mock.stats_snapshot()).encode("utf-8"))
+        elif url.path == "/feed.xml":
+            items = int(query.get("items", ["1000"])[0])
+            seed = int(query.get("seed", ["0"])[0])
+            etag = f'"feed-{items}-{seed}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml; charset=utf-8")
+            self.send_header("ETag", etag)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in generate_feed(items, seed):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        method = (form.get("method") or [""])[0]
+        try:
+            params = json.loads((form.get("parameters") or ["{}"])[0] or "{}")
+        except ValueError:
+            params = None
+
+        mock = self.mock
+        denied = mock.check_token(self.headers.get("X-BLToken"))
+        if denied is not None:
+            mock.record(method, "rate_limited" if denied["error_code"] == "ERROR_QUERY_LIMIT_EXCEEDED" else "denied")
+            self._send(200, json.dumps(denied).encode("utf-8"))
+            return
+
+        time.sleep(mock.delay_for(method))
+        fault = mock.pick_fault()
+        if fault == "timeout":
+            mock.record(method, "timeout")
+            time.sleep(mock.timeout_seconds)
+            self.close_connection = True  # zamknięcie bez odpowiedzi
+            return
+        if fault is not None:
+            mock.record(method, f"http_{fault}")
+            self._send(int(fault), b"<html><body>Server error</body></html>", "text/html")
+            return
+
+        if params is None:
+            data = _error("ERROR_PARAMETERS", "Invalid parameters JSON")
+        else:
+            data = mock.dispatch(method, params)
+        mock.record(method, "ok" if data["status"] == "SUCCESS" else "error")
+        self._send(200, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def serve(mock: MockBaseLinker, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Tworzy serwer HTTP dla `mock` (wywołaj serve_forever() albo uruchom w wątku)."""
+    handler = type("BoundMockHandler", (MockHandler,), {"mock": mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny mock API BaseLinker (connector.php)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--storage-id", default="bl_1", help="storage_id magazynu (INVENTORY_ID w skryptach)")
+    parser.add_argument("--inventory-id", default="1", help="inventory_id dla addInventoryProduct (NEW_INVENTORY_ID)")
+    parser.add_argument("--seed-products", type=int, default=0, help="ile produktów z feedu założyć na starcie")
+    parser.add_argument("--rpm", type=int, default=0, help="limit zapytań na minutę per token (0 = brak)")
+    parser.add_argument("--block-seconds", type=float, default=60, help="czas blokady tokena po przekroczeniu limitu")
+    parser.add_argument("--latency", default="0", help="rozkład opóźnień, np. lognormal:0.15:0.4")
+    parser.add_argument("--method-latency", action="append", default=[], metavar="METODA=ROZKŁAD",
+                        help="opóźnienie dla jednej metody, np. addProduct=uniform:0.2:0.8")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="odsetek odpowiedzi 5xx")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="odsetek zapytań bez odpowiedzi")
+    parser.add_argument("--timeout-seconds", type=float, default=65, help="jak długo wisi zapytanie-timeout")
+    parser.add_argument("--tokens", default="", help="dozwolone tokeny po przecinku (puste = dowolny)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    mock = MockBaseLinker(
+        storage_id=args.storage_id, inventory_id=args.inventory_id, rpm=args.rpm, block_seconds=args.block_seconds,
+        latency=args.latency, method_latency=dict(s.split("=", 1) for s in args.method_latency),
+        error_rate=args.error_rate, timeout_rate=args.timeout_rate, timeout_seconds=args.timeout_seconds,
+        tokens=[t for t in args.tokens.split(",") if t], page_size=args.page_size,
+    )
+    if args.seed_products:
+        mock.seed_products(args.seed_products)
+    server = serve(mock, args.host, args.port)
+    print(f"Mock BaseLinker: http://{args.host}:{args.port}/connector.php "
+          f"(feed: /feed.xml?items=N, statystyki: /stats, produktów: {len(mock.products)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH", 2))  # partii w kolejce na wątek roboczy (ponad wysyłane)
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Grupuje elementy strumienia w listy po `size` (ostatnia może być krótsza)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_pipeline(items: Iterable, worker: Callable, workers: int, on_result: Optional[Callable] = None,
+                 depth: int = PIPELINE_DEPTH) -> int:
+    """Przepuszcza strumień `items` (zwykle partii) przez `workers` wątków z ograniczoną kolejką.
+
+    Kolejny element jest pobierany z `items` dopiero, gdy w locie jest mniej niż
+    workers * (1 + depth) zadań – leniwy strumień (parser -> lookup -> batcher)
+    jest więc czytany w tempie wysyłki, a w pamięci jest tylko kilka partii.
+    Pierwsze zadania startują, zanim strumień się skończy. `on_result(item,
+    wynik_albo_wyjątek)` jest wołane w wątku wywołującym, w kolejności
+    elementów. Zwraca liczbę przetworzonych elementów.
+    """
+    limit = workers * (1 + depth)
+    pending = deque()
+    done = 0
+
+    def finish_oldest():
+        item, future = pending.popleft()
+        try:
+            result = future.result()
+        except Exception as e:
+            result = e
+        if on_result is not None:
+            on_result(item, result)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+                while len(pending) >= limit:
+                    finish_oldest()
+                    done += 1
+                pending.append((item, executor.submit(worker, item)))
+        finally:
+            # także przy błędzie strumienia (np. FeedError): wysłane partie są dokańczane i rozliczane
+            while pending:
+                finish_oldest()
+                done += 1
+    return done
@@ -0,0 +1,118 @@
+import sys
+from typing import Callable, Dict, Optional
+
+
+class _Record:
+    """Wspólna baza rekordów: dostęp jak do dict (product["sku"], product.get(...)),
+    żeby kod budujący parametry API i zapis nieudanych produktów działał bez zmian."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class StockRecord(_Record):
+    """Produkt dla aktualizacji stanów i cen – tylko sku, stan i cena (None w trybie stock-only)."""
+
+    __slots__ = ("sku", "quantity", "price_brutto")
+    FIELDS = __slots__
+
+    def __init__(self, sku: str, quantity: int, price_brutto: Optional[float]):
+        self.sku = sku
+        self.quantity = quantity
+        self.price_brutto = price_brutto
+
+
+class ProductRecord(_Record):
+    """Pełny produkt z feedu dla addProduct.
+
+    Marka i kategoria są internowane (kilkaset różnych wartości na 30k produktów),
+    a opis – najdłuższe pole – jest czytany dopiero przy pierwszym użyciu przez
+    wspólne dla wszystkich rekordów `description_source(pos)` (np. ze snapshotu
+    feedu po pozycji produktu), więc nie wisi w pamięci dla 30k produktów.
+    """
+
+    __slots__ = ("sku", "name", "quantity", "price_brutto", "ean", "man_name", "category", "image_link", "erp_id",
+                 "_description", "_source", "_pos")
+    FIELDS = ("sku", "name", "quantity", "price_brutto", "ean", "man_name", "description", "category", "image_link",
+              "erp_id")
+
+    def __init__(self, sku: str, name: str, quantity: int, price_brutto: float, ean: str, man_name: str,
+                 category: str, image_link: str, erp_id: str, description: Optional[str] = None,
+                 description_source: Optional[Callable[[int], Optional[str]]] = None, pos: int = -1):
+        self.sku = sku
+        self.name = name
+        self.quantity = quantity
+        self.price_brutto = price_brutto
+        self.ean = ean
+        self.man_name = sys.intern(man_name)
+        self.category = sys.intern(category)
+        self.image_link = image_link
+        self.erp_id = erp_id
+        self._description = description
+        self._source = description_source
+        self._pos = pos
+
+    @property
+    def description(self) -> str:
+        if self._description is None:
+            self._description = (self._source(self._pos) if self._source is not None else None) or ""
+            self._source = None
+        return self._description
+
+
+def _memory_benchmark(items: int = 30_000):
+    """Pamięć listy produktów z feedu: dict na produkt vs ProductRecord vs StockRecord."""
+    import tracemalloc
+    import xml.etree.ElementTree as ET
+
+    from bl_feed import decode_numbers, read_item
+    from bl_mock_server import generate_feed
+
+    root = ET.fromstring(b"".join(generate_feed(items)))
+    rows = [read_item(item) for item in root.findall("./channel/item")]
+    del root
+
+    def as_dict(row, numbers):
+        return {"sku": row["mpn"].strip(), "name": f"{row['mpn']} {row['title']}".strip(),
+                "quantity": numbers["availability"], "price_brutto": round(numbers["price"], 2),
+                "ean": row["gtin"].strip(), "man_name": row["brand"].strip(), "description": row["g_description"],
+                "category": row["stock_category"].strip(), "image_link": row["image_link"].strip(),
+                "erp_id": row["erp_id"].strip()}
+
+    def no_description(pos):
+        return ""
+
+    def as_product(row, numbers):
+        return ProductRecord(row["mpn"].strip(), f"{row['mpn']} {row['title']}".strip(), numbers["availability"],
+                             round(numbers["price"], 2), row["gtin"].strip(), row["brand"].strip(),
+                             row["stock_category"].strip(), row["image_link"].strip(), row["erp_id"].strip(),
+                             description_source=no_description, pos=0)
+
+    def as_stock(row, numbers):
+        return StockRecord(row["mpn"].strip(), numbers["availability"], round(numbers["price"], 2))
+
+    for name, build in (("dict", as_dict), ("ProductRecord", as_product), ("StockRecord", as_stock)):
+        tracemalloc.start()
+        # świeże kopie tekstów (jak z parsera), żeby pomiar obejmował stringi trzymane przez produkty
+        copies = [{k: (v + ".")[:-1] if v else v for k, v in row.items()} for row in rows]
+        products = [build(row, decode_numbers(row)[0]) for row in copies]
+        del copies
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:>13}: {len(products)} produktów, {current / 1e6:.1f} MB ({current / len(products):.0f} B/produkt)")
+        del products
+
+
+if __name__ == "__main__":
+    _memory_benchmark()
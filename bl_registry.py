@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+PRODUCT_REGISTRY_FILE = os.environ.get("PRODUCT_REGISTRY_FILE", "product_registry.sqlite")
+KEYS = ("sku", "product_id", "erp_id", "ean")
+WRITE_BATCH = 500  # wierszy na transakcję
+
+
+class ProductRegistry:
+    """Rejestr produktów: SKU, product_id, ERP ID (g:id) i EAN w jednej tabeli z indeksem po każdym kluczu.
+
+    Zamiast budować w każdym jobie słowniki SKU -> ERP, product_id -> SKU czy
+    EAN -> produkt, joby czytają rejestr: `find()` / `sku_for()` to jedno
+    zapytanie po indeksie, a `join()` i `pairs()` łączą klucze hurtowo w SQLite.
+    product_id pochodzi z bazy SKU (`reconcile()` – tylko różnice, gdy baza
+    SKU zmieniła generację; add_products dopisuje od razu `record_product()`),
+    ERP ID i EAN – z feedu (`track_feed()` przy czytaniu feedu w jobie).
+    """
+
+    def __init__(self, path: str = PRODUCT_REGISTRY_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS products (sku TEXT PRIMARY KEY, product_id TEXT, erp_id TEXT, ean TEXT, "
+            "updated_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        for key in KEYS[1:]:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS products_{key} ON products ({key})")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS join_keys (value TEXT PRIMARY KEY)")
+
+    @staticmethod
+    def _check(fields: Sequence[str]):
+        for field in fields:
+            if field not in KEYS:
+                raise ValueError(f"Nieznane pole rejestru: {field} (dostępne: {', '.join(KEYS)})")
+
+    def _write(self, sql: str, rows: Iterable[Tuple]) -> int:
+        rows = iter(rows)
+        total = 0
+        while True:
+            batch = list(islice(rows, WRITE_BATCH))
+            if not batch:
+                return total
+            with self.lock:
+                self.conn.execute("BEGIN")
+                try:
+                    self.conn.executemany(sql, batch)
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+            total += len(batch)
+
+    def _prune(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM products WHERE product_id IS NULL AND erp_id IS NULL AND ean IS NULL")
+
+    # ---- odczyt ----
+
+    def find(self, key: str, value: str) -> List[Dict[str, Optional[str]]]:
+        """Produkty o danym kluczu (EAN może się powtarzać – stąd lista)."""
+        self._check([key])
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(KEYS)} FROM products WHERE {key} = ?", (str(value),)).fetchall()
+        return [dict(zip(KEYS, row)) for row in rows]
+
+    def get(self, key: str, value: str) -> Optional[Dict[str, Optional[str]]]:
+        rows = self.find(key, value)
+        return rows[0] if rows else None
+
+    def sku_for(self, product_id: str) -> Optional[str]:
+        """SKU dla product_id (np. z "warnings" odpowiedzi API)."""
+        row = self.get("product_id", product_id)
+        return row["sku"] if row else None
+
+    def count(self, field: Optional[str] = None) -> int:
+        """Liczba produktów w rejestrze (z `field` – tylko z niepustym polem)."""
+        where = ""
+        if field is not None:
+            self._check([field])
+            where = f" WHERE {field} IS NOT NULL"
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM products{where}").fetchone()[0]
+
+    def join(self, values: Iterable[str], by: str = "sku",
+             fields: Sequence[str] = ("product_id",)) -> Iterator[Tuple]:
+        """Hurtowe połączenie: (wartość, *fields) dla każdej wartości `by` obecnej w rejestrze.
+
+        Wartości trafiają do tabeli tymczasowej, a połączenie robi jedno zapytanie
+        po indeksie `by` – bez słownika całego rejestru po stronie Pythona.
+        """
+        self._check([by, *fields])
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM join_keys")
+                self.conn.executemany("INSERT OR IGNORE INTO join_keys (value) VALUES (?)",
+                                      ((str(value),) for value in values))
+                rows = self.conn.execute(
+                    f"SELECT j.value, {', '.join('p.' + f for f in fields)} FROM join_keys j "
+                    f"JOIN products p ON p.{by} = j.value"
+                ).fetchall()
+                self.conn.execute("DELETE FROM join_keys")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return iter(rows)
+
+    def pairs(self, fields: Sequence[str]) -> Iterator[Tuple]:
+        """Krotki `fields` dla produktów, które mają wszystkie te pola (np. sku, product_id, erp_id)."""
+        self._check(fields)
+        where = " AND ".join(f"{field} IS NOT NULL" for field in fields)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(fields)} FROM products WHERE {where} ORDER BY sku").fetchall()
+        return iter(rows)
+
+    # ---- zapis ----
+
+    def record_product(self, sku: str, product_id: str, erp_id: Optional[str] = None, ean: Optional[str] = None):
+        """Nowy produkt z addProduct – od razu ze wszystkimi kluczami."""
+        self.record_products([(sku, product_id, erp_id, ean)])
+
+    def record_products(self, products: Iterable[Tuple[str, str, Optional[str], Optional[str]]]) -> int:
+        """Jak record_product() dla wielu produktów (sku, product_id, erp_id, ean) – transakcje po WRITE_BATCH."""
+        now = time.time()
+        return self._write(
+            "INSERT INTO products (sku, product_id, erp_id, ean, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (sku) DO UPDATE SET product_id = excluded.product_id, "
+            "erp_id = COALESCE(excluded.erp_id, erp_id), ean = COALESCE(excluded.ean, ean), "
+            "updated_at = excluded.updated_at",
+            ((sku, str(product_id), erp_id or None, ean or None, now) for sku, product_id, erp_id, ean in products),
+        )
+
+    def reconcile(self, sku_store) -> int:
+        """Dopasowuje product_id do bazy SKU (bl_sku_store); zapisuje tylko różnice. Zwraca liczbę zmian.
+
+        Nic nie robi, gdy generacja bazy SKU nie zmieniła się od ostatniego razu.
+        """
+        generation = sku_store.generation()  # przed odczytem – zmiana w trakcie da kolejne dopasowanie, nie błąd
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM registry_meta WHERE key = 'sku_generation'").fetchone()
+        if row is not None and row[0] == generation:
+            return 0
+        mapping = sku_store.load()
+        with self.lock:
+            current = dict(self.conn.execute("SELECT sku, product_id FROM products WHERE product_id IS NOT NULL"))
+        now = time.time()
+        changed = self._write(
+            "INSERT INTO products (sku, product_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (sku) DO UPDATE SET product_id = excluded.product_id, updated_at = excluded.updated_at",
+            ((sku, str(product_id), now) for sku, product_id in mapping.items() if current.get(sku) != str(product_id)),
+        )
+        changed += self._write("UPDATE products SET product_id = NULL, updated_at = ? WHERE sku = ?",
+                               ((now, sku) for sku in current if sku not in mapping))
+        self._prune()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('sku_generation', ?)",
+                              (generation,))
+        return changed
+
+    def track_feed(self, products: Iterable) -> Iterator:
+        """Przepuszcza produkty (z ["sku"], ["erp_id"], ["ean"]) i zapisuje w rejestrze zmienione ERP ID / EAN.
+
+        Po przeczytaniu całego strumienia SKU, których nie było w feedzie, tracą
+        ERP ID i EAN (przerwany strumień niczego nie czyści).
+        """
+        with self.lock:
+            state = {row[0]: row[1:] for row in self.conn.execute("SELECT sku, erp_id, ean FROM products")}
+        sql = ("INSERT INTO products (sku, erp_id, ean, updated_at) VALUES (?, ?, ?, ?) "
+               "ON CONFLICT (sku) DO UPDATE SET erp_id = excluded.erp_id, ean = excluded.ean, "
+               "updated_at = excluded.updated_at")
+        pending = []
+        seen = set()
+        for product in products:
+            sku = product["sku"]
+            if sku and sku not in seen:
+                seen.add(sku)
+                values = (product["erp_id"] or None, product["ean"] or None)
+                if state.get(sku) != values:
+                    pending.append((sku, *values, time.time()))
+                    if len(pending) >= WRITE_BATCH:
+                        self._write(sql, pending)
+                        pending = []
+            yield product
+        self._write(sql, pending)
+        gone = [sku for sku, values in state.items() if sku not in seen and values != (None, None)]
+        self._write("UPDATE products SET erp_id = NULL, ean = NULL, updated_at = ? WHERE sku = ?",
+                    ((time.time(), sku) for sku in gone))
+        self._prune()
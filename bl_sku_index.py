@@ -0,0 +1,234 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import ItemsView, Mapping
+from typing import Dict, Iterator, Optional, Tuple
+
+from bl_feed import fingerprint
+
+SKU_INDEX_FILE = os.environ.get("SKU_INDEX_FILE", "sku_to_id.idx")  # binarny indeks SKU -> product_id (mmap)
+MAGIC = b"BLSKUIX2"  # BLSKUIX1 miał 32 bajty na generację – za mało dla backendu journal
+GENERATION_SIZE = 64  # bajty na generację bazy SKU (journal:<mtime_ns>:<rozmiar> ma do ~50)
+# magic, liczba SKU, rozmiar bloku SKU, generacja bazy SKU, fingerprint mapy (104 B – tablice uint64 wyrównane)
+HEADER = struct.Struct(f"<8sQQ{GENERATION_SIZE}s16s")
+
+
+class SkuIndex(Mapping):
+    """Mapowanie SKU -> product_id czytane wprost z pliku przez mmap.
+
+    Plik: nagłówek, tablica przesunięć (uint64[N + 1]), product_id (uint64[N])
+    i posortowany blok SKU w UTF-8. Otwarcie nie parsuje niczego – wyszukanie
+    to przeszukiwanie binarne po przesunięciach (log2 N porównań, kilka stron
+    pliku), a pamięć procesu rośnie tylko o faktycznie dotknięte strony.
+    Działa wszędzie tam, gdzie dotąd dict: `sku in m`, `m[sku]`, `m.get()`,
+    `m.items()`; `content_fingerprint` to fingerprint() mapy z chwili budowy.
+    """
+
+    def __init__(self, path: str = SKU_INDEX_FILE):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, blob_size, generation, digest = HEADER.unpack_from(self.mm, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path}: to nie jest indeks SKU")
+        self.path = path
+        self.count = count
+        self.generation = generation.rstrip(b"\0").decode("ascii")
+        self.content_fingerprint = digest.decode("ascii")
+        view = memoryview(self.mm)
+        start = HEADER.size
+        self.offsets = view[start:start + 8 * (count + 1)].cast("Q")
+        start += 8 * (count + 1)
+        self.ids = view[start:start + 8 * count].cast("Q")
+        self.base = start + 8 * count
+
+    def _key(self, i: int) -> bytes:
+        return self.mm[self.base + self.offsets[i]:self.base + self.offsets[i + 1]]
+
+    def _find(self, sku: str) -> int:
+        if not isinstance(sku, str):
+            return -1
+        key = sku.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self._key(lo) == key else -1
+
+    def __getitem__(self, sku: str) -> str:
+        i = self._find(sku)
+        if i < 0:
+            raise KeyError(sku)
+        return str(self.ids[i])
+
+    def __contains__(self, sku) -> bool:
+        return self._find(sku) >= 0
+
+    def get(self, sku: str, default=None):
+        i = self._find(sku)
+        return str(self.ids[i]) if i >= 0 else default
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.count):
+            yield self._key(i).decode("utf-8")
+
+    def items(self) -> ItemsView:
+        return _IndexItems(self)
+
+    def close(self):
+        self.offsets.release()
+        self.ids.release()
+        self.mm.close()
+
+
+class _IndexItems(ItemsView):
+    """items() po kolei z pliku – bez wyszukiwania każdego klucza osobno."""
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        index = self._mapping
+        for i in range(index.count):
+            yield index._key(i).decode("utf-8"), str(index.ids[i])
+
+
+def write_index(path: str, mapping: Dict[str, str], generation: str = ""):
+    """Zapisuje mapę jako indeks (plik tymczasowy + atomowy rename).
+
+    product_id musi być liczbą dziesiętną (tak zwraca je BaseLinker), a generacja
+    mieścić się w GENERATION_SIZE bajtach – inaczej ValueError i skrypty zostają
+    przy mapie w pamięci (obcięta generacja nigdy nie pasowałaby do bazy SKU).
+    """
+    encoded_generation = generation.encode("ascii")
+    if len(encoded_generation) > GENERATION_SIZE:
+        raise ValueError(f"generacja bazy SKU {generation!r} dłuższa niż {GENERATION_SIZE} bajtów")
+    entries = []
+    for sku, product_id in mapping.items():
+        product_id = str(product_id)
+        if not product_id.isdigit() or str(int(product_id)) != product_id or int(product_id) >= 2 ** 64:
+            raise ValueError(f"product_id {product_id!r} (SKU {sku}) nie mieści się w indeksie")
+        entries.append((sku.encode("utf-8"), int(product_id)))
+    entries.sort()
+
+    offsets = array("Q", [0])
+    ids = array("Q")
+    blob = bytearray()
+    for key, product_id in entries:
+        blob += key
+        offsets.append(len(blob))
+        ids.append(product_id)
+    header = HEADER.pack(MAGIC, len(entries), len(blob), encoded_generation, fingerprint(mapping).encode("ascii"))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # osobny plik na proces – dwa procesy mogą przebudowywać indeks naraz
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        offsets.tofile(f)
+        ids.tofile(f)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_index(path: str = SKU_INDEX_FILE, generation: Optional[str] = None) -> Optional[SkuIndex]:
+    """Indeks, jeśli istnieje i (przy podanej `generation`) odpowiada bieżącemu stanowi bazy SKU; inaczej None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        index = SkuIndex(path)
+    except (OSError, ValueError):
+        return None
+    if generation is not None and index.generation != generation:
+        index.close()
+        return None
+    return index
+
+
+def refresh_index(store, path: str = SKU_INDEX_FILE) -> Mapping:
+    """Przebudowuje indeks z bazy SKU (bl_sku_store) i zwraca wczytaną mapę."""
+    generation = store.generation()  # przed odczytem: zapis w trakcie budowy da nieaktualny indeks, nie błędny
+    data = store.load()
+    try:
+        write_index(path, data, generation)
+    except (OSError, ValueError) as e:
+        print(f"Indeks SKU niedostępny ({e}) – mapa SKU-to-ID tylko w pamięci.")
+    return data
+
+
+def load_sku_map(store, path: str = SKU_INDEX_FILE) -> Mapping:
+    """Mapa SKU -> product_id do odczytu: aktualny indeks (mmap, bez parsowania) albo świeżo zbudowany."""
+    index = open_index(path, store.generation())
+    if index is not None:
+        return index
+    return refresh_index(store, path)
+
+
+def _rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _benchmark(sizes=(30_000, 300_000, 3_000_000), lookups: int = 1000):
+    """Start (otwarcie + `lookups` sprawdzeń SKU) i RSS procesu: json.load sku_to_id.json vs indeks mmap.
+
+    Każdy pomiar w nowym procesie; pliki są w cache systemu plików (start
+    procesu "na zimno", nie dysku).
+    """
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    probe = (
+        "import sys, time, json, random\n"
+        "sys.path.insert(0, {here!r})\n"
+        "from bl_sku_index import SkuIndex, _rss_kb\n"
+        "rss0 = _rss_kb()\n"
+        "t = time.perf_counter()\n"
+        "m = json.load(open({json!r}, encoding='utf-8')) if {mode!r} == 'json' else SkuIndex({idx!r})\n"
+        "opened = time.perf_counter() - t\n"
+        "random.seed(1)\n"
+        "keys = [f'MPN-{{random.randrange({n} * 2):08d}}' for _ in range({lookups})]\n"
+        "t2 = time.perf_counter()\n"
+        "hits = sum(1 for k in keys if k in m)\n"
+        "print(opened, time.perf_counter() - t2, _rss_kb() - rss0, hits)\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            data = {f"MPN-{i * 2:08d}": str(10_000_000 + i) for i in range(n)}
+            json_path = os.path.join(tmp, "sku_to_id.json")
+            idx_path = os.path.join(tmp, "sku_to_id.idx")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            started = time.perf_counter()
+            write_index(idx_path, data)
+            built = time.perf_counter() - started
+            check = SkuIndex(idx_path)
+            assert dict(check.items()) == data and check.content_fingerprint == fingerprint(data)
+            check.close()
+            del data
+            print(f"{n:>9} SKU: JSON {os.path.getsize(json_path) / 1e6:.1f} MB, "
+                  f"indeks {os.path.getsize(idx_path) / 1e6:.1f} MB (budowa {built:.2f} s)")
+            for mode in ("json", "index"):
+                code = probe.format(here=here, json=json_path, idx=idx_path, mode=mode, n=n, lookups=lookups)
+                out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+                opened, looked, rss, hits = out.stdout.split()
+                print(f"    {mode:>5}: start {float(opened) * 1e3:8.1f} ms, {lookups} sprawdzeń "
+                      f"{float(looked) * 1e3:6.2f} ms, RSS +{int(rss) / 1024:7.1f} MB (trafień {hits})")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,531 @@
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SKU_STORE_FILE = os.environ.get("SKU_STORE_FILE", "sku_to_id.sqlite")  # mapowanie SKU -> product_id (SQLite, WAL)
+SKU_TO_ID_JSON = "sku_to_id.json"  # stary format – importowany raz przy pierwszym otwarciu bazy
+WRITE_BATCH = 500  # wierszy na transakcję przy zapisie wielu SKU (krótkie blokady dla innych procesów)
+# "sqlite" (domyślnie) albo "journal": sku_to_id.json jako snapshot + dziennik dopisań sku_to_id.journal
+SKU_STORE_BACKEND = os.environ.get("SKU_STORE_BACKEND", "sqlite")
+JOURNAL_GROUP = int(os.environ.get("SKU_JOURNAL_GROUP", 100))  # rekordów dziennika na jedno fsync
+COMPACT_MIN = 1000  # kompaktuj dziennik, gdy ma więcej rekordów niż max(COMPACT_MIN, połowa mapy)
+
+
+class SkuStore:
+    """Mapowanie SKU -> product_id w SQLite zamiast sku_to_id.json.
+
+    Dopisanie jednego SKU to jeden upsert po kluczu głównym we własnej krótkiej
+    transakcji – bez przepisywania całej mapy, jak przy JSON. Tryb WAL pozwala
+    innym procesom (update_products, update_erp, GUI) czytać spójny stan w czasie,
+    gdy add_products albo sync_sku_to_id zapisują. Przy pierwszym otwarciu nowej
+    bazy istniejący sku_to_id.json jest importowany (jednorazowo).
+    """
+
+    def __init__(self, path: str = SKU_STORE_FILE, json_path: Optional[str] = SKU_TO_ID_JSON):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sku_map ("
+            "sku TEXT PRIMARY KEY, product_id TEXT NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)")
+        # generacja rośnie przy każdej zmianie mapy – po niej indeks mmap (bl_sku_index) poznaje, że jest nieaktualny
+        self.conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('generation', '0')")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            self.conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS sku_map_{event.lower()} AFTER {event} ON sku_map BEGIN "
+                "UPDATE store_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'; END"
+            )
+        if json_path:
+            self._migrate(json_path)
+
+    def _migrate(self, json_path: str):
+        """Jednorazowy import sku_to_id.json (BEGIN IMMEDIATE: przy dwóch procesach importuje jeden)."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = self.conn.execute("SELECT value FROM store_meta WHERE key = 'json_imported'").fetchone()
+                if done is None:
+                    count = 0
+                    if os.path.exists(json_path):
+                        count = self._insert(self._read_json(json_path).items())
+                        print(f"Zaimportowano {count} rekordów SKU-to-ID z {json_path} do {self.path}.")
+                    self._mark_imported(json_path, count)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _mark_imported(self, path: str, count: int):
+        self.conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('json_imported', ?)",
+                          (json.dumps({"file": path, "records": count, "at": time.time()}),))
+
+    @staticmethod
+    def _read_json(path: str) -> Dict[str, str]:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: oczekiwano obiektu JSON {{SKU: product_id}}")
+        return data
+
+    def _insert(self, items: Iterable[Tuple[str, str]]) -> int:
+        now = time.time()
+        rows = [(str(sku), str(product_id), now) for sku, product_id in items]
+        self.conn.executemany(
+            "INSERT INTO sku_map (sku, product_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (sku) DO UPDATE SET product_id = excluded.product_id, updated_at = excluded.updated_at "
+            "WHERE product_id != excluded.product_id",
+            rows,
+        )
+        return len(rows)
+
+    def _write_batches(self, write, items: Iterable) -> int:
+        """Zapis w transakcjach po WRITE_BATCH wierszy – czytający i inne procesy nie czekają na całość."""
+        items = iter(items)
+        total = 0
+        while True:
+            batch = list(islice(items, WRITE_BATCH))
+            if not batch:
+                return total
+            with self.lock:
+                self.conn.execute("BEGIN")
+                try:
+                    total += write(batch)
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+
+    def load(self) -> Dict[str, str]:
+        """Cała mapa SKU -> product_id."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT sku, product_id FROM sku_map"))
+
+    def get(self, sku: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT product_id FROM sku_map WHERE sku = ?", (sku,)).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sku_map").fetchone()[0]
+
+    def generation(self) -> str:
+        with self.lock:
+            return "sqlite:" + self.conn.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()[0]
+
+    def put(self, sku: str, product_id: str):
+        """Zapisuje jedno SKU od razu (autocommit) – np. po każdym udanym addProduct."""
+        with self.lock:
+            self._insert([(sku, product_id)])
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        return self._write_batches(self._insert, items)
+
+    def delete_many(self, skus: Iterable[str]) -> int:
+        def delete(batch):
+            self.conn.executemany("DELETE FROM sku_map WHERE sku = ?", [(sku,) for sku in batch])
+            return len(batch)
+
+        return self._write_batches(delete, skus)
+
+    def import_json(self, path: str = SKU_TO_ID_JSON, replace: bool = False) -> int:
+        """Dopisuje (albo przy `replace` – zastępuje) mapę z pliku JSON. Zwraca liczbę rekordów z pliku."""
+        data = self._read_json(path)
+        if replace:
+            self.delete_many([sku for sku in self.load() if sku not in data])
+        count = self.put_many(data.items())
+        with self.lock:
+            self._mark_imported(path, count)  # automatyczny import przy otwarciu już nie nadpisze tej mapy
+        return count
+
+    def export_json(self, path: str = SKU_TO_ID_JSON) -> int:
+        """Zapisuje mapę w starym formacie sku_to_id.json (atomowo: plik tymczasowy + rename)."""
+        data = self.load()
+        _write_json_atomic(path, data)
+        return len(data)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SkuJournal:
+    """Mapowanie SKU -> product_id jako plik JSON (snapshot) + dziennik dopisań.
+
+    Nowe SKU trafiają na koniec dziennika (linia JSON {"sku", "id", "ts"}, "id":
+    null usuwa SKU), a fsync jest robione grupowo co JOURNAL_GROUP rekordów –
+    koszt zapisu zależy od liczby nowych SKU, nie od wielkości katalogu, a awaria
+    w trakcie przebiegu traci najwyżej jedną niezsynchronizowaną grupę. Odczyt =
+    snapshot + odtworzenie dziennika (ucięta ostatnia linia jest pomijana).
+    Gdy dziennik urośnie, kompaktowanie w tle zapisuje nowy snapshot (plik
+    tymczasowy + atomowy rename) i zostawia w dzienniku tylko nowsze rekordy.
+    Jeden proces zapisujący – pilnuje tego blokada pliku sku_to_id.journal.lock
+    (drugi czeka na jej zwolnienie); tylko on naprawia uciętą końcówkę.
+    Procesy, które tylko czytają, używają SkuJournalReader.
+    """
+
+    def __init__(self, path: str = SKU_TO_ID_JSON, journal_path: Optional[str] = None,
+                 group: int = JOURNAL_GROUP, compact_min: int = COMPACT_MIN):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + ".journal"
+        self.group = max(1, group)
+        self.compact_min = compact_min
+        self.lock = threading.Lock()
+        self.compactor: Optional[threading.Thread] = None
+        self.writer_lock = _lock_writer(self.journal_path + ".lock")
+        self.data, self.journal_records, valid = _read_journal(self.path, self.journal_path)
+        # ucięta linia po awarii – nowe rekordy nie mogą trafić za nią; bezpieczne tylko pod blokadą zapisującego
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > valid:
+            os.truncate(self.journal_path, valid)
+        self.journal = open(self.journal_path, "ab")
+        self.unsynced = 0
+        atexit.register(self.close)
+
+    def _append(self, sku: str, product_id: Optional[str]):
+        record = {"sku": sku, "id": product_id, "ts": round(time.time(), 3)}
+        self.journal.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        if product_id is None:
+            self.data.pop(sku, None)
+        else:
+            self.data[sku] = product_id
+        self.journal_records += 1
+        self.unsynced += 1
+        if self.unsynced >= self.group:
+            self._sync()
+
+    def _sync(self):
+        if self.unsynced:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.unsynced = 0
+
+    def _after_write(self):
+        with self.lock:
+            if self.compactor is not None or self.journal.closed:
+                return
+            if self.journal_records <= max(self.compact_min, len(self.data) // 2):
+                return
+            self.compactor = threading.Thread(target=self.compact, name="sku-journal-compact", daemon=True)
+        self.compactor.start()
+
+    def load(self) -> Dict[str, str]:
+        with self.lock:
+            return dict(self.data)
+
+    def get(self, sku: str) -> Optional[str]:
+        with self.lock:
+            return self.data.get(sku)
+
+    def count(self) -> int:
+        with self.lock:
+            return len(self.data)
+
+    def generation(self) -> str:
+        with self.lock:
+            if not self.journal.closed:
+                self.journal.flush()
+        return journal_generation(self.path, self.journal_path)
+
+    def put(self, sku: str, product_id: str):
+        with self.lock:
+            self._append(str(sku), str(product_id))
+        self._after_write()
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        count = 0
+        with self.lock:
+            for sku, product_id in items:
+                if self.data.get(str(sku)) != str(product_id):
+                    self._append(str(sku), str(product_id))
+                count += 1
+            self._sync()
+        self._after_write()
+        return count
+
+    def delete_many(self, skus: Iterable[str]) -> int:
+        count = 0
+        with self.lock:
+            for sku in skus:
+                if sku in self.data:
+                    self._append(sku, None)
+                    count += 1
+            self._sync()
+        self._after_write()
+        return count
+
+    def import_json(self, path: str = SKU_TO_ID_JSON, replace: bool = False) -> int:
+        data = SkuStore._read_json(path)
+        if replace:
+            self.delete_many([sku for sku in self.load() if sku not in data])
+        return self.put_many(data.items())
+
+    def export_json(self, path: str = SKU_TO_ID_JSON) -> int:
+        data = self.load()
+        _write_json_atomic(path, data)
+        return len(data)
+
+    def compact(self):
+        """Zapisuje bieżącą mapę jako nowy snapshot i skraca dziennik do rekordów dopisanych w międzyczasie.
+
+        Kolejność: najpierw rename snapshotu, potem dziennika. Stary dziennik
+        odtworzony na nowym snapshocie daje ten sam stan (rekordy są idempotentne,
+        w kolejności), więc awaria między krokami niczego nie gubi.
+        """
+        try:
+            with self.lock:
+                self._sync()
+                mark = self.journal.tell()
+                data = dict(self.data)
+                folded = self.journal_records
+            _write_json_atomic(self.path, data)  # zapis snapshotu bez blokady – put() działa dalej
+            with self.lock:
+                self.journal.flush()
+                with open(self.journal_path, "rb") as f:
+                    f.seek(mark)
+                    tail = f.read()
+                tmp_path = self.journal_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journal.close()
+                os.replace(tmp_path, self.journal_path)
+                self.journal = open(self.journal_path, "ab")
+                self.journal_records -= folded
+                self.unsynced = 0
+            print(f"Dziennik SKU skompaktowany: {len(data)} rekordów w {self.path}, {folded} rekordów dziennika.")
+        finally:
+            self.compactor = None
+
+    def close(self):
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        with self.lock:
+            if not self.journal.closed:
+                self._sync()
+                self.journal.close()
+            if not self.writer_lock.closed:
+                self.writer_lock.close()  # zamknięcie pliku zwalnia blokadę
+
+
+class SkuJournalReader:
+    """Mapowanie z backendu journal tylko do odczytu (update_products, update_erp).
+
+    Nie bierze blokady zapisującego i niczego nie zmienia w plikach – czyta
+    snapshot + dziennik (read_journal_map) obok działającego add_products czy
+    sync_sku_to_id. Mapa jest czytana ponownie dopiero, gdy zmieni się generacja.
+    """
+
+    def __init__(self, path: str = SKU_TO_ID_JSON, journal_path: Optional[str] = None):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + ".journal"
+        self.lock = threading.Lock()
+        self.cached: Optional[Tuple[str, Dict[str, str]]] = None
+
+    def generation(self) -> str:
+        return journal_generation(self.path, self.journal_path)
+
+    def load(self) -> Dict[str, str]:
+        generation = self.generation()  # przed odczytem – dopisanie w trakcie da kolejny odczyt, nie stary stan
+        with self.lock:
+            if self.cached is None or self.cached[0] != generation:
+                self.cached = (generation, read_journal_map(self.path, self.journal_path)[0])
+            return dict(self.cached[1])
+
+    def get(self, sku: str) -> Optional[str]:
+        return self.load().get(sku)
+
+    def count(self) -> int:
+        return len(self.load())
+
+    def export_json(self, path: str = SKU_TO_ID_JSON) -> int:
+        data = self.load()
+        _write_json_atomic(path, data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def _lock_writer(path: str):
+    """Wyłączna blokada pliku `path` na czas życia procesu zapisującego (czeka, gdy ma ją inny proces)."""
+    f = open(path, "a+b")
+    waiting = False
+    while True:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return f
+        except OSError:
+            if not waiting:
+                print(f"Dziennik SKU zapisuje inny proces ({path}) – czekam na zwolnienie...")
+                waiting = True
+            time.sleep(1)
+
+
+def read_journal_map(path: str = SKU_TO_ID_JSON, journal_path: Optional[str] = None) -> Tuple[Dict[str, str], int]:
+    """Snapshot JSON + odtworzony dziennik: (mapa SKU -> product_id, liczba rekordów dziennika).
+
+    Dziennik jest otwierany przed snapshotem: przy równoległym kompaktowaniu
+    odczyt widzi stary dziennik z nowym albo starym snapshotem – oba dają pełny stan.
+    """
+    data, records, _ = _read_journal(path, journal_path or os.path.splitext(path)[0] + ".journal")
+    return data, records
+
+
+def _read_journal(path: str, journal_path: str) -> Tuple[Dict[str, str], int, int]:
+    """Jak read_journal_map(), plus długość kompletnej części dziennika w bajtach (do naprawy końcówki)."""
+    journal = open(journal_path, "rb") if os.path.exists(journal_path) else None
+    try:
+        data = {str(k): str(v) for k, v in SkuStore._read_json(path).items()} if os.path.exists(path) else {}
+        records = 0
+        valid = 0
+        damaged = 0
+        if journal is not None:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    break  # ucięta ostatnia linia po awarii – wszystko przed nią jest kompletne
+                valid += len(line)
+                try:
+                    record = json.loads(line)
+                    sku, product_id = record["sku"], record["id"]
+                except (ValueError, KeyError, TypeError):
+                    damaged += 1  # uszkodzona linia nie blokuje odczytu reszty; kompaktowanie ją usunie
+                    continue
+                if product_id is None:
+                    data.pop(sku, None)
+                else:
+                    data[sku] = product_id
+                records += 1
+    finally:
+        if journal is not None:
+            journal.close()
+    if damaged:
+        print(f"Dziennik SKU {journal_path}: pominięto {damaged} uszkodzonych linii.")
+    return data, records, valid
+
+
+def journal_generation(path: str = SKU_TO_ID_JSON, journal_path: Optional[str] = None) -> str:
+    """Stan snapshotu + dziennika: zmienia się przy każdym dopisaniu i kompaktowaniu."""
+    journal_path = journal_path or os.path.splitext(path)[0] + ".journal"
+    snapshot = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    journal = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+    return f"journal:{snapshot}:{journal}"
+
+
+def store_generation(backend: str = SKU_STORE_BACKEND, directory: str = "") -> Optional[str]:
+    """Generacja bazy SKU bez otwierania jej do zapisu (np. dla GUI); None, gdy bazy nie ma."""
+    if backend == "journal":
+        return journal_generation(os.path.join(directory, SKU_TO_ID_JSON))
+    path = os.path.join(directory, SKU_STORE_FILE)
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+    try:
+        row = conn.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()
+        return "sqlite:" + row[0] if row else None
+    finally:
+        conn.close()
+
+
+def _write_json_atomic(path: str, data: Dict[str, str]):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_sku_store(backend: str = SKU_STORE_BACKEND, readonly: bool = False):
+    """Baza SKU -> product_id wybrana przez SKU_STORE_BACKEND (ten sam interfejs: load/get/put/put_many/...).
+
+    `readonly` – dla skryptów, które tylko czytają mapę: przy backendzie journal
+    SkuJournalReader (bez blokady zapisującego i bez naprawy dziennika).
+    """
+    if backend == "journal":
+        return SkuJournalReader() if readonly else SkuJournal()
+    return SkuStore()
+
+
+def _journal_benchmark(catalog: int = 30_000, new: int = 1_000):
+    """Koszt zapisu `new` nowych SKU: przepisywanie całego JSON co 100 dodań vs dziennik z grupowym fsync."""
+    import tempfile
+
+    base = {f"MPN-{i:07d}": str(i) for i in range(catalog)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sku_to_id.json")
+        _write_json_atomic(path, base)
+        data = dict(base)
+        started = time.perf_counter()
+        for i in range(new):
+            data[f"NEW-{i:07d}"] = str(catalog + i)
+            if (i + 1) % 100 == 0:
+                _write_json_atomic(path, data)
+        rewrite = time.perf_counter() - started
+
+        _write_json_atomic(path, base)
+        journal = SkuJournal(path, compact_min=10 ** 9)
+        started = time.perf_counter()
+        for i in range(new):
+            journal.put(f"NEW-{i:07d}", str(catalog + i))
+        journal.close()
+        appended = time.perf_counter() - started
+        replayed, records = read_journal_map(path)
+        same = "identyczna" if replayed == data else "RÓŻNA!"
+        print(f"{catalog} SKU + {new} nowych: przepisywanie JSON {rewrite * 1e3:.0f} ms, "
+              f"dziennik {appended * 1e3:.0f} ms ({records} rekordów), mapa po odtworzeniu {same}")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Baza SKU -> product_id (SQLite): import/eksport sku_to_id.json.")
+    parser.add_argument("--db", default=SKU_STORE_FILE, help=f"plik bazy (domyślnie {SKU_STORE_FILE})")
+    parser.add_argument("--import", dest="import_path", metavar="JSON", help="dopisz mapę z pliku JSON")
+    parser.add_argument("--replace", action="store_true", help="przy --import usuń SKU, których nie ma w pliku")
+    parser.add_argument("--export", dest="export_path", metavar="JSON", help="zapisz mapę do pliku JSON")
+    parser.add_argument("--compact", action="store_true", help="backend journal: złóż dziennik do sku_to_id.json")
+    parser.add_argument("--benchmark-journal", action="store_true", help="JSON co 100 dodań vs dziennik")
+    args = parser.parse_args()
+
+    if args.benchmark_journal:
+        _journal_benchmark()
+        return
+    if SKU_STORE_BACKEND == "journal":
+        store = SkuJournal() if args.compact or args.import_path else SkuJournalReader()
+        if args.compact:
+            store.compact()
+    else:
+        store = SkuStore(args.db, json_path=None)
+    if args.import_path:
+        count = store.import_json(args.import_path, replace=args.replace)
+        print(f"Zaimportowano {count} rekordów z {args.import_path} do {store.path}.")
+    if args.export_path:
+        count = store.export_json(args.export_path)
+        print(f"Wyeksportowano {count} rekordów z {store.path} do {args.export_path}.")
+    print(f"{store.path}: {store.count()} rekordów SKU-to-ID.")
+    if not isinstance(store, SkuStore):
+        store.close()
+
+
+if __name__ == "__main__":
+    _main()
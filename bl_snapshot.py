@@ -0,0 +1,357 @@
+import atexit
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bl_feed import CHUNK_SIZE, ITEM_FIELDS, FeedCache, FeedError, local_path, read_item
+from bl_feed_parallel import FEED_WORKERS, iter_rows_parallel
+
+FEED_SNAPSHOT_FILE = os.environ.get("FEED_SNAPSHOT_FILE", "feed_snapshot.sqlite")
+KEEP_VERSIONS = 2  # ile kompletnych wersji feedu trzymać na URL
+STALE_INCOMPLETE = 3600  # s – niedokończony zapis (przerwany proces) starszy niż tyle jest usuwany
+LEASE_TTL = 24 * 3600  # s – niezwolniona dzierżawa (przerwany proces) przestaje chronić wersję po tylu
+_INSERT_BATCH = 2000
+
+FIELDS = list(ITEM_FIELDS)
+
+
+class FeedSnapshot:
+    """Sparsowany feed w SQLite – wspólny dla add, update, ERP i GUI.
+
+    Każda wersja feedu (sha256 treści) to osobny zestaw wierszy z surowymi
+    polami ITEM_FIELDS w kolejności z feedu, z indeksem po SKU (g:mpn).
+    Wersja jest widoczna dla czytelników dopiero po `finish()`, a stare wersje
+    są usuwane (zostaje KEEP_VERSIONS na URL) – poza wersjami z dzierżawą
+    (`lease`), z których czytelnik jeszcze doczytuje pola.
+    """
+
+    def __init__(self, path: str = FEED_SNAPSHOT_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # GUI czyta w trakcie zapisu przez job
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS feed_versions ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, sha256 TEXT, "
+            "items INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, complete INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = ", ".join(f"{name} TEXT" for name in FIELDS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS feed_items (version_id INTEGER NOT NULL, pos INTEGER NOT NULL, "
+            f"{columns}, PRIMARY KEY (version_id, pos))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS feed_items_sku ON feed_items (version_id, mpn)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS feed_leases (version_id INTEGER NOT NULL, owner TEXT NOT NULL, "
+            "acquired_at REAL NOT NULL, PRIMARY KEY (version_id, owner))"
+        )
+        self.owner = f"{os.getpid()}.{id(self)}"
+        self.leased = False
+
+    def find_version(self, url: Optional[str] = None, sha256: Optional[str] = None) -> Optional[Dict]:
+        """Najnowsza kompletna wersja (dla URL i/lub sha256) albo None."""
+        query = "SELECT id, url, sha256, items, created_at FROM feed_versions WHERE complete = 1"
+        args = []
+        if url is not None:
+            query += " AND url = ?"
+            args.append(url)
+        if sha256 is not None:
+            query += " AND sha256 = ?"
+            args.append(sha256)
+        with self.lock:
+            row = self.conn.execute(query + " ORDER BY id DESC LIMIT 1", args).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "url", "sha256", "items", "created_at"), row))
+
+    def rows(self, version_id: int, fields: Optional[List[str]] = None) -> Iterator[Dict[str, Optional[str]]]:
+        """Wiersze wersji w kolejności z feedu (tylko `fields`, jeśli podane)."""
+        fields = fields or FIELDS
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {', '.join(fields)} FROM feed_items WHERE version_id = ? ORDER BY pos", (version_id,))
+        while True:
+            with self.lock:
+                batch = cursor.fetchmany(_INSERT_BATCH)
+            if not batch:
+                return
+            for row in batch:
+                yield dict(zip(fields, row))
+
+    def value(self, version_id: int, pos: int, field: str) -> Optional[str]:
+        """Jedno pole produktu na pozycji `pos` (np. opis czytany dopiero, gdy jest potrzebny).
+
+        FeedError, gdy wiersza nie ma (wersja usunięta) – brak wiersza to nie pusty opis.
+        """
+        if field not in FIELDS:
+            raise KeyError(field)
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {field} FROM feed_items WHERE version_id = ? AND pos = ?", (version_id, pos)
+            ).fetchone()
+        if row is None:
+            raise FeedError(f"Brak produktu {pos} w wersji {version_id} snapshotu feedu (wersja usunięta?)")
+        return row[0]
+
+    def lease(self, version_id: int):
+        """Chroni wersję przed usunięciem przez `_prune` (także w innych procesach) do `release()`."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO feed_leases (version_id, owner, acquired_at) VALUES (?, ?, ?)",
+                (version_id, self.owner, time.time()),
+            )
+        if not self.leased:
+            self.leased = True
+            atexit.register(self.release)
+
+    def release(self):
+        """Zwalnia dzierżawy tego obiektu (wołane też przy wyjściu z procesu)."""
+        with self.lock:
+            self.conn.execute("DELETE FROM feed_leases WHERE owner = ?", (self.owner,))
+
+    def lookup(self, skus: Iterable[str], version_id: int, fields: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """Wiersze dla podanych SKU (pierwsze wystąpienie SKU w feedzie)."""
+        fields = fields or FIELDS
+        result = {}
+        skus = list(skus)
+        with self.lock:
+            for i in range(0, len(skus), 500):
+                chunk = skus[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for row in self.conn.execute(
+                    f"SELECT mpn, {', '.join(fields)} FROM feed_items "
+                    f"WHERE version_id = ? AND mpn IN ({placeholders}) ORDER BY pos",
+                    [version_id] + chunk,
+                ):
+                    result.setdefault(row[0], dict(zip(fields, row[1:])))
+        return result
+
+    def write(self, url: str, rows: Iterable[Dict[str, Optional[str]]]) -> Iterator[Dict[str, Optional[str]]]:
+        """Zapisuje `rows` jako nową (jeszcze niewidoczną) wersję i przekazuje je dalej.
+
+        Po wyczerpaniu generatora id wersji jest w `self.pending`; `finish(sha256)`
+        ją publikuje, `discard()` usuwa.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO feed_versions (url, created_at) VALUES (?, ?)", (url, time.time())
+            )
+            version_id = cursor.lastrowid
+        self.pending = version_id
+        insert = (f"INSERT INTO feed_items (version_id, pos, {', '.join(FIELDS)}) "
+                  f"VALUES ({', '.join('?' * (len(FIELDS) + 2))})")
+        batch = []
+        pos = 0
+        for row in rows:
+            batch.append((version_id, pos) + tuple(row[name] for name in FIELDS))
+            pos += 1
+            if len(batch) >= _INSERT_BATCH:
+                self._insert(insert, batch)
+                batch = []
+            yield row
+        self._insert(insert, batch)
+        self.pending_items = pos
+
+    def _insert(self, sql: str, batch: List):
+        if not batch:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, batch)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def finish(self, sha256: str):
+        """Publikuje zapisaną wersję i czyści stare."""
+        version_id = self.pending
+        with self.lock:
+            self.conn.execute(
+                "UPDATE feed_versions SET sha256 = ?, items = ?, complete = 1 WHERE id = ?",
+                (sha256, self.pending_items, version_id),
+            )
+            url = self.conn.execute("SELECT url FROM feed_versions WHERE id = ?", (version_id,)).fetchone()[0]
+        self.pending = None
+        self._prune(url)
+
+    def discard(self):
+        if getattr(self, "pending", None) is None:
+            return
+        self._delete([self.pending])
+        self.pending = None
+
+    def _prune(self, url: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM feed_leases WHERE acquired_at < ?", (now - LEASE_TTL,))
+            keep = [row[0] for row in self.conn.execute(
+                "SELECT id FROM feed_versions WHERE url = ? AND complete = 1 ORDER BY id DESC LIMIT ?",
+                (url, KEEP_VERSIONS),
+            )]
+            old = [row[0] for row in self.conn.execute(
+                "SELECT id FROM feed_versions WHERE url = ? AND ((complete = 1 AND id NOT IN ({}) "
+                "AND id NOT IN (SELECT version_id FROM feed_leases)) "
+                "OR (complete = 0 AND created_at < ?))".format(", ".join("?" * len(keep)) or "NULL"),
+                [url] + keep + [now - STALE_INCOMPLETE],
+            )]
+        self._delete(old)
+
+    def _delete(self, version_ids: List[int]):
+        if not version_ids:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for version_id in version_ids:
+                    self.conn.execute("DELETE FROM feed_items WHERE version_id = ?", (version_id,))
+                    self.conn.execute("DELETE FROM feed_versions WHERE id = ?", (version_id,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class FeedStage:
+    """Etap feedu wspólny dla jobów: pobranie warunkowe -> snapshot -> surowe wiersze.
+
+    Feed jest parsowany raz na wersję: jeśli serwer odpowie 304 (albo plik
+    lokalny ma ten sam skrót), wiersze są czytane ze snapshotu bez parsowania
+    XML. Inaczej feed jest parsowany w trakcie pobierania i od razu zapisywany
+    jako nowa wersja snapshotu. Pomijanie niezmienionego feedu działa jak w
+    FeedCache (`already_pushed` / `mark_pushed`).
+    """
+
+    def __init__(self, url: str, job: str, snapshot_path: str = FEED_SNAPSHOT_FILE):
+        self.url = url
+        self.cache = FeedCache(url, job)
+        self.snapshot_path = snapshot_path
+        self.snapshot: Optional[FeedSnapshot] = None
+        self.version_id: Optional[int] = None  # wersja snapshotu po przeczytaniu całego feedu
+
+    @property
+    def sha256(self) -> Optional[str]:
+        return self.cache.sha256
+
+    def already_pushed(self, context: str = "") -> bool:
+        return self.cache.already_pushed(context)
+
+    def mark_pushed(self, context: str = ""):
+        self.cache.mark_pushed(context)
+
+    def value(self, pos: int, field: str) -> Optional[str]:
+        """Pole produktu z pozycji `pos` przeczytanego feedu (pozycja = kolejność z iter_rows)."""
+        if self.version_id is None:
+            return None
+        return self.snapshot.value(self.version_id, pos, field)
+
+    def _use_version(self, version_id: int):
+        # value() doczytuje pola z tej wersji długo po iter_rows – inny job nie może jej w tym czasie usunąć
+        self.version_id = version_id
+        self.snapshot.lease(version_id)
+
+    def _open_snapshot(self) -> FeedSnapshot:
+        if self.snapshot is not None:
+            self.snapshot.release()
+        self.snapshot = FeedSnapshot(self.snapshot_path)
+        self.version_id = None
+        return self.snapshot
+
+    def _from_snapshot(self, snapshot: FeedSnapshot, version: Dict) -> Iterator[Dict[str, Optional[str]]]:
+        self._use_version(version["id"])
+        msg = f"FEED: {version['items']} produktów ze snapshotu ({version['sha256'][:12]}) – bez parsowania XML"
+        logging.info(msg)
+        print(msg)
+        yield from snapshot.rows(version["id"])
+
+    def iter_rows(self, progress: bool = True) -> Iterator[Dict[str, Optional[str]]]:
+        """Surowe pola ITEM_FIELDS kolejnych produktów (FeedError przy błędzie pobierania/parsowania)."""
+        snapshot = self._open_snapshot()
+
+        path = local_path(self.url)
+        if path is not None and os.path.exists(path):
+            self.cache.sha256 = file_sha256(path)
+            version = snapshot.find_version(sha256=self.cache.sha256)
+            if version is not None:
+                yield from self._from_snapshot(snapshot, version)
+                return
+            if FEED_WORKERS > 1:
+                # duży plik lokalny: zakresy <item> parsowane równolegle w procesach, kolejność zachowana
+                yield from self._write_rows(snapshot, iter_rows_parallel(path, FEED_WORKERS, progress))
+                return
+
+        items = self.cache.iter_items(progress)
+        first = next(items, None)
+        # po pierwszym elemencie wiadomo, czy serwer odpowiedział 304 (znany sha256)
+        if self.cache.not_modified and self.cache.sha256:
+            version = snapshot.find_version(sha256=self.cache.sha256)
+            if version is not None:
+                items.close()
+                yield from self._from_snapshot(snapshot, version)
+                return
+
+        rows = (read_item(item) for item in chain([first] if first is not None else [], items))
+        yield from self._write_rows(snapshot, rows)
+
+    def iter_stock(self, progress: bool = True) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+        """Tylko (g:mpn, g:availability) – szybka ścieżka trybu stock-only.
+
+        Znana wersja feedu jest czytana ze snapshotu (dwie kolumny), a nowa –
+        skanerem iter_stock() bez pełnego parsowania; snapshot nie jest wtedy
+        zapisywany (reszta pól nie jest czytana).
+        """
+        snapshot = self._open_snapshot()
+        fields = ["mpn", "availability"]
+
+        path = local_path(self.url)
+        if path is not None and os.path.exists(path):
+            self.cache.sha256 = file_sha256(path)
+            version = snapshot.find_version(sha256=self.cache.sha256)
+            if version is not None:
+                self._use_version(version["id"])
+                yield from ((row["mpn"], row["availability"]) for row in snapshot.rows(version["id"], fields))
+                return
+
+        stock = self.cache.iter_stock(progress)
+        first = next(stock, None)
+        if self.cache.not_modified and self.cache.sha256:
+            version = snapshot.find_version(sha256=self.cache.sha256)
+            if version is not None:
+                stock.close()
+                self._use_version(version["id"])
+                yield from ((row["mpn"], row["availability"]) for row in snapshot.rows(version["id"], fields))
+                return
+        if first is not None:
+            yield first
+        yield from stock
+
+    def _write_rows(self, snapshot: FeedSnapshot, rows: Iterable[Dict[str, Optional[str]]]) -> Iterator[Dict[str, Optional[str]]]:
+        try:
+            yield from snapshot.write(self.url, rows)
+            if self.cache.sha256:
+                version_id = snapshot.pending
+                snapshot.finish(self.cache.sha256)
+                self._use_version(version_id)
+        finally:
+            snapshot.discard()
+
+
+def latest_snapshot(path: str = FEED_SNAPSHOT_FILE, url: Optional[str] = None):
+    """(FeedSnapshot, wersja) najnowszego kompletnego snapshotu albo (None, None) – np. dla GUI."""
+    if not os.path.exists(path):
+        return None, None
+    snapshot = FeedSnapshot(path)
+    return snapshot, snapshot.find_version(url=url)
@@ -1,27 +1,30 @@
-import requests
+import os
+from dotenv import load_dotenv
+from bl_limiter import create_limiter
+from bl_client import BaseLinkerClient, BaseLinkerError
+from bl_metadata import MetadataCache
 
-API_TOKEN = "6008178-6011029-R5ZC2W5BZKP2JRBFBLDFO5203A3I68OUA8HLLUB7T6XYOQLSOM89E6321EIL2H38"
+load_dotenv()
 
-url = "https://api.baselinker.com/connector.php"
+API_TOKEN = os.environ.get("API_TOKEN")
+API_URL = os.environ.get("API_URL", "https://api.baselinker.com/connector.php")
+REQUESTS_PER_MINUTE = int(os.environ.get("REQUESTS_PER_MINUTE", 80))
 
-payload = {
-    "token": API_TOKEN,
-    "method": "getInventoryExtraFields",
-    "parameters": "{}"
-}
+if not API_TOKEN:
+    raise SystemExit("Ustaw API_TOKEN w .env")
 
-response = requests.post(url, data=payload)
-response.raise_for_status()
+client = BaseLinkerClient(API_URL, API_TOKEN, create_limiter(int(REQUESTS_PER_MINUTE * 0.95), API_TOKEN))
+metadata = MetadataCache(client, API_TOKEN)  # --refresh-metadata wymusza pobranie z API
 
-data = response.json()
-
-if data.get("status") != "SUCCESS":
-    print("❌ Błąd API:", data)
+try:
+    extra_fields = metadata.extra_fields()
+except BaseLinkerError as e:
+    print("❌ Błąd API:", e)
     exit(1)
 
 print("✅ Extra fields w BaseLinkerze:\n")
 
-for field in data.get("extra_fields", []):
+for field in extra_fields:
     field_id = field.get("extra_field_id")
     name = field.get("name")
     field_type = field.get("type", "n/a")  # <-- bezpieczne
@@ -3,6 +3,7 @@ import os
 import sys
 import json
 import re
+import sqlite3
 from pathlib import Path
 
 from PyQt6.QtCore import Qt, QProcess, QTimer
@@ -23,6 +24,9 @@ SCRIPT_ERP = "update_erp.py"
 SCRIPT_SYNC = "sync_sku_to_id.py"
 
 SKU_JSON = "sku_to_id.json"
+SKU_STORE = "sku_to_id.sqlite"  # SKU -> product_id written by the scripts (bl_sku_store.py); the JSON is the legacy format
+SKU_INDEX = "sku_to_id.idx"  # memory-mapped copy of the SKU map (bl_sku_index.py), opened without parsing
+FEED_SNAPSHOT = "feed_snapshot.sqlite"  # parsed feed shared with the scripts (bl_snapshot.py)
 
 KNOWN_LOG_FILES = [
     "add_products.log",
@@ -69,13 +73,77 @@ def upsert_env_key(text: str, key: str, value: str) -> str:
 class SkuModel(QStandardItemModel):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setColumnCount(2)
-        self.setHorizontalHeaderLabels(["SKU", "product_id"])
+        self.setColumnCount(5)
+        self.setHorizontalHeaderLabels(["SKU", "product_id", "feed qty", "feed price", "ERP ID"])
 
-    def load_from_dict(self, d: dict):
+    def load_from_dict(self, d: dict, feed: dict = None):
+        feed = feed or {}
         self.setRowCount(0)
         for sku, pid in d.items():
-            self.appendRow([QStandardItem(str(sku)), QStandardItem(str(pid))])
+            row = feed.get(sku) or {}
+            self.appendRow([QStandardItem(str(sku)), QStandardItem(str(pid))] +
+                           [QStandardItem(row.get(k) or "") for k in ("availability", "price", "erp_id")])
+
+
+def fresh_sku_index(project_dir: Path, backend: str):
+    """Path of the SKU index if it matches the current state of the SKU store, else None."""
+    try:
+        if str(project_dir) not in sys.path:
+            sys.path.insert(0, str(project_dir))
+        from bl_sku_index import open_index
+        from bl_sku_store import store_generation
+        generation = store_generation(backend, str(project_dir))
+        index = open_index(str(project_dir / SKU_INDEX), generation) if generation else None
+        if index is None:
+            return None
+        index.close()
+        return project_dir / SKU_INDEX
+    except Exception:
+        return None
+
+
+def read_sku_map(path: Path):
+    """SKU -> product_id from the index (mmap), the SQLite store (read-only, safe while a script writes)
+    or a JSON file (+ journal)."""
+    if path.suffix == ".idx":
+        if str(path.parent) not in sys.path:
+            sys.path.insert(0, str(path.parent))
+        from bl_sku_index import SkuIndex
+        return SkuIndex(str(path))
+    if path.suffix == ".json" and path.with_suffix(".journal").exists():
+        # SKU_STORE_BACKEND=journal: snapshot JSON + append-only journal of new SKUs
+        if str(path.parent) not in sys.path:
+            sys.path.insert(0, str(path.parent))
+        from bl_sku_store import read_journal_map
+        return read_journal_map(str(path))[0]
+    if path.suffix == ".json":
+        data = json.loads(path.read_text(encoding="utf-8", errors="replace"))
+        if not isinstance(data, dict):
+            raise ValueError("sku_to_id.json must be a JSON object {SKU: product_id}")
+        return data
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+    try:
+        return dict(conn.execute("SELECT sku, product_id FROM sku_map"))
+    finally:
+        conn.close()
+
+
+def load_feed_snapshot(project_dir: Path, skus) -> tuple:
+    """Feed fields for the given SKUs from the latest snapshot written by the scripts: ({sku: row}, info)."""
+    path = project_dir / FEED_SNAPSHOT
+    if not path.exists():
+        return {}, "no feed snapshot"
+    try:
+        if str(project_dir) not in sys.path:
+            sys.path.insert(0, str(project_dir))
+        from bl_snapshot import latest_snapshot
+        snapshot, version = latest_snapshot(str(path))
+        if version is None:
+            return {}, "no feed snapshot"
+        rows = snapshot.lookup(skus, version["id"], ["availability", "price", "erp_id"])
+        return rows, f"feed {version['sha256'][:12]}: {version['items']:,} items"
+    except Exception as e:
+        return {}, f"feed snapshot unavailable ({e})"
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -161,6 +229,10 @@ class MainWindow(QMainWindow):
         self.btn_update.clicked.connect(lambda: self.run_script(SCRIPT_UPDATE))
         row.addWidget(self.btn_update)
 
+        self.btn_stock = QPushButton("UPDATE stock only")
+        self.btn_stock.clicked.connect(lambda: self.run_script(SCRIPT_UPDATE, ["--stock-only"]))
+        row.addWidget(self.btn_stock)
+
         self.btn_erp = QPushButton("UPDATE ERP_ID (extra_field_9157)")
         self.btn_erp.clicked.connect(lambda: self.run_script(SCRIPT_ERP))
         row.addWidget(self.btn_erp)
@@ -209,7 +281,7 @@ class MainWindow(QMainWindow):
         top = QHBoxLayout()
         self.lbl_sku_file = QLabel("")
         self.lbl_sku_file.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-        top.addWidget(QLabel("sku_to_id.json:"))
+        top.addWidget(QLabel("SKU -> product_id:"))
         top.addWidget(self.lbl_sku_file, 1)
 
         self.btn_reload_sku = QPushButton("Reload")
@@ -220,6 +292,10 @@ class MainWindow(QMainWindow):
         self.btn_open_sku.clicked.connect(self.open_sku_file)
         top.addWidget(self.btn_open_sku)
 
+        self.btn_export_sku = QPushButton("Export JSON…")
+        self.btn_export_sku.clicked.connect(self.export_sku_json)
+        top.addWidget(self.btn_export_sku)
+
         root.addLayout(top)
 
         filt = QHBoxLayout()
@@ -484,13 +560,40 @@ class MainWindow(QMainWindow):
 
     # ---------- SKU ----------
     def open_sku_file(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Open sku_to_id.json", str(self.project_dir), "JSON (*.json);;All (*.*)")
+        path, _ = QFileDialog.getOpenFileName(self, "Open SKU map", str(self.project_dir),
+                                              "SKU store / index / JSON (*.sqlite *.idx *.json);;All (*.*)")
         if not path:
             return
         self._load_sku(Path(path))
 
     def load_sku_json(self):
-        self._load_sku(self.project_dir / SKU_JSON)
+        backend = parse_env(load_env_text(self.env_path)).get("SKU_STORE_BACKEND", "sqlite")
+        index = fresh_sku_index(self.project_dir, backend)
+        store = self.project_dir / SKU_STORE
+        if index is not None:
+            self._load_sku(index)
+        elif backend != "journal" and store.exists():
+            self._load_sku(store)
+        else:
+            self._load_sku(self.project_dir / SKU_JSON)
+
+    def export_sku_json(self):
+        store = self.project_dir / SKU_STORE
+        if not store.exists():
+            QMessageBox.information(self, "Export", f"No SKU store yet: {store}")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export sku_to_id.json", str(self.project_dir / SKU_JSON),
+                                              "JSON (*.json)")
+        if not path:
+            return
+        try:
+            if str(self.project_dir) not in sys.path:
+                sys.path.insert(0, str(self.project_dir))
+            from bl_sku_store import SkuStore
+            count = SkuStore(str(store), json_path=None).export_json(path)
+            QMessageBox.information(self, "Export", f"Exported {count:,} records to {path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to export:\n{e}")
 
     def _load_sku(self, path: Path):
         self.lbl_sku_file.setText(str(path))
@@ -499,15 +602,14 @@ class MainWindow(QMainWindow):
                 self.lbl_count.setText("File not found")
                 self.sku_model.load_from_dict({})
                 return
-            data = json.loads(path.read_text(encoding="utf-8", errors="replace"))
-            if not isinstance(data, dict):
-                raise ValueError("sku_to_id.json must be a JSON object {SKU: product_id}")
-            self.sku_model.load_from_dict(data)
-            self.lbl_count.setText(f"{len(data):,} records")
+            data = read_sku_map(path)
+            feed, feed_info = load_feed_snapshot(self.project_dir, data.keys())
+            self.sku_model.load_from_dict(data, feed)
+            self.lbl_count.setText(f"{len(data):,} records | {feed_info}")
         except Exception as e:
             self.sku_model.load_from_dict({})
             self.lbl_count.setText("0 records")
-            QMessageBox.critical(self, "Error", f"Failed to load JSON:\n{e}")
+            QMessageBox.critical(self, "Error", f"Failed to load SKU map:\n{e}")
 
     # ---------- Logs ----------
     def open_log_file(self):
@@ -535,7 +637,7 @@ class MainWindow(QMainWindow):
             self.log_view.setPlainText(f"Failed to read log:\n{e}")
 
     # ---------- Runner ----------
-    def run_script(self, script_name: str):
+    def run_script(self, script_name: str, args: list = None):
         if self.process and self.process.state() != QProcess.ProcessState.NotRunning:
             QMessageBox.warning(self, "Running", "A script is already running. Stop it first.")
             return
@@ -557,7 +659,7 @@ class MainWindow(QMainWindow):
                 return
 
         self.console.clear()
-        self._append_console(f"==> Running {script_name}\n")
+        self._append_console(f"==> Running {' '.join([script_name] + (args or []))}\n")
         self.current_script = script_name
 
         # init progress
@@ -572,7 +674,7 @@ class MainWindow(QMainWindow):
 
         python_exe = sys.executable
         self.process.setProgram(python_exe)
-        self.process.setArguments([str(script_path)])
+        self.process.setArguments([str(script_path)] + (args or []))
 
         self.process.readyReadStandardOutput.connect(self._on_stdout)
         self.process.readyReadStandardError.connect(self._on_stderr)
@@ -1,10 +1,18 @@
-import requests
+import hashlib
 import json
 import logging
 import os
+import random
+import sys
 import time
 from dotenv import load_dotenv
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from bl_limiter import create_limiter
+from bl_client import BaseLinkerClient, HttpTransport, PermanentError
+from bl_metadata import MetadataCache
+from bl_sku_store import open_sku_store
+from bl_sku_index import refresh_index
+from bl_registry import ProductRegistry
 
 load_dotenv()
 
@@ -13,9 +21,18 @@ API_TOKEN = os.environ.get('API_TOKEN')  # Wstaw swój token API BaseLinker jako
 API_URL = os.environ.get('API_URL')
 INVENTORY_ID = os.environ.get('INVENTORY_ID')  # Poprawny ID magazynu BaseLinker
 NEW_INVENTORY_ID = os.environ.get('NEW_INVENTORY_ID')  # ID nowego katalogu
-SKU_TO_ID_FILE = "sku_to_id.json"  # Plik do przechowywania mapowania SKU -> product_id
+METRICS_FILE = "sync_sku_to_id.metrics.json"  # Podsumowanie wywołań API z przebiegu (obok logu)
 REQUESTS_PER_MINUTE = int(os.environ.get('REQUESTS_PER_MINUTE', 80))  # Limit zapytań na minutę
-SLEEP_TIME = 60 / REQUESTS_PER_MINUTE  # Czas między żądaniami (0.12s)
+SAFE_RPM = int(REQUESTS_PER_MINUTE * 0.95)
+PAUSE_DURATION = 360  # Pauza (s), gdy nie da się odczytać czasu blokady tokena
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 4))  # Ponowienia po błędach sieci / 5xx (z losowym backoffem)
+RATE_SHARE = float(os.environ.get('RATE_SHARE_SYNC', 1.0))  # Udział tego joba we wspólnym budżecie tokena (0-1]
+SYNC_STATE_FILE = "sync_sku_to_id.state.json"  # Znacznik ostatniego przebiegu: strony getProductsList (zakres ID, skrót)
+# --incremental (albo SYNC_INCREMENTAL=1): tylko strony za znacznikiem + próbka starszych; --full-sync wymusza pełny przebieg
+INCREMENTAL = "--incremental" in sys.argv or os.environ.get('SYNC_INCREMENTAL', '0') == '1'
+FULL_SYNC = "--full-sync" in sys.argv
+SAMPLE_PAGES = int(os.environ.get('SYNC_SAMPLE_PAGES', 2))  # Ile starszych stron sprawdzić w trybie przyrostowym
+FULL_SWEEP_HOURS = float(os.environ.get('SYNC_FULL_SWEEP_HOURS', 24))  # Pełny przebieg co tyle godzin
 
 # Konfiguracja logowania
 logging.basicConfig(
@@ -27,118 +44,249 @@ logging.basicConfig(
 # Globalna zmienna do przechowywania bazy SKU-to-ID w pamięci
 sku_to_id_cache = {}
 
+limiter = create_limiter(SAFE_RPM, API_TOKEN, share=RATE_SHARE)
+client = BaseLinkerClient(API_URL, API_TOKEN, limiter, transport=HttpTransport(pool_size=1),
+                          max_retries=MAX_RETRIES, pause_fallback=PAUSE_DURATION)
+metadata = MetadataCache(client, API_TOKEN)
+sku_store = open_sku_store()  # SKU -> product_id (SQLite albo JSON + dziennik, SKU_STORE_BACKEND)
+registry = ProductRegistry()  # rejestr produktów (product_id dopasowywane do bazy SKU po synchronizacji)
+
 def load_sku_to_id() -> Dict[str, str]:
-    """Ładuje mapowanie SKU -> product_id z pliku JSON."""
+    """Ładuje mapowanie SKU -> product_id z bazy SKU (bl_sku_store)."""
     global sku_to_id_cache
-    if os.path.exists(SKU_TO_ID_FILE):
-        try:
-            with open(SKU_TO_ID_FILE, "r", encoding="utf-8") as f:
-                sku_to_id_cache = json.load(f)
-            logging.info(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-            print(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-        except Exception as e:
-            logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            sku_to_id_cache = {}
-    else:
-        logging.warning("Plik SKU-to-ID nie istnieje. Inicjalizowanie pustej bazy.")
-        print("Plik SKU-to-ID nie istnieje. Inicjalizowanie pustej bazy.")
+    try:
+        sku_to_id_cache = sku_store.load()
+        logging.info(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+        print(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+    except Exception as e:
+        logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
+        print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
         sku_to_id_cache = {}
     return sku_to_id_cache
 
-def save_sku_to_id():
-    """Zapisuje mapowanie SKU -> product_id do pliku JSON."""
+def save_sku_to_id(changed: Dict[str, str], removed: List[str]) -> bool:
+    """Zapisuje do bazy SKU tylko zmiany (upsert nowych/zmienionych, usunięcie znikniętych)."""
     try:
-        with open(SKU_TO_ID_FILE, "w", encoding="utf-8") as f:
-            json.dump(sku_to_id_cache, f, ensure_ascii=False, indent=2)
-        logging.info(f"Zapisano bazę SKU-to-ID do pliku: {len(sku_to_id_cache)} rekordów.")
-        print(f"Zapisano bazę SKU-to-ID do pliku: {len(sku_to_id_cache)} rekordów.")
+        sku_store.put_many(changed.items())
+        sku_store.delete_many(removed)
+        logging.info(f"Zapisano zmiany w bazie SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+        print(f"Zapisano zmiany w bazie SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+        return True
     except Exception as e:
         logging.error(f"Błąd podczas zapisywania bazy SKU-to-ID: {str(e)}")
         print(f"Błąd podczas zapisywania bazy SKU-to-ID: {str(e)}")
+        return False
 
 def get_valid_storage_id() -> str:
     """Pobiera listę magazynów i sprawdza poprawność INVENTORY_ID."""
-    headers = {"X-BLToken": API_TOKEN}
-    params = {
-        "method": "getStoragesList",
-        "parameters": json.dumps({})
-    }
-    
     try:
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") != "SUCCESS":
-            logging.error(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            print(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            return None
-        
-        storages = response_data.get("storages", [])
-        for storage in storages:
-            if storage.get("storage_id") == INVENTORY_ID:
-                print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                return INVENTORY_ID
+        storage = metadata.find_storage(INVENTORY_ID)  # z cache metadanych (TTL), bez zapytania przy każdym starcie
+        if storage:
+            print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            return INVENTORY_ID
         
+        storages = metadata.storages()
         logging.error(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         print(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         return None
+    except PermanentError as e:
+        logging.error(f"Błąd pobierania listy magazynów: {str(e)}")
+        print(f"Błąd pobierania listy magazynów: {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas pobierania listy magazynów: {str(e)}")
         print(f"Błąd podczas pobierania listy magazynów: {str(e)}")
         return None
 
-def get_products_from_baselinker(storage_id: str) -> Dict[str, str]:
-    """Pobiera listę wszystkich produktów z BaseLinker dla podanego magazynu z paginacją."""
-    headers = {"X-BLToken": API_TOKEN}
+# Strona getProductsList: lista (sku, product_id) w kolejności z API
+Page = List[Tuple[str, str]]
+
+
+def fetch_page(storage_id: str, page: int) -> Optional[Page]:
+    """Pobiera jedną stronę getProductsList; None przy błędzie (po ponowieniach)."""
+    params = {
+        "storage_id": storage_id,
+        "page": page,
+        "include_variants": False  # Pobierz tylko główne produkty (bez wariantów)
+    }
+    try:
+        response_data = client.call("getProductsList", params)
+    except Exception as e:
+        logging.error(f"Błąd pobierania produktów z BaseLinker (strona {page}): {str(e)}")
+        print(f"Błąd pobierania produktów z BaseLinker (strona {page}): {str(e)}")
+        return None
+    products = response_data.get("products", [])
+    logging.info(f"Pobrano {len(products)} produktów z BaseLinker (strona {page}).")
+    return [(product.get("sku", "") or "", str(product.get("product_id", "") or "")) for product in products]
+
+
+def page_summary(entries: Page) -> Dict:
+    """Zakres product_id, liczba i skrót zawartości strony – do porównań z kolejnym przebiegiem."""
+    digest = hashlib.sha256(json.dumps(entries, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return {"first": int(entries[0][1]), "last": int(entries[-1][1]), "count": len(entries), "hash": digest}
+
+
+def sorted_by_id(entries: Page) -> bool:
+    ids = [int(product_id) for _, product_id in entries]
+    return all(a < b for a, b in zip(ids, ids[1:]))
+
+
+def load_sync_state(storage_id: str) -> Optional[Dict]:
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("storage_id") != str(storage_id) or not state.get("pages"):
+        return None
+    return state
+
+
+def save_sync_state(state: Dict):
+    tmp_path = SYNC_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+
+def collect(entries: Page, current_skus: Dict[str, str]):
+    for sku, product_id in entries:
+        if sku and product_id:
+            current_skus[sku] = product_id
+
+
+def get_products_from_baselinker(storage_id: str) -> Optional[Tuple[Dict[str, str], Optional[List], Optional[Dict]]]:
+    """Pobiera produkty z BaseLinker: (SKU -> product_id, sprawdzone zakresy product_id, nowy znacznik).
+
+    Pełny przebieg czyta wszystkie strony (zakresy = None: lista jest kompletna).
+    W trybie przyrostowym – tylko strony za znacznikiem i próbkę starszych;
+    SKU spoza zwróconych zakresów nie są wtedy uznawane za usunięte. Zwraca
+    None, jeśli którejkolwiek strony nie udało się pobrać – niepełna lista
+    usunęłaby z bazy SKU, które nadal istnieją. Znacznik zapisuje wywołujący,
+    dopiero gdy zmiany trafią do bazy SKU.
+    """
+    state = load_sync_state(storage_id) if INCREMENTAL and not FULL_SYNC else None
+    if state is not None and time.time() - state.get("full_sweep_at", 0) < FULL_SWEEP_HOURS * 3600:
+        result = get_products_incremental(storage_id, state)
+        if result != "full":
+            return result
+    return get_products_full(storage_id)
+
+
+def get_products_full(storage_id: str):
+    """Wszystkie strony po kolei; przy okazji liczy znacznik dla trybu przyrostowego."""
     current_skus = {}
+    pages = []
     page = 1
     while True:
-        params = {
-            "method": "getProductsList",
-            "parameters": json.dumps({
-                "storage_id": storage_id,
-                "page": page,
-                "include_variants": False  # Pobierz tylko główne produkty (bez wariantów)
-            })
-        }
-        
-        try:
-            response = requests.post(API_URL, headers=headers, data=params)
-            response_data = response.json()
-            
-            if response_data.get("status") != "SUCCESS":
-                logging.error(f"Błąd pobierania produktów z BaseLinker (strona {page}): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-                print(f"Błąd pobierania produktów z BaseLinker (strona {page}): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-                return current_skus
-            
-            products = response_data.get("products", [])
-            if not products:  # Brak kolejnych produktów – koniec paginacji
-                break
-                
-            for product in products:
-                sku = product.get("sku", "")
-                product_id = product.get("product_id", "")
-                if sku and product_id:
-                    current_skus[sku] = product_id
-            
-            logging.info(f"Pobrano {len(products)} produktów z BaseLinker (strona {page}).")
-            total_loaded = len(current_skus)
-            print(f"[PAGE {page}] Pobrano {len(products)} | Łącznie: {total_loaded}")
+        entries = fetch_page(storage_id, page)
+        if entries is None:
+            return None
+        if not entries:  # Brak kolejnych produktów – koniec paginacji
+            break
+        collect(entries, current_skus)
+        pages.append(entries)
+        total_loaded = len(current_skus)
+        print(f"[PAGE {page}] Pobrano {len(entries)} | Łącznie: {total_loaded}")
+
+        page += 1
+
+    state = None
+    try:
+        if all(sorted_by_id(entries) for entries in pages):
+            state = {"storage_id": str(storage_id), "full_sweep_at": time.time(),
+                     "page_size": max((len(entries) for entries in pages), default=0),
+                     "pages": [page_summary(entries) for entries in pages]}
+        else:
+            logging.warning("Strony getProductsList nie są posortowane po product_id – tryb przyrostowy niedostępny.")
+    except ValueError:
+        logging.warning("Nieliczbowe product_id – tryb przyrostowy niedostępny.")
 
-            page += 1
-            time.sleep(SLEEP_TIME)  # Respektowanie limitu 500/min
-        except Exception as e:
-            logging.error(f"Błąd podczas pobierania produktów z BaseLinker (strona {page}): {str(e)}")
-            print(f"Błąd podczas pobierania produktów z BaseLinker (strona {page}): {str(e)}")
-            return current_skus
-    
     logging.info(f"Łącznie pobrano {len(current_skus)} produktów z BaseLinker.")
     print(f"START SYNC: {len(current_skus)} produktów z BaseLinker")
-    return current_skus
+    return current_skus, None, state
+
+
+def get_products_incremental(storage_id: str, state: Dict):
+    """Strony od ostatniej znanej (za znacznikiem) do końca + SAMPLE_PAGES losowych starszych.
+
+    Ostatnia znana strona musi zaczynać się tym samym product_id co poprzednio –
+    inaczej coś zniknęło wcześniej na liście (strony się przesunęły) i potrzebny
+    jest pełny przebieg ("full"). Zmiany od tej strony w górę (nowe, usunięte,
+    zmienione SKU) są w sprawdzonym zakresie. Starsza strona z innym skrótem,
+    ale tym samym zakresem ID, to zmienione SKU – też wchodzi do porównania.
+    """
+    pages = state["pages"]
+    page_size = state["page_size"]
+    last = len(pages)
+    current_skus = {}
+    covered = []
+    fetched = 0
+    try:
+        entries = fetch_page(storage_id, last)
+        if entries is None:
+            return None
+        fetched += 1
+        known = pages[-1]
+        if not entries or int(entries[0][1]) != known["first"]:
+            print("SYNC: lista produktów przesunęła się od ostatniego przebiegu (usunięcia) – pełna synchronizacja.")
+            logging.info("Tryb przyrostowy: ostatnia znana strona się zmieniła – pełny przebieg.")
+            return "full"
+        tail = [entries]
+        page = last
+        while len(entries) >= page_size:
+            page += 1
+            entries = fetch_page(storage_id, page)
+            if entries is None:
+                return None
+            fetched += 1
+            if not entries:
+                break
+            tail.append(entries)
+        for entries in tail:
+            if not sorted_by_id(entries):
+                return "full"
+            collect(entries, current_skus)
+        covered.append((known["first"], float("inf")))
+        new_pages = pages[:-1] + [page_summary(entries) for entries in tail]
+
+        for page in sorted(random.sample(range(1, last), min(SAMPLE_PAGES, last - 1))):
+            entries = fetch_page(storage_id, page)
+            if entries is None:
+                return None
+            fetched += 1
+            summary = page_summary(entries) if entries else None
+            old = pages[page - 1]
+            if summary is None or (summary["first"], summary["last"], summary["count"]) != (old["first"], old["last"], old["count"]):
+                print(f"SYNC: strona {page} zmieniła zakres produktów – pełna synchronizacja.")
+                return "full"
+            if summary["hash"] != old["hash"]:
+                logging.info(f"Tryb przyrostowy: zmienione SKU na stronie {page}.")
+                new_pages[page - 1] = summary
+            collect(entries, current_skus)
+            covered.append((old["first"], old["last"]))
+    except ValueError:  # nieliczbowe product_id
+        return "full"
+
+    logging.info(f"Tryb przyrostowy: {fetched} z {len(new_pages)} stron, {len(current_skus)} produktów.")
+    print(f"START SYNC (przyrostowo): {len(current_skus)} produktów z {fetched}/{len(new_pages)} stron BaseLinker")
+    page_size = max([page_size] + [len(entries) for entries in tail])
+    return current_skus, covered, dict(state, pages=new_pages, page_size=page_size)
+
+
+def in_covered(product_id: str, covered: Optional[List[Tuple[int, float]]]) -> bool:
+    """Czy produkt leży w sprawdzonym zakresie ID (None = pełna lista)."""
+    if covered is None:
+        return True
+    try:
+        value = int(product_id)
+    except ValueError:
+        return False
+    return any(lo <= value <= hi for lo, hi in covered)
 
 def sync_sku_to_id():
-    """Synchronizuje sku_to_id.json z aktualnym stanem produktów w BaseLinker."""
+    """Synchronizuje bazę SKU-to-ID z aktualnym stanem produktów w BaseLinker."""
     global sku_to_id_cache
     # Załaduj istniejącą bazę
     load_sku_to_id()
@@ -151,29 +299,41 @@ def sync_sku_to_id():
         return
     
     # Pobierz aktualną listę produktów z BaseLinker
-    current_products = get_products_from_baselinker(storage_id)
+    fetched = get_products_from_baselinker(storage_id)
+    if fetched is None:
+        logging.error("Synchronizacja przerwana: nie pobrano pełnej listy produktów, baza SKU-to-ID bez zmian.")
+        print("Synchronizacja przerwana: nie pobrano pełnej listy produktów, baza SKU-to-ID bez zmian.")
+        return
+    current_products, covered, sync_state = fetched
     
     # Aktualizuj bazę SKU-to-ID
     initial_count = len(sku_to_id_cache)
     updated_count = 0
     new_entries = 0
+    changed = {}
     
     total = len(current_products)
     for i, (sku, product_id) in enumerate(current_products.items(), start=1):
+        product_id = str(product_id)  # baza SKU trzyma product_id jako tekst
         if sku not in sku_to_id_cache:
             sku_to_id_cache[sku] = product_id
+            changed[sku] = product_id
             new_entries += 1
         elif sku_to_id_cache[sku] != product_id:
             sku_to_id_cache[sku] = product_id
+            changed[sku] = product_id
             updated_count += 1
         if i % 1000 == 0:
             print(f"[{i}/{total}] SYNC SKU -> ID")
 
     
-    # Usuń SKU, które nie istnieją w aktualnej liście z BaseLinker
-    removed_count = sum(1 for sku in list(sku_to_id_cache.keys()) if sku not in current_products)
+    # Usuń SKU, które nie istnieją w aktualnej liście z BaseLinker (w trybie przyrostowym: w sprawdzonych zakresach ID)
+    removed = [sku for sku, product_id in sku_to_id_cache.items()
+               if sku not in current_products and in_covered(product_id, covered)]
+    removed_count = len(removed)
     if removed_count > 0:
-        sku_to_id_cache = {sku: product_id for sku, product_id in sku_to_id_cache.items() if sku in current_products}
+        gone = set(removed)
+        sku_to_id_cache = {sku: product_id for sku, product_id in sku_to_id_cache.items() if sku not in gone}
     
     # Zapisanie bazy, jeśli były zmiany lub baza była pusta
     if new_entries > 0 or updated_count > 0 or removed_count > 0 or initial_count == 0:
@@ -186,10 +346,17 @@ def sync_sku_to_id():
         if removed_count > 0:
             logging.info(f"Usunięto {removed_count} nieistniejących SKU z bazy SKU-to-ID.")
             print(f"Usunięto {removed_count} nieistniejących SKU z bazy SKU-to-ID.")
-        save_sku_to_id()
+        if not save_sku_to_id(changed, removed):
+            return  # znacznik bez zmian – następny przebieg sprawdzi te strony ponownie
+        refresh_index(sku_store)  # indeks mmap dla update_products / update_erp / GUI
+        registry.reconcile(sku_store)  # tylko różnice: nowe, zmienione i usunięte product_id
     else:
         logging.info("Brak zmian w bazie SKU-to-ID – wszystkie SKU są aktualne.")
         print("Brak zmian w bazie SKU-to-ID – wszystkie SKU są aktualne.")
+    if sync_state is not None:
+        save_sync_state(sync_state)
 
 if __name__ == "__main__":
-    sync_sku_to_id()
\ No newline at end of file
+    sync_sku_to_id()
+    client.transport.report()
+    client.write_run_summary(METRICS_FILE)
\ No newline at end of file
@@ -1,111 +1,117 @@
-import os, json, time, requests, threading
-import xml.etree.ElementTree as ET
+import os, sys, time, asyncio
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import deque
 from datetime import timedelta
+from bl_limiter import create_limiter
+from bl_client import BaseLinkerClient, HttpTransport
+from bl_feed import fingerprint
+from bl_snapshot import FeedStage
+from bl_sku_store import open_sku_store
+from bl_sku_index import load_sku_map
+from bl_registry import ProductRegistry
 import time
 
 load_dotenv()
 
-API_URL = "https://api.baselinker.com/connector.php"
+API_URL = os.getenv("API_URL", "https://api.baselinker.com/connector.php")  # np. lokalny bl_mock_server.py
 API_TOKEN = os.getenv("BASELINKER_TOKEN") or os.getenv("API_TOKEN")
 INVENTORY_ID = int(os.getenv("NEW_INVENTORY_ID", "0"))
 XML_URL = os.getenv("XML_URL", "")
 EXTRA_FIELD_ID = 9157  # ERP_ID
+METRICS_FILE = "update_erp.metrics.json"  # podsumowanie wywołań API (obok update_erp.log)
 
 # ustaw pod swój limit
 REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", "500"))
 SAFE_RPM = int(REQUESTS_PER_MINUTE * 0.95)  # np 475
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+RATE_BURST = int(os.getenv("RATE_BURST", "1"))
+PAUSE_DURATION = 360  # gdy nie da się odczytać czasu blokady tokena
+MAX_BLOCK_RETRIES = 5
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "4"))  # ponowienia po błędach sieci / 5xx
+# tryb asyncio (--async albo USE_ASYNC=1): setki zapytań w locie bez setek wątków
+USE_ASYNC = "--async" in sys.argv or os.getenv("USE_ASYNC", "0") == "1"
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "200"))
+RATE_SHARE = float(os.getenv("RATE_SHARE_ERP", "1.0"))  # udział w budżecie tokena
 
-class RateLimiter:
-    def __init__(self, per_minute: int):
-        self.per_minute = per_minute
-        self.lock = threading.Lock()
-        self.calls = deque()
+limiter = create_limiter(SAFE_RPM, API_TOKEN, burst=RATE_BURST, share=RATE_SHARE)
 
-    def wait(self):
-        now = time.monotonic()
-        with self.lock:
-            while self.calls and now - self.calls[0] >= 60:
-                self.calls.popleft()
+client = BaseLinkerClient(API_URL, API_TOKEN, limiter, transport=HttpTransport(pool_size=MAX_WORKERS),
+                          max_retries=MAX_RETRIES,
+                          pause_fallback=PAUSE_DURATION, max_block_retries=MAX_BLOCK_RETRIES)
 
-            if len(self.calls) >= self.per_minute:
-                sleep_for = 60 - (now - self.calls[0])
-            else:
-                sleep_for = 0
-
-        if sleep_for > 0:
-            time.sleep(sleep_for)
-
-        with self.lock:
-            self.calls.append(time.monotonic())
-
-limiter = RateLimiter(SAFE_RPM)
-
-thread_local = threading.local()
-def get_session():
-    if not hasattr(thread_local, "session"):
-        thread_local.session = requests.Session()
-    return thread_local.session
+feed = FeedStage(XML_URL, "update_erp")  # pobieranie warunkowe + wspólny snapshot + pomijanie niezmienionego feedu
+registry = ProductRegistry()  # SKU / product_id / ERP ID / EAN z indeksami – zamiast łączenia słowników w każdym przebiegu
 
 def bl_call(method: str, params: dict):
-    limiter.wait()
-    headers = {"X-BLToken": API_TOKEN}
-    payload = {"method": method, "parameters": json.dumps(params, ensure_ascii=False)}
-    s = get_session()
-    r = s.post(API_URL, headers=headers, data=payload, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("status") != "SUCCESS":
-        raise RuntimeError(f"{method} ERROR: {data.get('error_message')} ({data.get('error_code')})")
-    return data
-
-def load_sku_to_id_json(path="sku_to_id.json"):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def fetch_xml_sku_to_erp():
-    r = requests.get(XML_URL, timeout=60)
-    r.raise_for_status()
-    root = ET.fromstring(r.content)
-    ns = {"g": "http://base.google.com/ns/1.0"}
-
-    sku_to_erp = {}
-    for item in root.findall(".//item"):
-        sku = (item.findtext("g:mpn", default="", namespaces=ns) or "").strip()
-        erp_id = (item.findtext("g:id", default="", namespaces=ns) or "").strip()
-        if sku and erp_id:
-            sku_to_erp[sku] = erp_id
-    return sku_to_erp
-
-def update_one(sku: str, inv_pid: str, erp_id: str, text_key: str):
+    # sieć/5xx -> ponowienia z backoffem, blokada tokena -> wspólna pauza, walidacja -> PermanentError
+    # pas "backfill": stany i ceny z update_products dostają sloty przed tym zadaniem
+    return client.call(method, params, lane="backfill")
+
+def load_sku_to_id():
+    # baza SKU -> product_id (SQLite albo JSON + dziennik, SKU_STORE_BACKEND) czytana przez indeks mmap;
+    # product_id w rejestrze dopasowywane tylko, gdy baza SKU się zmieniła
+    sku_store = open_sku_store(readonly=True)
+    registry.reconcile(sku_store)
+    return load_sku_map(sku_store)
+
+def feed_products():
+    for row in feed.iter_rows():
+        yield {"sku": (row["mpn"] or "").strip(), "erp_id": (row["erp_id"] or "").strip(),
+               "ean": (row["gtin"] or "").strip()}
+
+def sync_feed_to_registry():
+    # strumieniowo: do rejestru trafiają tylko zmienione ERP ID / EAN, bez słownika SKU -> ERP w pamięci
+    for _ in registry.track_feed(feed_products()):
+        pass
+
+def erp_params(inv_pid: str, erp_id: str, text_key: str, inventory_id: int = INVENTORY_ID) -> dict:
     # addInventoryProduct z product_id = update istniejącego
-    bl_call("addInventoryProduct", {
-        "inventory_id": INVENTORY_ID,
+    return {
+        "inventory_id": inventory_id,
         "product_id": str(inv_pid),
         "text_fields": {
             text_key: str(erp_id)
         }
-    })
+    }
+
+def update_one(sku: str, inv_pid: str, erp_id: str, text_key: str):
+    bl_call("addInventoryProduct", erp_params(inv_pid, erp_id, text_key))
     return sku
 
-def update_extra_fields_only_listed_parallel(listed_sku_to_id, xml_sku_to_erp):
-    total_listed = len(listed_sku_to_id)
-    text_key = f"extra_field_{EXTRA_FIELD_ID}"
+def prepare_jobs():
+    # przygotuj tylko to, co realnie wyślesz (bez braków w XML): połączenie SKU -> product_id -> ERP ID w rejestrze
+    jobs = list(registry.pairs(("sku", "product_id", "erp_id")))
+    listed = registry.count("product_id")
+    no_in_xml = listed - len(jobs)
+
+    print(f"START: do wysyłki {len(jobs)} / {listed} (brak w XML: {no_in_xml})")
+    return jobs, no_in_xml
+
+def log_progress(ok: int, total: int, sku_done: str, start_time: float):
+    elapsed = time.time() - start_time
+    rate = ok / elapsed * 60 if elapsed > 0 else 0
+
+    remaining = total - ok
+    eta_sec = remaining / (rate / 60) if rate > 0 else 0
+    eta = str(timedelta(seconds=int(eta_sec)))
 
-    # przygotuj tylko to, co realnie wyślesz (bez braków w XML)
-    jobs = []
-    no_in_xml = 0
-    for sku, inv_pid in listed_sku_to_id.items():
-        erp_id = xml_sku_to_erp.get(sku)
-        if not erp_id:
-            no_in_xml += 1
-            continue
-        jobs.append((sku, inv_pid, erp_id))
+    if ok % 10 == 0:
+        msg = f"[{ok}/{total}] ✔ SKU: {sku_done} | {int(rate)}/min | ETA: {eta}"
+        print(msg)
 
-    print(f"START: do wysyłki {len(jobs)} / {total_listed} (brak w XML: {no_in_xml})")
+        with open("update_erp.log", "a", encoding="utf-8") as f:
+            f.write(msg + "\n")
+
+def log_error(e: Exception):
+    err = f"❌ ERROR: {e}"
+    print(err)
+
+    with open("update_erp.log", "a", encoding="utf-8") as f:
+        f.write(err + "\n")
+
+def update_extra_fields_only_listed_parallel():
+    text_key = f"extra_field_{EXTRA_FIELD_ID}"
+    jobs, no_in_xml = prepare_jobs()
 
     ok = 0
     fail = 0
@@ -120,36 +126,63 @@ def update_extra_fields_only_listed_parallel(listed_sku_to_id, xml_sku_to_erp):
             try:
                 sku_done = fut.result()
                 ok += 1
+                log_progress(ok, len(jobs), sku_done, start_time)
+            except Exception as e:
+                fail += 1
+                log_error(e)
 
-                elapsed = time.time() - start_time
-                rate = ok / elapsed * 60 if elapsed > 0 else 0
 
-                remaining = len(jobs) - ok
-                eta_sec = remaining / (rate / 60) if rate > 0 else 0
-                eta = str(timedelta(seconds=int(eta_sec)))
+    print(f"KONIEC ✔  Zapisane: {ok} | Brak w XML: {no_in_xml} | Błędy: {fail}")
+    return fail
 
-                if ok % 10 == 0:
-                    msg = f"[{ok}/{len(jobs)}] ✔ SKU: {sku_done} | {int(rate)}/min | ETA: {eta}"
-                    print(msg)
+async def update_extra_fields_only_listed_async(inventory_id: int = INVENTORY_ID):
+    """Wersja asyncio: ASYNC_CONCURRENCY zapytań w locie bez puli wątków."""
+    from bl_async import AsyncBaseLinkerClient, run_bounded
 
-                    with open("update_erp.log", "a", encoding="utf-8") as f:
-                        f.write(msg + "\n")
+    text_key = f"extra_field_{EXTRA_FIELD_ID}"
+    jobs, no_in_xml = prepare_jobs()
 
-            except Exception as e:
-                fail += 1
-                err = f"❌ ERROR: {e}"
-                print(err)
+    counts = {"ok": 0, "fail": 0}
+    start_time = time.time()
 
-                with open("update_erp.log", "a", encoding="utf-8") as f:
-                    f.write(err + "\n")
+    async with AsyncBaseLinkerClient(API_URL, API_TOKEN, limiter, concurrency=ASYNC_CONCURRENCY, max_retries=MAX_RETRIES,
+                                     pause_fallback=PAUSE_DURATION, max_block_retries=MAX_BLOCK_RETRIES,
+                                     metrics=client.metrics) as async_client:
+        async def worker(job):
+            sku, inv_pid, erp_id = job
+            await async_client.call("addInventoryProduct", erp_params(inv_pid, erp_id, text_key, inventory_id),
+                                   lane="backfill")
+            return sku
+
+        def on_result(job, result):
+            if isinstance(result, Exception):
+                counts["fail"] += 1
+                log_error(result)
+            else:
+                counts["ok"] += 1
+                log_progress(counts["ok"], len(jobs), result, start_time)
 
+        await run_bounded(jobs, worker, ASYNC_CONCURRENCY, on_result)
+    async_client.report()
 
-    print(f"KONIEC ✔  Zapisane: {ok} | Brak w XML: {no_in_xml} | Błędy: {fail}")
+    print(f"KONIEC ✔  Zapisane: {counts['ok']} | Brak w XML: {no_in_xml} | Błędy: {counts['fail']}")
+    return counts["fail"]
 
 if __name__ == "__main__":
     if not API_TOKEN or not INVENTORY_ID or not XML_URL:
         raise SystemExit("Ustaw API_TOKEN, NEW_INVENTORY_ID oraz XML_URL w .env")
 
-    xml_sku_to_erp = fetch_xml_sku_to_erp()
-    listed_sku_to_id = load_sku_to_id_json("sku_to_id.json")
-    update_extra_fields_only_listed_parallel(listed_sku_to_id, xml_sku_to_erp)
+    sync_feed_to_registry()
+    listed_sku_to_id = load_sku_to_id()
+    if feed.already_pushed(fingerprint(listed_sku_to_id)):
+        print("Feed bez zmian od ostatniego udanego przebiegu – pomijam (--force-feed wymusza).")
+    else:
+        if USE_ASYNC:
+            failed = asyncio.run(update_extra_fields_only_listed_async())
+        else:
+            failed = update_extra_fields_only_listed_parallel()
+        if not failed:
+            feed.mark_pushed(fingerprint(listed_sku_to_id))
+    if not USE_ASYNC:  # w trybie asyncio zapytania idą przez aiohttp – raport w update_extra_fields_only_listed_async()
+        client.transport.report()
+    client.write_run_summary(METRICS_FILE)
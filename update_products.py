@@ -1,15 +1,21 @@
-import xml.etree.ElementTree as ET
-import requests
+import sys
 import time
 import json
 import logging
 import os
 from dotenv import load_dotenv
-from typing import List, Dict
-from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import urlparse
-import threading
-from collections import deque
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+from bl_limiter import create_limiter
+from bl_client import BaseLinkerClient, HttpTransport, PermanentError
+from bl_metadata import MetadataCache
+from bl_feed import FeedError, decode_numbers, fingerprint
+from bl_snapshot import FeedStage
+from bl_records import StockRecord
+from bl_delta import Delta, PushState
+from bl_pipeline import run_pipeline
+from bl_sku_store import open_sku_store
+from bl_sku_index import load_sku_map
+from bl_registry import ProductRegistry
 
 
 load_dotenv()
@@ -24,8 +30,14 @@ BATCH_SIZE = 1000  # Optymalizacja dla 1000 produktów na zapytanie
 MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 5))  # Liczba równoległych wątków
 REQUESTS_PER_MINUTE = int(os.environ.get('REQUESTS_PER_MINUTE', 80))
 DEFAULT_TAX = 21
-SKU_TO_ID_FILE = "sku_to_id.json"  # Plik do przechowywania mapowania SKU -> product_id
+METRICS_FILE = "update_products.metrics.json"  # Podsumowanie wywołań API z przebiegu (obok logu)
 XML_URL = os.environ.get('XML_URL')  # URL do pliku XML
+PAUSE_DURATION = 360  # Pauza (s), gdy nie da się odczytać czasu blokady tokena
+MAX_BLOCK_RETRIES = 5  # Ile razy ponowić zapytanie po blokadzie tokena
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 4))  # Ponowienia po błędach sieci / 5xx (z losowym backoffem)
+RATE_BURST = int(os.environ.get('RATE_BURST', 1))  # Ile zapytań można wysłać od razu po bezczynności
+RATE_SHARE = float(os.environ.get('RATE_SHARE_UPDATE', 1.0))  # Udział tego joba we wspólnym budżecie tokena (0-1]
+STOCK_ONLY = "--stock-only" in sys.argv or os.environ.get('STOCK_ONLY', '0') == '1'  # Tylko stany (szybka ścieżka między pełnymi przebiegami)
 
 # Konfiguracja logowania
 logging.basicConfig(
@@ -36,83 +48,53 @@ logging.basicConfig(
 
 # Globalna zmienna do przechowywania bazy SKU-to-ID w pamięci
 sku_to_id_cache = {}
-
-class RateLimiter:
-    def __init__(self, per_minute: int):
-        self.per_minute = per_minute
-        self.lock = threading.Lock()
-        self.calls = deque()
-
-    def wait(self):
-        now = time.monotonic()
-        with self.lock:
-            while self.calls and now - self.calls[0] >= 60:
-                self.calls.popleft()
-
-            if len(self.calls) >= self.per_minute:
-                sleep_for = 60 - (now - self.calls[0])
-            else:
-                sleep_for = 0
-
-        if sleep_for > 0:
-            time.sleep(sleep_for)
-
-        with self.lock:
-            self.calls.append(time.monotonic())
+feed_errors = []  # produkty pominięte przez złe wartości liczbowe w feedzie
 
 SAFE_RPM = int(REQUESTS_PER_MINUTE * 0.95)  # np. 475
-limiter = RateLimiter(SAFE_RPM)
-
-thread_local = threading.local()
+limiter = create_limiter(SAFE_RPM, API_TOKEN, burst=RATE_BURST, share=RATE_SHARE)
 
-def get_session():
-    if not hasattr(thread_local, "session"):
-        thread_local.session = requests.Session()
-    return thread_local.session
+client = BaseLinkerClient(API_URL, API_TOKEN, limiter, transport=HttpTransport(pool_size=MAX_WORKERS),
+                          max_retries=MAX_RETRIES,
+                          pause_fallback=PAUSE_DURATION, max_block_retries=MAX_BLOCK_RETRIES)
+metadata = MetadataCache(client, API_TOKEN)
+push_state = PushState(f"{INVENTORY_ID}:{NEW_INVENTORY_ID}")  # ostatnio potwierdzone stany/ceny per SKU
+feed = FeedStage(XML_URL or "", "update_products")  # pobieranie warunkowe + wspólny snapshot + pomijanie niezmienionego feedu
+stock_feed = FeedStage(XML_URL or "", "update_stock")  # ten sam feed, osobne "wysłano" dla trybu --stock-only
+sku_store = open_sku_store(readonly=True)  # SKU -> product_id (SQLite albo JSON + dziennik, SKU_STORE_BACKEND), tylko odczyt
+registry = ProductRegistry()  # odwrotne wyszukiwanie product_id -> SKU dla odrzuconych pozycji
 
 
-
-def load_sku_to_id() -> Dict[str, str]:
-    """Ładuje mapowanie SKU -> product_id z pliku JSON."""
+def load_sku_to_id() -> Mapping[str, str]:
+    """Otwiera mapowanie SKU -> product_id: indeks mmap z bl_sku_index (przebudowany, gdy baza SKU się zmieniła)."""
     global sku_to_id_cache
-    if os.path.exists(SKU_TO_ID_FILE):
-        try:
-            with open(SKU_TO_ID_FILE, "r", encoding="utf-8") as f:
-                sku_to_id_cache = json.load(f)
-            logging.info(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-            print(f"Załadowano bazę SKU-to-ID z pliku: {len(sku_to_id_cache)} rekordów.")
-        except Exception as e:
-            logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
-            sku_to_id_cache = {}
+    try:
+        sku_to_id_cache = load_sku_map(sku_store)
+        registry.reconcile(sku_store)
+        logging.info(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+        print(f"Załadowano bazę SKU-to-ID: {len(sku_to_id_cache)} rekordów.")
+    except Exception as e:
+        logging.error(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
+        print(f"Błąd podczas ładowania bazy SKU-to-ID: {str(e)}")
+        sku_to_id_cache = {}
     return sku_to_id_cache
 
 def get_valid_storage_id() -> str:
     """Pobiera listę magazynów i sprawdza poprawność INVENTORY_ID."""
-    headers = {"X-BLToken": API_TOKEN}
-    params = {
-        "method": "getStoragesList",
-        "parameters": json.dumps({})
-    }
-    
     try:
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") != "SUCCESS":
-            logging.error(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            print(f"Błąd pobierania listy magazynów: {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            return None
-        
-        storages = response_data.get("storages", [])
-        for storage in storages:
-            if storage.get("storage_id") == INVENTORY_ID:
-                print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
-                return INVENTORY_ID
+        storage = metadata.find_storage(INVENTORY_ID)  # z cache metadanych (TTL), bez zapytania przy każdym starcie
+        if storage:
+            print(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            logging.info(f"Znaleziono poprawny magazyn: {storage.get('name')} (ID: {INVENTORY_ID})")
+            return INVENTORY_ID
         
+        storages = metadata.storages()
         logging.error(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         print(f"Nie znaleziono magazynu o ID {INVENTORY_ID}. Dostępne magazyny: {storages}")
         return None
+    except PermanentError as e:
+        logging.error(f"Błąd pobierania listy magazynów: {str(e)}")
+        print(f"Błąd pobierania listy magazynów: {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas pobierania listy magazynów: {str(e)}")
         print(f"Błąd podczas pobierania listy magazynów: {str(e)}")
@@ -120,17 +102,10 @@ def get_valid_storage_id() -> str:
 
 def get_category_id(inventory_id: str) -> str:
     """Pobiera listę kategorii BaseLinker i zwraca pierwszą dostępną lub 0."""
-    headers = {"X-BLToken": API_TOKEN}
-    params = {
-        "method": "getProductCatalogCategories",
-        "parameters": json.dumps({"storage_id": INVENTORY_ID, "inventory_id": inventory_id})
-    }
-    
     try:
-        response = requests.post(API_URL, headers=headers, data=params)
-        response_data = response.json()
-        if response_data.get("status") == "SUCCESS" and response_data.get("categories"):
-            category_id = str(response_data["categories"][0]["category_id"])
+        categories = metadata.categories(INVENTORY_ID, inventory_id)
+        if categories:
+            category_id = str(categories[0]["category_id"])
             print(f"Znaleziono domyślną kategorię: ID {category_id}")
             logging.info(f"Znaleziono domyślną kategorię: ID {category_id}")
             return category_id
@@ -143,99 +118,66 @@ def get_category_id(inventory_id: str) -> str:
         print(f"Błąd podczas pobierania kategorii: {str(e)}")
         return "0"
 
-def fetch_and_parse_xml() -> List[Dict]:
-    """Pobiera i parsuje plik XML z podanego URL lub ścieżki lokalnej."""
-    products = []
-    try:
-        if XML_URL.startswith("file://"):
-            # Lokalny plik
-            parsed = urlparse(XML_URL)
-            file_path = parsed.path
-            if os.name == 'nt' and file_path.startswith('/'):
-                file_path = file_path[1:]  # Usuń początkowy / dla Windows
-            with open(file_path, "r", encoding="utf-8") as f:
-                xml_content = f.read()
-        else:
-            # URL
-            response = requests.get(XML_URL)
-            response.raise_for_status()
-            xml_content = response.content.decode('utf-8')
-            xml_content = xml_content.lstrip('\ufeff')  # Usuń BOM jeśli występuje
-        
-        # Parsowanie XML
-        root = ET.fromstring(xml_content)
-        namespace = {"g": "http://base.google.com/ns/1.0"}
-        
-        for item in root.findall(".//item"):
-            # Parsowanie ceny
-            price_czk = float(item.find("g:price", namespace).text) if item.find("g:price", namespace) is not None else 0.0
-            
-            # Parsowanie dostępności (stan magazynu) - zawsze jest liczbą
-            quantity = int(item.find("g:availability", namespace).text) if item.find("g:availability", namespace) is not None else 0
-            
-            # Parsowanie GTIN - zawsze pojedynczy numer
-            gtin_el = item.find("g:gtin", namespace)
-            ean = (gtin_el.text or "").strip() if gtin_el is not None else ""
-
-            
-            # Parsowanie kategorii z NX_StockCategory
-            nx_stock_category = (item.find("NX_StockCategory").text if item.find("NX_StockCategory") is not None else "").strip()
-            category = nx_stock_category if nx_stock_category else item.find("g:product_type", namespace).text if item.find("g:product_type", namespace) is not None else ""
-            
-            # Parsowanie ERP ID z g:id (wewnętrzne ID z ERP) - MUSI być z namespace!
-            erp_id = (item.find("g:id", namespace).text if item.find("g:id", namespace) is not None else "").strip()
-            
-            # Parsowanie MPN (jako SKU)
-            mpn_el = item.find("g:mpn", namespace)
-            mpn = (mpn_el.text or "").strip() if mpn_el is not None else ""
-            
-            # Parsowanie tytułu - najpierw <title>, jeśli pusty to <description>
-            title_elem = item.find("title")
-            title = (title_elem.text if title_elem is not None and title_elem.text else "").strip()
-            if not title:
-                desc_elem = item.find("description")
-                title = (desc_elem.text if desc_elem is not None and desc_elem.text else "").strip()
-            
-            # Parsowanie marki
-            brand_el = item.find("g:brand", namespace)
-            brand = (brand_el.text or "").strip() if brand_el is not None else ""
-            
-            # Formatowanie nazwy w formacie: g:mpn g:title
-            formatted_name = f"{mpn} {title}".strip() if mpn and title else (mpn or title or "Unknown Product")
-            
-            product = {
-                "sku": mpn,
-                "name": formatted_name,
-                "quantity": quantity,
-                "price_brutto": round(price_czk, 2),  # Cena już w CZK, zaokrąglona do 2 miejsc
-                "ean": ean,
-                "man_name": brand,
-                "description": item.find("g:description", namespace).text if item.find("g:description", namespace) is not None else "",
-                "category": category,
-                "erp_id": erp_id
-            }
-            # Walidacja nazwy produktu
-            if not product["name"] or len(product["name"].strip()) < 3:
-                product["name"] = product["sku"] or "Unknown Product"
-                logging.warning(f"Nieprawidłowa nazwa produktu dla SKU {product['sku']}, użyto: {product['name']}")
-                print(f"Nieprawidłowa nazwa produktu dla SKU {product['sku']}, użyto: {product['name']}")
-            
-            products.append(product)
-        
-        print(f"Pomyślnie sparsowano {len(products)} produktów z XML online (ceny w CZK).")
-        return products
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Błąd podczas pobierania XML z URL {XML_URL}: {str(e)}")
-        print(f"Błąd podczas pobierania XML z URL {XML_URL}: {str(e)}")
-        return []
-    except ET.ParseError as e:
-        logging.error(f"Błąd podczas parsowania XML: {str(e)}")
-        print(f"Błąd podczas parsowania XML: {str(e)}")
-        return []
-
-def update_product_quantity_in_baselinker(products: List[Dict], storage_id: str, sku_to_id: Dict[str, str], inventory_id: str) -> bool:
-    """Aktualizuje stany produktów w BaseLinker przez API."""
-    headers = {"X-BLToken": API_TOKEN}
+def iter_feed_products(stats: Dict) -> Iterator[StockRecord]:
+    """Strumień produktów z feedu (sku, stan, cena) – czytany w tempie wysyłki, bez listy całego feedu.
+
+    Niezmieniony feed jest czytany ze wspólnego snapshotu. `stats["total"]` liczy
+    produkty, a `stats["skipped"]` mówi, że ten feed był już w całości wysłany.
+    Błąd pobierania/parsowania to FeedError.
+    """
+    for row in feed.iter_rows():
+        stats["total"] += 1
+        # wersja feedu jest znana od pierwszego produktu przy 304 / snapshocie / pliku lokalnym
+        if stats["total"] == 1 and feed.already_pushed(fingerprint(sku_to_id_cache)):
+            stats["skipped"] = True
+            return
+        # Cena i stan - zła wartość pomija tylko ten produkt, nie cały feed
+        numbers, errors = decode_numbers(row)
+        if errors:
+            feed_errors.append({"sku": (row["mpn"] or "").strip(), "errors": errors})
+            logging.warning(f"Pominięto SKU {row['mpn']}: nieprawidłowe wartości w feedzie {', '.join(errors)}")
+            continue
+        # Aktualizacja wysyła tylko stan i cenę - nazwa, opis, EAN itd. nie są tu potrzebne
+        yield StockRecord(
+            sku=(row["mpn"] or "").strip(),
+            quantity=numbers["availability"],
+            price_brutto=round(numbers["price"], 2),  # Cena już w CZK, zaokrąglona do 2 miejsc
+        )
+
+
+def iter_stock_products(stats: Dict) -> Iterator[StockRecord]:
+    """Jak iter_feed_products(), ale tylko g:mpn i g:availability (skaner trybu --stock-only, bez cen)."""
+    for mpn, availability in stock_feed.iter_stock():
+        stats["total"] += 1
+        if stats["total"] == 1 and stock_feed.already_pushed(fingerprint(sku_to_id_cache)):
+            stats["skipped"] = True
+            return
+        sku = (mpn or "").strip()
+        if sku not in sku_to_id_cache:
+            continue
+        numbers, errors = decode_numbers({"availability": availability})
+        if errors:
+            feed_errors.append({"sku": sku, "errors": errors})
+            logging.warning(f"Pominięto SKU {sku}: nieprawidłowe wartości w feedzie {', '.join(errors)}")
+            continue
+        yield StockRecord(sku=sku, quantity=numbers["availability"], price_brutto=None)
+
+
+def rejected_ids(response_data: Dict) -> Set[str]:
+    """product_id z "warnings" odpowiedzi zbiorczej – pozycje, których API nie przyjęło."""
+    warnings = response_data.get("warnings") or {}
+    if not isinstance(warnings, dict):
+        return set()
+    for product_id, message in warnings.items():
+        logging.warning(f"API odrzuciło product_id={product_id} (SKU {registry.sku_for(product_id) or '?'}): {message}")
+    return {str(product_id) for product_id in warnings}
+
+
+def update_product_quantity_in_baselinker(products: List[StockRecord], storage_id: str, sku_to_id: Mapping[str, str], inventory_id: str) -> Optional[Set[str]]:
+    """Aktualizuje stany produktów w BaseLinker przez API.
+
+    Zwraca product_id odrzucone przez API (pusty zbiór = wszystko przyjęte) albo None przy błędzie partii.
+    """
     formatted_products = []
     
     for product in products:
@@ -245,38 +187,29 @@ def update_product_quantity_in_baselinker(products: List[Dict], storage_id: str,
             print(f"Aktualizacja stanu produktu: SKU={product['sku']}, Product ID={product_id}, Stan={product['quantity']}")
     
     if not formatted_products:
-        return True  # Brak produktów do aktualizacji
+        return set()  # Brak produktów do aktualizacji
     
     params = {
-        "method": "updateProductsQuantity",
-        "parameters": json.dumps({
-            "storage_id": storage_id,
-            "inventory_id": inventory_id,  # Użycie nowego katalogu
-            "products": formatted_products
-        }, ensure_ascii=False)
+        "storage_id": storage_id,
+        "inventory_id": inventory_id,  # Użycie nowego katalogu
+        "products": formatted_products
     }
     
     try:
-        limiter.wait()
-        session = get_session()
-        response = session.post(API_URL, headers=headers, data=params, timeout=60)
-        response_data = response.json()
-        
-        if response_data.get("status") == "SUCCESS":
-            print(f"Pomyślnie zaktualizowano stany {len(formatted_products)} produktów.")
-            return True
-        else:
-            logging.error(f"Błąd API (updateInventoryProductsStock): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            print(f"Błąd API (updateInventoryProductsStock): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            return False
+        response_data = client.call("updateProductsQuantity", params)
+        print(f"Pomyślnie zaktualizowano stany {len(formatted_products)} produktów.")
+        return rejected_ids(response_data)
+    except PermanentError as e:
+        logging.error(f"Błąd API (updateInventoryProductsStock): {str(e)}")
+        print(f"Błąd API (updateInventoryProductsStock): {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas wysyłania żądania (updateInventoryProductsStock): {str(e)}")
         print(f"Błąd podczas wysyłania żądania (updateInventoryProductsStock): {str(e)}")
-        return False
+        return None
 
-def update_product_prices_in_baselinker(products: List[Dict], storage_id: str, sku_to_id: Dict[str, str], inventory_id: str) -> bool:
-    """Aktualizuje ceny produktów w BaseLinker przez API (ceny w CZK)."""
-    headers = {"X-BLToken": API_TOKEN}
+def update_product_prices_in_baselinker(products: List[StockRecord], storage_id: str, sku_to_id: Mapping[str, str], inventory_id: str) -> Optional[Set[str]]:
+    """Aktualizuje ceny produktów w BaseLinker przez API (ceny w CZK); wynik jak w update_product_quantity_in_baselinker."""
     formatted_products = []
     
     for product in products:
@@ -293,47 +226,131 @@ def update_product_prices_in_baselinker(products: List[Dict], storage_id: str, s
             formatted_products.append(formatted_product)
     
     if not formatted_products:
-        return True  # Brak produktów do aktualizacji
+        return set()  # Brak produktów do aktualizacji
     
     params = {
-        "method": "updateProductsPrices",
-        "parameters": json.dumps({
-            "storage_id": storage_id,
-            "inventory_id": inventory_id,  # Użycie nowego katalogu
-            "products": formatted_products
-        }, ensure_ascii=False)
+        "storage_id": storage_id,
+        "inventory_id": inventory_id,  # Użycie nowego katalogu
+        "products": formatted_products
     }
     
     try:
-        limiter.wait()
-        session = get_session()
-        response = session.post(API_URL, headers=headers, data=params, timeout=60)
-
-        response_data = response.json()
-        
-        if response_data.get("status") == "SUCCESS":
-            return True
-        else:
-            logging.error(f"Błąd API (updateInventoryProductsPrices): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            print(f"Błąd API (updateInventoryProductsPrices): {response_data.get('error_message', 'Brak szczegółów błędu')}")
-            return False
+        response_data = client.call("updateProductsPrices", params)
+        return rejected_ids(response_data)
+    except PermanentError as e:
+        logging.error(f"Błąd API (updateInventoryProductsPrices): {str(e)}")
+        print(f"Błąd API (updateInventoryProductsPrices): {str(e)}")
+        return None
     except Exception as e:
         logging.error(f"Błąd podczas wysyłania żądania (updateInventoryProductsPrices): {str(e)}")
         print(f"Błąd podczas wysyłania żądania (updateInventoryProductsPrices): {str(e)}")
-        return False
+        return None
 
 
-def process_batch(batch: List[Dict], storage_id: str, sku_to_id: Dict[str, str], inventory_id: str):
-    existing_products = [p for p in batch if p["sku"] in sku_to_id]
+UPDATERS = {
+    "quantity": update_product_quantity_in_baselinker,
+    "price": update_product_prices_in_baselinker,
+}
 
-    if not existing_products:
-        return (True, [])  # nic do roboty, ale batch "ok"
 
-    success_quantity = update_product_quantity_in_baselinker(existing_products, storage_id, sku_to_id, inventory_id)
-    success_prices   = update_product_prices_in_baselinker(existing_products, storage_id, sku_to_id, inventory_id)
+def change_batches(changes: Iterable) -> Iterator[Tuple[str, List[StockRecord]]]:
+    """Batcher: strumień (kind, produkt, product_id) -> partie po BATCH_SIZE osobno dla stanów i cen."""
+    batches = {"quantity": [], "price": []}
+    for kind, product, _ in changes:
+        batch = batches[kind]
+        batch.append(product)
+        if len(batch) >= BATCH_SIZE:
+            yield kind, batch
+            batches[kind] = []
+    for kind, batch in batches.items():
+        if batch:
+            yield kind, batch
 
-    success = success_quantity and success_prices
-    return (success, existing_products)
+
+def commit_batch(kind: str, batch: List[StockRecord], rejected: Set[str], sku_to_id: Mapping[str, str]):
+    """Zapisuje w stanie delty pozycje partii przyjęte przez BaseLinker."""
+    accepted = [(p, sku_to_id[p["sku"]]) for p in batch if str(sku_to_id[p["sku"]]) not in rejected]
+    if kind == "quantity":
+        push_state.commit_quantities((p["sku"], product_id, p["quantity"]) for p, product_id in accepted)
+    else:
+        push_state.commit_prices(
+            (p["sku"], product_id, p["price_brutto"], DEFAULT_TAX, PRICE_GROUP_ID) for p, product_id in accepted
+        )
+
+
+def push_changes(changes: Iterable, storage_id: str, failed_products: Dict[str, StockRecord]) -> int:
+    """Pipeline: zmiany -> batcher -> ograniczona kolejka -> MAX_WORKERS wątków wysyłki.
+
+    Partie są wysyłane już w trakcie czytania feedu, a w pamięci jest tylko kilka
+    z nich. Po każdej partii stan delty zapisuje pozycje potwierdzone przez
+    BaseLinker; nieudane trafiają do `failed_products` (SKU -> produkt).
+    Zwraca liczbę wysłanych partii.
+    """
+    sent = {"batches": 0}
+
+    def worker(job):
+        kind, batch = job
+        return UPDATERS[kind](batch, storage_id, sku_to_id_cache, NEW_INVENTORY_ID)
+
+    def on_result(job, rejected):
+        kind, batch = job
+        if isinstance(rejected, Exception):
+            logging.error(f"Błąd partii ({kind}): {str(rejected)}")
+            rejected = None
+        if rejected is None:
+            rejected = {str(sku_to_id_cache[p["sku"]]) for p in batch}
+        # stan zapisujemy tylko dla pozycji potwierdzonych - reszta pójdzie ponownie w następnym przebiegu
+        commit_batch(kind, batch, rejected, sku_to_id_cache)
+        for p in batch:
+            if str(sku_to_id_cache[p["sku"]]) in rejected:
+                failed_products[p["sku"]] = p
+        sent["batches"] += 1
+        # progress do GUI (co batch)
+        print(f"[{sent['batches']}] UPDATE batch done ({kind}, {len(batch)} produktów)")
+
+    run_pipeline(change_batches(changes), worker, MAX_WORKERS, on_result)
+    return sent["batches"]
+
+
+def run_update(products: Iterator[StockRecord], stats: Dict, storage_id: str, prices: bool, target: FeedStage,
+               label: str) -> None:
+    """Wspólny przebieg obu trybów: delta -> pipeline wysyłki -> rozliczenie stanu i nieudanych."""
+    delta = Delta()
+    changes = push_state.changes(products, sku_to_id_cache, delta, DEFAULT_TAX, PRICE_GROUP_ID, prices=prices)
+    failed_products = {}
+    started = time.time()
+    print(f"START {label}: wysyłka partii w trakcie czytania feedu (partie po {BATCH_SIZE})")
+    try:
+        batches = push_changes(changes, storage_id, failed_products)
+    except FeedError as e:
+        logging.error(str(e))
+        print(str(e))
+        print("Przerwano czytanie feedu - wysłane partie zapisano w stanie, reszta pójdzie w następnym przebiegu.")
+        if failed_products:
+            save_failed_products(failed_products)
+        return
+
+    if stats["skipped"]:
+        logging.info(f"Feed bez zmian od ostatniego udanego przebiegu ({label}) – pomijam przebieg.")
+        print("Feed bez zmian od ostatniego udanego przebiegu – pomijam przebieg (--force-feed wymusza).")
+        return
+    if not stats["total"]:
+        logging.error("Brak produktów do przetworzenia.")
+        print("Brak produktów do przetworzenia. Sprawdź URL XML Lub jego składnię.")
+        return
+    if feed_errors:
+        print(f"Pominięto {len(feed_errors)} produktów z nieprawidłowymi wartościami w feedzie (szczegóły w logu).")
+    logging.info(f"Delta feedu ({label}): {delta.summary()} | {batches} partii w {time.time() - started:.1f} s")
+    print(f"Przeczytano {stats['total']} produktów. Delta feedu: {delta.summary()} | {batches} partii")
+    if prices:
+        push_state.forget(delta.removed)  # tylko pełny przebieg zna cały zestaw wysyłanych SKU
+
+    # Zapisanie nieudanych produktów do osobnego pliku
+    if failed_products:
+        save_failed_products(failed_products)
+    else:
+        print("Wszystkie produkty zaktualizowano pomyślnie!")
+        target.mark_pushed(fingerprint(sku_to_id_cache))
 
 
 def update_products_from_xml():
@@ -350,50 +367,40 @@ def update_products_from_xml():
     
     # Pobieranie kategorii dla nowego katalogu
     get_category_id(NEW_INVENTORY_ID)
-    
-    # Parsowanie XML z URL
-    products = fetch_and_parse_xml()
-    if not products:
-        logging.error("Brak produktów do przetworzenia.")
-        print("Brak produktów do przetworzenia. Sprawdź URL XML Lub jego składnię.")
-        return
-    
-    # Podział na partie
-    batches = [products[i:i + BATCH_SIZE] for i in range(0, len(products), BATCH_SIZE)]
-    logging.info(f"Podzielono na {len(batches)} partii po {BATCH_SIZE} produktów.")
-    print(f"Podzielono na {len(batches)} partii po {BATCH_SIZE} produktów.")
-    print(f"START UPDATE: {len(products)} produktów | {len(batches)} batchy")
 
+    # Strumień: parser -> delta -> batcher -> kolejka -> wątki; bez listy produktów ani partii w pamięci
+    stats = {"total": 0, "skipped": False}
+    run_update(iter_feed_products(stats), stats, storage_id, prices=True, target=feed, label="UPDATE")
 
-    
-    failed_products = []
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [
-            executor.submit(process_batch, batch, storage_id, sku_to_id_cache, NEW_INVENTORY_ID)
-            for batch in batches
-        ]
+def sync_stock():
+    """Tryb --stock-only: tylko stany, tylko zmienione od ostatniego wysłania, tylko updateProductsQuantity.
 
-        total_batches = len(futures)
+    Feed jest skanowany wyłącznie pod g:mpn i g:availability (bez pełnego
+    parsowania i bez cen), więc przebieg jest na tyle tani, że można go puszczać
+    co kilka minut między pełnymi aktualizacjami.
+    """
+    load_sku_to_id()
+    storage_id = get_valid_storage_id()
+    if not storage_id:
+        logging.error("Nie można kontynuować: nieprawidłowy ID magazynu.")
+        print("Nie można kontynuować: nieprawidłowy ID magazynu. Sprawdź API_TOKEN i INVENTORY_ID.")
+        return
 
-        for i, fut in enumerate(futures, start=1):
-            success, processed_batch = fut.result()
-            if not success:
-                failed_products.extend(processed_batch)
+    stats = {"total": 0, "skipped": False}
+    run_update(iter_stock_products(stats), stats, storage_id, prices=False, target=stock_feed, label="STOCK")
 
-            # progress do GUI (co batch)
-            if i % 1 == 0:  # możesz dać np. 2 lub 5 jeśli chcesz mniej printów
-                print(f"[{i}/{total_batches}] UPDATE batch done")
 
-    
-    # Zapisanie nieudanych produktów do osobnego pliku
-    if failed_products:
-        with open("failed_products_update.json", "w", encoding="utf-8") as f:
-            json.dump(failed_products, f, ensure_ascii=False, indent=2)
-        logging.warning(f"Nieudane produkty zapisano do failed_products_update.json ({len(failed_products)} produktów).")
-        print(f"Nieudane produkty zapisano do failed_products_update.json ({len(failed_products)} produktów).")
-    else:
-        print("Wszystkie produkty zaktualizowano pomyślnie!")
+def save_failed_products(failed_products: Dict[str, StockRecord]):
+    with open("failed_products_update.json", "w", encoding="utf-8") as f:
+        json.dump([product.to_dict() for product in failed_products.values()], f, ensure_ascii=False, indent=2)
+    logging.warning(f"Nieudane produkty zapisano do failed_products_update.json ({len(failed_products)} produktów).")
+    print(f"Nieudane produkty zapisano do failed_products_update.json ({len(failed_products)} produktów).")
 
 if __name__ == "__main__":
-    update_products_from_xml()
\ No newline at end of file
+    if STOCK_ONLY:
+        sync_stock()
+    else:
+        update_products_from_xml()
+    client.transport.report()
+    client.write_run_summary(METRICS_FILE)
\ No newline at end of file